@@ -0,0 +1,432 @@
+# A script to benchmark the rendering pipeline on synthetic models, so that the effect of a Blender version, engine,
+# worker count or view count can be measured and compared with a stored baseline.
+#
+# The models are generated from a fixed seed: spheres with a controlled number of triangles (e.g. 1k to 1M), with or
+# without a texture, with the .mtl files and the metadata file laid out as in ShapeNetSem. The stages are:
+#   generate:   generate_commands.py over a metadata file with --metadata_rows rows (rows/s)
+#   fix:        fix_shapenetsem.py over --mtl_files .mtl files, first run and idempotent re-run (files/s)
+#   projection: build of the projection factor map, without and with the cache
+#   depth:      render_depth_numpy.py for every model size (views/s)
+#   render:     render_blender_parallel.py with Blender, for every engine, quality profile, worker count, view count
+#               and model size (models/hour, the seconds per view and the per-phase percentiles of the run report,
+#               and the RGB and depth error against the renders of the reference profile). Only with --blender.
+# Every stage but render runs on a plain CPU-only machine with numpy and pandas.
+#
+# Usage: python benchmark.py --output results.json
+# Usage: python benchmark.py --blender /path/to/blender --engines BLENDER_EEVEE,CYCLES --workers 1,4 --output results.json --baseline baseline.json
+# Usage: python benchmark.py --blender /path/to/blender --stages render --profiles fast,balanced,reference --output profiles.json
+#
+# Usage: python benchmark.py --smoke 1 --output /tmp/smoke.json
+# runs every stage once on tiny inputs (a few seconds), as a quick check after changing the scripts it calls.
+#
+# The results file has the environment (machine, Python, numpy, Blender versions) and, for every benchmark and set of
+# parameters, the latencies of every repetition with their p50/p95/p99 and the throughput. With --baseline, the results
+# are compared with a previous results file, and the script exits with code 1 when a p50 latency or a throughput
+# regressed by more than --tolerance.
+#
+# Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
+
+import argparse, json, os, platform, shutil, subprocess, sys, tempfile, time
+import numpy as np
+import pandas as pd
+
+import fix_shapenetsem, generate_commands, render_blender_parallel, render_depth_numpy, rgbd_camera, rgbd_io
+
+def sphere_mesh(faces):
+    # Vertices, texture coordinates and triangles of a UV sphere of radius 1 with about the given number of triangles
+    n = max(2, int(round(np.sqrt(faces / 2.0))))
+    latitude = np.linspace(0.0, np.pi, n + 1)
+    longitude = np.linspace(0.0, 2.0 * np.pi, n, endpoint=False)
+    lat, lon = np.meshgrid(latitude, longitude, indexing='ij')
+    vertices = np.stack((np.sin(lat) * np.cos(lon), np.cos(lat), np.sin(lat) * np.sin(lon)), axis=-1).reshape(-1, 3)
+    uvs = np.stack((lon / (2.0 * np.pi), 1.0 - lat / np.pi), axis=-1).reshape(-1, 2)
+    i, j = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    a = i * n + j
+    b = i * n + (j + 1) % n
+    c = a + n
+    d = b + n
+    triangles = np.concatenate((np.stack((a, c, d), axis=-1).reshape(-1, 3), np.stack((a, d, b), axis=-1).reshape(-1, 3)))
+    return vertices, uvs, triangles
+
+def write_model(directory, name, faces, textured, rng):
+    # Write <name>.obj and <name>.mtl (and <name>.png when textured), with the inverted "d" values of ShapeNetSem
+    vertices, uvs, triangles = sphere_mesh(faces)
+    # Perturb the radius a little, so that the mesh is not trivially smooth
+    vertices *= 1.0 + 0.02 * rng.standard_normal((len(vertices), 1))
+    with open(os.path.join(directory, name + '.mtl'), 'w') as file:
+        file.write('newmtl material_0\nKa 0.2 0.2 0.2\nKd 0.8 0.6 0.4\nKs 0.1 0.1 0.1\nd 0.0\n')
+        if textured:
+            file.write('map_Kd {}.png\n'.format(name))
+    if textured:
+        texture = (rng.random((1024, 1024, 3)) * 255).astype(np.uint8)
+        rgbd_io.write_png(os.path.join(directory, name + '.png'), texture)
+
+    with open(os.path.join(directory, name + '.obj'), 'w') as file:
+        file.write('mtllib {}.mtl\nusemtl material_0\n'.format(name))
+        np.savetxt(file, vertices, fmt='v %.6f %.6f %.6f')
+        indices = triangles + 1
+        if textured:
+            np.savetxt(file, uvs, fmt='vt %.6f %.6f')
+            np.savetxt(file, np.repeat(indices, 2, axis=1), fmt='f %d/%d %d/%d %d/%d')
+        else:
+            np.savetxt(file, indices, fmt='f %d %d %d')
+    return len(triangles)
+
+def write_metadata(filepath, names, rows):
+    # ShapeNetSem metadata for the models, repeated up to the given number of rows. The spheres have a radius of
+    # 1 unit and the unit is 0.25 m, so their aligned dimensions are 50 cm.
+    names = [names[i % len(names)] for i in range(rows)]
+    metadata = pd.DataFrame({'fullId': ['wss.' + name for name in names], 'up': '0\\,1\\,0', 'front': '0\\,0\\,1',
+                             'unit': 0.25, 'aligned.dims': '50.0\\,50.0\\,50.0'})
+    metadata.to_csv(filepath, index=False)
+
+def summarize(benchmark, params, latencies, items=1, unit='items'):
+    # A results entry: the latency of every repetition, its percentiles and the throughput in items per second
+    latencies = [float(latency) for latency in latencies]
+    return {'benchmark': benchmark, 'params': params, 'latencies': latencies,
+            'p50': render_blender_parallel.percentile(latencies, 50), 'p95': render_blender_parallel.percentile(latencies, 95),
+            'p99': render_blender_parallel.percentile(latencies, 99),
+            'throughput': items * len(latencies) / sum(latencies) if sum(latencies) > 0 else None, 'unit': unit + '/s'}
+
+def timed_runs(function, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def quiet(function, *args, **kwargs):
+    # Run a function of the pipeline without its progress prints
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return function(*args, **kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def benchmark_generate(work_folder, obj_folder, names, rows, repeat):
+    metadata_path = os.path.join(work_folder, 'metadata.csv')
+    write_metadata(metadata_path, names, rows)
+    output_folder = os.path.join(work_folder, 'outputs')
+
+    def run():
+        manifest = generate_commands.build_manifest(pd.read_csv(metadata_path), obj_folder, output_folder)
+        generate_commands.to_commands(manifest, 'render_blender.py')
+        generate_commands.to_jsonl(manifest)
+    return [summarize('generate', {'rows': rows}, timed_runs(run, repeat), rows, 'rows')]
+
+def benchmark_fix(work_folder, mtl_files, repeat):
+    source_folder = os.path.join(work_folder, 'mtl')
+    os.makedirs(source_folder, exist_ok=True)
+    for i in range(mtl_files):
+        with open(os.path.join(source_folder, 'model{:06d}.mtl'.format(i)), 'w') as file:
+            file.write('newmtl material_0\nKa 0.2 0.2 0.2\nKd 0.8 0.6 0.4\nd 0.0\n' * 8)
+
+    first_runs = []
+    reruns = []
+    for _ in range(repeat):
+        output_folder = os.path.join(work_folder, 'mtl_fixed')
+        shutil.rmtree(output_folder, ignore_errors=True)
+        first_runs += timed_runs(lambda: quiet(fix_shapenetsem.fix_directory, source_folder, output_folder), 1)
+        reruns += timed_runs(lambda: quiet(fix_shapenetsem.fix_directory, source_folder, output_folder), 1)
+    return [summarize('fix', {'files': mtl_files, 'run': 'first'}, first_runs, mtl_files, 'files'),
+            summarize('fix', {'files': mtl_files, 'run': 'rerun'}, reruns, mtl_files, 'files')]
+
+def benchmark_projection(work_folder, repeat):
+    results = []
+    cache_folder = os.path.join(work_folder, 'projection_cache')
+    for width, height in ((640, 480), (1280, 960)):
+        params = (width, height, rgbd_camera.FX, rgbd_camera.FY, width / 2, height / 2, 'CYCLES')
+        latencies = timed_runs(lambda: rgbd_camera.projection_factor_rgba(*params), repeat)
+        results.append(summarize('projection', {'width': width, 'height': height, 'cache': False}, latencies, 1, 'maps'))
+        rgbd_camera.cached_projection_factor_rgba(cache_folder, *params)
+        latencies = timed_runs(lambda: rgbd_camera.cached_projection_factor_rgba(cache_folder, *params), repeat)
+        results.append(summarize('projection', {'width': width, 'height': height, 'cache': True}, latencies, 1, 'maps'))
+    return results
+
+def benchmark_depth(work_folder, models, views, repeat):
+    results = []
+    options = {'up': '0\\,1\\,0', 'front': '0\\,0\\,1', 'unit': 0.25, 'aligned_dims': '50\\,50\\,50', 'views': views,
+               'camera_angle': 30, 'canonical_views': True, 'viewpoints': 'turntable', 'elevations': [0, 30, 60],
+               'viewpoint_count': 50, 'pose_file': None, 'model_distance_scale': 2.1,
+               'output_folder': os.path.join(work_folder, 'depth'), 'width': rgbd_camera.IMAGE_WIDTH,
+               'height': rgbd_camera.IMAGE_HEIGHT, 'fx': rgbd_camera.FX, 'fy': rgbd_camera.FY,
+               'ox': rgbd_camera.IMAGE_WIDTH / 2, 'oy': rgbd_camera.IMAGE_HEIGHT / 2, 'exr_compression': 'ZIP',
+               'depth_format': 'exr_rgb', 'depth_precision': 'full', 'depth_invalid_value': 0, 'compare_folder': None}
+    view_count = views + len(rgbd_camera.CANONICAL_VIEWS)
+    for model in models:
+        latencies = timed_runs(lambda: render_depth_numpy.render_model({'obj': model['obj']}, options), repeat)
+        results.append(summarize('depth', {'faces': model['faces'], 'textured': model['textured'], 'views': views},
+                                 latencies, view_count, 'views'))
+    return results
+
+def blender_version(blender):
+    try:
+        output = subprocess.run([blender, '--version'], capture_output=True, text=True, timeout=120).stdout
+        return output.strip().splitlines()[0] if output.strip() else None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def render_error(folder, reference_folder):
+    # Mean absolute difference between the renders of two runs of the same models: the RGB of the .png files (0 to 255,
+    # over the pixels covered in either image) and the depth maps (meters, over the pixels with depth in both)
+    rgb_errors = []
+    depth_errors = []
+    for root, _, filenames in os.walk(reference_folder):
+        for filename in filenames:
+            reference_path = os.path.join(root, filename)
+            filepath = os.path.join(folder, os.path.relpath(reference_path, reference_folder))
+            if not os.path.exists(filepath):
+                continue
+            if filename.endswith('_depth0001.exr'):
+                depth = rgbd_io.read_depth(filepath)
+                reference = rgbd_io.read_depth(reference_path)
+                mask = (depth > 0) & (reference > 0)
+                if mask.any():
+                    depth_errors.append(float(np.abs(depth[mask] - reference[mask]).mean()))
+            elif filename.endswith('.png'):
+                rgba = rgbd_io.read_png(filepath).astype(np.float64)
+                reference = rgbd_io.read_png(reference_path).astype(np.float64)
+                mask = (rgba[..., 3] > 0) | (reference[..., 3] > 0)
+                if mask.any():
+                    rgb_errors.append(float(np.abs(rgba[..., :3][mask] - reference[..., :3][mask]).mean()))
+    if not rgb_errors:
+        return None
+    return {'rgb': float(np.mean(rgb_errors)), 'depth': float(np.mean(depth_errors)) if depth_errors else None}
+
+def benchmark_render(work_folder, blender, models, engines, workers, view_counts, repeat, timeout, profiles=('default',)):
+    # Render every model with the parallel runner, once per combination of engine, profile, worker count and view count.
+    # With the reference profile, the error of the renders of every profile against it is also recorded.
+    results = []
+    result_folders = []
+    render_blender_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'render_blender.py')
+    for engine, profile in [(engine, profile) for engine in engines for profile in profiles]:
+        for max_workers in workers:
+            for views in view_counts:
+                for model in models:
+                    latencies = []
+                    view_latencies = []
+                    phases = {}
+                    wall_time = 0.0
+                    for repetition in range(repeat):
+                        run_folder = os.path.join(work_folder, 'render', '{}_{}_{}_{}_{}_{}'.format(
+                            engine, profile, max_workers, views, model['name'], repetition))
+                        shutil.rmtree(run_folder, ignore_errors=True)
+                        os.makedirs(run_folder)
+                        # One command per worker, so that the worker count matters
+                        manifest = pd.DataFrame({'obj': [model['obj']] * max_workers, 'up': '0\\,1\\,0', 'front': '0\\,0\\,1',
+                                                 'unit': 0.25, 'aligned_dims': '50.0\\,50.0\\,50.0', 'cost': model['faces']})
+                        manifest['output_folder'] = [os.path.join(run_folder, 'out{}'.format(i)) for i in range(max_workers)]
+                        commands = generate_commands.to_commands(manifest, '"{}"'.format(render_blender_path),
+                                                                 '--engine {} --profile {} --views {}'.format(engine, profile, views))
+                        commands_file = os.path.join(run_folder, 'commands.txt')
+                        with open(commands_file, 'w') as file:
+                            file.writelines('"{}"{}'.format(blender, command[len('blender'):]) for command in commands)
+                        start = time.perf_counter()
+                        quiet(render_blender_parallel.execute_commands_in_parallel, commands_file, max_workers,
+                              max_attempts=1, timeout=timeout)
+                        wall_time += time.perf_counter() - start
+                        for record in render_blender_parallel.read_stats(commands_file + '.stats.jsonl'):
+                            if record['status'] == 'done':
+                                latencies.append(record['duration'])
+                                view_latencies += record.get('views', [])
+                                for phase, seconds in record['phases'].items():
+                                    phases.setdefault(phase, []).append(seconds)
+                    if not latencies:
+                        print('No model rendered with {} and {} workers, check the Blender installation'.format(engine, max_workers))
+                        continue
+                    params = {'engine': engine, 'workers': max_workers, 'views': views, 'faces': model['faces'],
+                              'textured': model['textured']}
+                    if profile != 'default':
+                        # Left out for the default profile, so that the results compare with the older baselines
+                        params['profile'] = profile
+                    result = summarize('render', params, latencies, 1, 'models')
+                    # The models render at the same time, so the throughput comes from the wall-clock time of the runs
+                    result['throughput'] = len(latencies) / wall_time
+                    if view_latencies:
+                        result['view_seconds'] = {'p50': render_blender_parallel.percentile(view_latencies, 50),
+                                                  'p95': render_blender_parallel.percentile(view_latencies, 95)}
+                    result['phases'] = {phase: {'p50': render_blender_parallel.percentile(values, 50),
+                                                'p95': render_blender_parallel.percentile(values, 95)}
+                                        for phase, values in phases.items()}
+                    results.append(result)
+                    result_folders.append((engine, profile, max_workers, views, model['name']))
+
+    # The first repetition of every profile is compared with the first repetition of the reference profile
+    def first_run(engine, profile, max_workers, views, name):
+        return os.path.join(work_folder, 'render', '{}_{}_{}_{}_{}_0'.format(engine, profile, max_workers, views, name))
+    for result, (engine, profile, max_workers, views, name) in zip(results, result_folders):
+        if 'reference' in profiles and profile != 'reference':
+            error = render_error(first_run(engine, profile, max_workers, views, name),
+                                 first_run(engine, 'reference', max_workers, views, name))
+            if error is not None:
+                result['error'] = error
+    return results
+
+def environment(blender):
+    return {'platform': platform.platform(), 'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'blender': None if blender is None else blender_version(blender), 'time': time.time()}
+
+def profile_table(results):
+    # Markdown table of the seconds per view of every engine and quality profile, with their error against the
+    # reference profile (the largest over the models), for the README
+    rows = {}
+    for result in results['results']:
+        if result['benchmark'] == 'render' and 'view_seconds' in result:
+            key = (result['params']['engine'], result['params'].get('profile', 'default'))
+            rows.setdefault(key, []).append(result)
+    if not rows:
+        return None
+    environment = results['environment']
+    lines = ['Measured on {} ({} cores), {}'.format(environment['platform'], environment['cpu_count'], environment['blender']), '',
+             '| Engine | `--profile` | Seconds per view (p50) | Seconds per view (p95) | RGB error vs `reference` (0-255) | '
+             'Depth error vs `reference` (mm) |', '| --- | --- | --- | --- | --- | --- |']
+    for (engine, profile), profile_results in sorted(rows.items()):
+        errors = [result['error'] for result in profile_results if 'error' in result]
+        depth_errors = [error['depth'] for error in errors if error['depth'] is not None]
+        lines.append('| {} | `{}` | {:.3f} | {:.3f} | {} | {} |'.format(
+            engine, profile, max(result['view_seconds']['p50'] for result in profile_results),
+            max(result['view_seconds']['p95'] for result in profile_results),
+            '{:.2f}'.format(max(error['rgb'] for error in errors)) if errors else '-',
+            '{:.2f}'.format(max(depth_errors) * 1000) if depth_errors else '-'))
+    return '\n'.join(lines)
+
+def result_key(result):
+    return result['benchmark'] + ' ' + json.dumps(result['params'], sort_keys=True)
+
+def compare(results, baseline, tolerance):
+    # Compare the p50 latencies and the throughputs with the baseline. Returns the number of regressions.
+    if baseline['environment'].get('machine') != results['environment']['machine'] or \
+       baseline['environment'].get('cpu_count') != results['environment']['cpu_count']:
+        print('Warning: the baseline was recorded on a different machine')
+    baseline_results = {result_key(result): result for result in baseline['results']}
+    regressions = 0
+    print('{:<72}{:>12}{:>12}{:>9}'.format('benchmark', 'baseline', 'current', 'change'))
+    for result in results['results']:
+        reference = baseline_results.get(result_key(result))
+        if reference is None:
+            continue
+        change = result['p50'] / reference['p50'] - 1.0 if reference['p50'] > 0 else 0.0
+        regressed = change > tolerance
+        if result['throughput'] and reference['throughput']:
+            regressed |= result['throughput'] < reference['throughput'] * (1.0 - tolerance)
+        regressions += regressed
+        print('{:<72}{:>11.4f}s{:>11.4f}s{:>+8.1%}{}'.format(result_key(result)[:71], reference['p50'], result['p50'], change,
+                                                           '  REGRESSION' if regressed else ''))
+    return regressions
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Benchmarks the rendering pipeline on synthetic models.')
+    parser.add_argument('--output', type=str, default='benchmark_results.json',
+                        help='The results file to write. Default is benchmark_results.json.')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='A previous results file to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative change of a p50 latency or throughput reported as a regression. Default is 0.1.')
+    parser.add_argument('--stages', type=str, default='generate,fix,projection,depth,render',
+                        help='Comma separated stages to run. The render stage is skipped without --blender.')
+    parser.add_argument('--faces', type=str, default='1000,10000,100000',
+                        help='Comma separated triangle counts of the synthetic models. Default is 1000,10000,100000.')
+    parser.add_argument('--textures', type=str, default='0,1',
+                        help='Comma separated 0 (untextured) and 1 (1024x1024 texture) variants of the models. Default is 0,1.')
+    parser.add_argument('--metadata_rows', type=int, default=10000,
+                        help='Rows of the metadata file of the generate stage. Default is 10000.')
+    parser.add_argument('--mtl_files', type=int, default=2000,
+                        help='Number of .mtl files of the fix stage. Default is 2000.')
+    parser.add_argument('--blender', type=str, default=None,
+                        help='Path to the Blender executable, enables the render stage.')
+    parser.add_argument('--engines', type=str, default='BLENDER_EEVEE',
+                        help='Comma separated render engines of the render stage. Default is BLENDER_EEVEE.')
+    parser.add_argument('--profiles', type=str, default='default',
+                        help='Comma separated render_blender.py quality profiles of the render stage. Default is default.')
+    parser.add_argument('--workers', type=str, default='1',
+                        help='Comma separated worker counts of the render stage. Default is 1.')
+    parser.add_argument('--views', type=str, default='8',
+                        help='Comma separated turntable view counts of the render and depth stages. Default is 8.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='How many times every benchmark is run. Default is 3.')
+    parser.add_argument('--timeout', type=float, default=3600,
+                        help='Renders running for longer than this many seconds are killed. Default is 3600.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic models. Default is 0.')
+    parser.add_argument('--work_folder', type=str, default=None,
+                        help='Folder for the synthetic models and the outputs. Default is a temporary folder, removed at the end.')
+    parser.add_argument('--smoke', type=int, default=0,
+                        help='1 to run every stage once on tiny inputs, as a quick check that the pipeline still works.')
+    args = parser.parse_args()
+    if args.smoke:
+        # Small enough to run in a few seconds, and still goes through every code path of the stages
+        args.faces, args.textures, args.views, args.workers = '200', '0,1', '2', '1'
+        args.metadata_rows, args.mtl_files, args.repeat = 50, 10, 1
+
+    stages = args.stages.split(',')
+    if 'render' in stages and args.blender is None:
+        print('No --blender given, skipping the render stage')
+        stages.remove('render')
+    work_folder = args.work_folder or tempfile.mkdtemp(prefix='render_benchmark_')
+    obj_folder = os.path.join(work_folder, 'models')
+    os.makedirs(obj_folder, exist_ok=True)
+
+    results = {'environment': environment(args.blender), 'args': vars(args), 'results': []}
+    try:
+        rng = np.random.default_rng(args.seed)
+        models = []
+        for faces in map(int, args.faces.split(',')):
+            for textured in map(int, args.textures.split(',')):
+                name = 'sphere{}{}'.format(faces, '_textured' if textured else '')
+                actual_faces = write_model(obj_folder, name, faces, bool(textured), rng)
+                models.append({'name': name, 'obj': os.path.join(obj_folder, name + '.obj'), 'faces': actual_faces,
+                               'textured': bool(textured)})
+        view_counts = [int(views) for views in args.views.split(',')]
+
+        for stage in stages:
+            print('Running the {} stage'.format(stage))
+            if stage == 'generate':
+                stage_results = benchmark_generate(work_folder, obj_folder, [model['name'] for model in models],
+                                                   args.metadata_rows, args.repeat)
+            elif stage == 'fix':
+                stage_results = benchmark_fix(work_folder, args.mtl_files, args.repeat)
+            elif stage == 'projection':
+                stage_results = benchmark_projection(work_folder, args.repeat)
+            elif stage == 'depth':
+                stage_results = []
+                for views in view_counts:
+                    # Textures make no difference without Blender
+                    stage_results += benchmark_depth(work_folder, [model for model in models if not model['textured']],
+                                                     views, args.repeat)
+            elif stage == 'render':
+                stage_results = benchmark_render(work_folder, args.blender, models, args.engines.split(','),
+                                                 [int(workers) for workers in args.workers.split(',')], view_counts,
+                                                 args.repeat, args.timeout, args.profiles.split(','))
+            else:
+                parser.error('unknown stage {}'.format(stage))
+            for result in stage_results:
+                print('  {}: p50 {:.4f} s, p95 {:.4f} s, {:.1f} {}'.format(result_key(result), result['p50'], result['p95'],
+                                                                         result['throughput'] or 0.0, result['unit']))
+            results['results'] += stage_results
+    finally:
+        if args.work_folder is None:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print('Saved the results to {}'.format(args.output))
+    table = profile_table(results)
+    if table is not None:
+        print('Cost per view and error of the quality profiles (worst model of each row), for the README:')
+        print(table)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        print('{} regressions'.format(regressions))
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
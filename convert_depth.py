@@ -0,0 +1,128 @@
+# A script to convert the depth maps already rendered by render_blender.py (32-bit float OpenEXR files with three
+# identical channels) to one of the compact depth formats (see rgbd_io.py for the loss of each format):
+#
+# Single channel OpenEXR, in place (same file names):
+# Usage: python convert_depth.py --directory /path/to/outputs/ --depth_format exr --codec ZIP --precision half
+#
+# 16-bit PNG in millimeters, like the Kinect (the .exr files are replaced by _depth0001.png files):
+# Usage: python convert_depth.py --directory /path/to/outputs/ --depth_format png16
+#
+# The files are converted by a pool of processes. Every converted file is read back and compared with the original
+# before the original is replaced, and the largest error is reported with the space saved. Files already in the
+# requested format are skipped, so the script can be interrupted and run again. Files that cannot be converted are
+# left untouched and listed at the end, and the run goes on with the other files.
+#
+# Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
+
+import argparse, os, time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import rgbd_io
+
+def find_depth_maps(directory):
+    filepaths = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith('_depth0001.exr'):
+                filepaths.append(os.path.join(root, filename))
+    return sorted(filepaths)
+
+def is_converted(filepath, depth_format, codec, precision):
+    # Whether an OpenEXR file already is a single channel file with the requested codec and precision
+    if depth_format != 'exr':
+        return False
+    with open(filepath, 'rb') as file:
+        # The header is at the start of the file and much smaller than this
+        header, _ = rgbd_io.parse_exr_header(file.read(1 << 16))
+    pixel_type = 1 if precision == 'half' else 2
+    return (len(header['channels']) == 1 and header['channels'][0][1] == pixel_type and
+            header['compression'] == rgbd_io.EXR_COMPRESSIONS[codec])
+
+def convert_file(filepath, depth_format, codec, precision, invalid_value):
+    # Convert a single depth map. Returns the status ('skipped', 'converted' or 'failed'), the sizes before and after
+    # and the largest absolute error in meters (or the error message when it failed).
+    size = os.path.getsize(filepath)
+    filepath_output = filepath[:-len('.exr')] + rgbd_io.DEPTH_EXTENSIONS[depth_format]
+    directory, filename = os.path.split(filepath_output)
+    extension = os.path.splitext(filename)[1]
+    # Keep the extension, so that the writers of the OpenEXR bindings accept the temporary file
+    filepath_tmp = os.path.join(directory, '.{}.{}.tmp{}'.format(filename, os.getpid(), extension))
+    try:
+        if is_converted(filepath, depth_format, codec, precision):
+            return 'skipped', size, size, 0.0
+        depth = rgbd_io.read_depth(filepath)
+        rgbd_io.write_depth(filepath_tmp, depth, depth_format, codec, precision == 'half', invalid_value)
+        error = float(np.max(np.abs(rgbd_io.read_depth(filepath_tmp, invalid_value) - depth), initial=0.0))
+    except Exception as e:
+        if os.path.exists(filepath_tmp):
+            os.remove(filepath_tmp)
+        return 'failed', size, 0, str(e)
+    size_output = os.path.getsize(filepath_tmp)
+
+    os.replace(filepath_tmp, filepath_output)
+    if filepath_output != filepath:
+        os.remove(filepath)
+    return 'converted', size, size_output, error
+
+def convert_file_star(task):
+    return convert_file(*task)
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Converts the rendered OpenEXR depth maps to a compact depth format.')
+    parser.add_argument('--directory', type=str,
+                        help='Output folder of render_blender.py, searched recursively for _depth0001.exr files.')
+    parser.add_argument('--depth_format', type=str, default='exr', choices=['exr', 'png16'],
+                        help='Single channel OpenEXR or 16-bit PNG in millimeters. Default is exr.')
+    parser.add_argument('--codec', type=str, default='ZIP', choices=['ZIP', 'PIZ', 'DWAA'],
+                        help='Compression of the single channel OpenEXR files. PIZ and DWAA need the OpenEXR Python bindings, DWAA is lossy.')
+    parser.add_argument('--precision', type=str, default='full', choices=['full', 'half'],
+                        help='32-bit or 16-bit floats for the single channel OpenEXR files.')
+    parser.add_argument('--invalid_value', type=int, default=0,
+                        help='Value of the pixels without depth in the 16-bit PNG files. Default is 0, as the Kinect.')
+    parser.add_argument('--max_workers', type=int, default=None,
+                        help='The number of processes converting files. Default is the number of cores.')
+    args = parser.parse_args()
+    if args.depth_format == 'exr' and args.codec != 'ZIP':
+        # Only ZIP is written without the OpenEXR bindings, check them before converting any file
+        try:
+            import OpenEXR, Imath
+        except ImportError:
+            parser.error('--codec {} needs the OpenEXR Python bindings (pip install OpenEXR), or use --codec ZIP'.format(args.codec))
+
+    start = time.time()
+    filepaths = find_depth_maps(args.directory)
+    tasks = [(filepath, args.depth_format, args.codec, args.precision, args.invalid_value) for filepath in filepaths]
+    converted = 0
+    skipped = 0
+    size_before = 0
+    size_after = 0
+    max_error = 0.0
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.max_workers) as executor:
+        for filepath, (status, size, size_output, error) in zip(filepaths, executor.map(convert_file_star, tasks, chunksize=16)):
+            if status == 'skipped':
+                skipped += 1
+                continue
+            if status == 'failed':
+                failed.append((filepath, error))
+                continue
+            converted += 1
+            size_before += size
+            size_after += size_output
+            max_error = max(max_error, error)
+
+    elapsed = max(time.time() - start, 1e-9)
+    print('{} depth maps converted, {} skipped (already converted) in {:.1f} s ({:.0f} files/s)'.format(
+        converted, skipped, elapsed, converted / elapsed))
+    if converted:
+        print('{:.1f} MB -> {:.1f} MB ({:.1%} of the original size), largest error {:.6f} m'.format(
+            size_before / 1024**2, size_after / 1024**2, size_after / size_before, max_error))
+    if failed:
+        print('{} depth maps could not be converted and were left untouched:'.format(len(failed)))
+        for filepath, error in failed:
+            print('    {}: {}'.format(filepath, error))
+
+if __name__ == "__main__":
+    main()
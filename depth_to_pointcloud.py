@@ -0,0 +1,164 @@
+# A script to turn the depth maps rendered by render_blender.py (or render_depth_numpy.py) into colored point clouds.
+# Every pixel with depth is back-projected along its ray (precomputed once per set of intrinsics, see
+# rgbd_camera.pixel_rays) and colored with the matching pixel of the .png render.
+#
+# Models are taken from the output folder (every model with a <model id>_cameras.json file), from a manifest or from
+# the file of commands given to render_blender_parallel.py (the poses then follow the options of each model when
+# the cameras file is missing):
+# Usage: python depth_to_pointcloud.py --directory /path/to/outputs/ --fuse 1 --voxel_size 0.005
+# Usage: python depth_to_pointcloud.py --file /path/to/commands.txt --format npz --output_folder /path/to/clouds/
+#
+# With --fuse 1, the views of a model are merged into a single cloud in the world frame (the frame of the centered
+# and scaled model, in meters), optionally downsampled to one point per --voxel_size voxel (the average of its
+# points and colors). Otherwise, every view gets its own cloud, in the camera frame (--frame camera, Blender
+# convention: X right, Y up, looking along -Z) or in the world frame (--frame world).
+#
+# The clouds are written as binary PLY files (float x, y, z and uchar red, green, blue) or as .npz files (points
+# (N, 3) float32 and colors (N, 3) uint8, plus the view names with --fuse 0). Models whose clouds are newer than
+# their renders are skipped, so the script can run again as more models are rendered.
+#
+# Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
+
+import argparse, glob, os, time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import pack_outputs, rgbd_camera, rgbd_io
+
+def find_models(directory, depth_invalid_value=0):
+    # The models of an output folder that have a cameras file, as manifest entries
+    models = []
+    for cameras_path in sorted(glob.glob(os.path.join(directory, '*', '*_cameras.json'))):
+        identifier = os.path.basename(cameras_path)[:-len('_cameras.json')]
+        models.append({'obj': identifier + '.obj', 'output_folder': directory, 'depth_invalid_value': depth_invalid_value})
+    return models
+
+def read_colors(filepath):
+    # The RGB channels of a render as uint8 (height, width, 3)
+    rgb = rgbd_io.read_png(filepath)
+    if rgb.ndim == 2:
+        rgb = rgb[..., np.newaxis]
+    if rgb.dtype == np.uint16:
+        rgb = (rgb >> 8).astype(np.uint8)
+    if rgb.shape[2] < 3:
+        rgb = np.repeat(rgb[..., :1], 3, axis=2)
+    return rgb[..., :3]
+
+def voxel_downsample(points, colors, voxel_size):
+    # Replace the points of every voxel by their average (and the average of their colors)
+    voxels = np.floor(points / voxel_size).astype(np.int64)
+    _, inverse, counts = np.unique(voxels, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    downsampled = np.empty((len(counts), 3), dtype=np.float32)
+    downsampled_colors = np.empty((len(counts), 3), dtype=np.uint8)
+    for i in range(3):
+        downsampled[:, i] = np.bincount(inverse, weights=points[:, i], minlength=len(counts)) / counts
+        downsampled_colors[:, i] = np.round(np.bincount(inverse, weights=colors[:, i], minlength=len(counts)) / counts)
+    return downsampled, downsampled_colors
+
+def cloud_paths(rendered, options):
+    # The files written for a model: a single fused cloud, or one cloud per view
+    output_folder = rendered['folder'] if options['output_folder'] is None else os.path.join(options['output_folder'], rendered['model'])
+    extension = '.' + options['format']
+    if options['fuse']:
+        return [os.path.join(output_folder, rendered['model'] + '_points' + extension)]
+    return [os.path.join(output_folder, rendered['model'] + view['name'] + '_points' + extension) for view in rendered['views']]
+
+def write_cloud(filepath, points, colors, cloud_format, **arrays):
+    # Write to a temporary file first, so that an interrupted run never leaves a partial cloud behind
+    filepath_tmp = '{}.{}.tmp.{}'.format(filepath[:-len(cloud_format) - 1], os.getpid(), cloud_format)
+    if cloud_format == 'ply':
+        rgbd_io.write_ply(filepath_tmp, points, colors)
+    else:
+        np.savez_compressed(filepath_tmp, points=points, colors=colors, **arrays)
+    os.replace(filepath_tmp, filepath)
+
+def convert_model(model, options):
+    # Back-project every view of a model. Returns the model statistics.
+    start = time.time()
+    rendered = pack_outputs.model_views(model)
+    filepaths = cloud_paths(rendered, options)
+    inputs = [filepath for view in rendered['views'] for filepath in (view['rgb'], view['depth'])]
+    if not all(os.path.exists(filepath) for filepath in inputs):
+        return {'model': rendered['model'], 'status': 'missing', 'points': 0, 'duration': time.time() - start}
+    if all(os.path.exists(filepath) for filepath in filepaths):
+        newest_input = max(os.path.getmtime(filepath) for filepath in inputs)
+        if all(os.path.getmtime(filepath) >= newest_input for filepath in filepaths):
+            return {'model': rendered['model'], 'status': 'skipped', 'points': 0, 'duration': time.time() - start}
+
+    rays = rgbd_camera.pixel_rays(rendered['width'], rendered['height'], rendered['K'])
+    clouds = []
+    for view in rendered['views']:
+        depth = rgbd_io.read_depth(view['depth'], rendered['depth_invalid_value'])
+        camera_to_world = None if options['frame'] == 'camera' and not options['fuse'] else view['camera_to_world']
+        points, mask = rgbd_camera.depth_to_points(depth, rays, camera_to_world)
+        clouds.append((points, read_colors(view['rgb'])[mask]))
+
+    os.makedirs(os.path.dirname(filepaths[0]), exist_ok=True)
+    if options['fuse']:
+        points = np.concatenate([points for points, _ in clouds])
+        colors = np.concatenate([colors for _, colors in clouds])
+        if options['voxel_size'] > 0 and len(points) > 0:
+            points, colors = voxel_downsample(points, colors, options['voxel_size'])
+        write_cloud(filepaths[0], points, colors, options['format'])
+        count = len(points)
+    else:
+        for filepath, view, (points, colors) in zip(filepaths, rendered['views'], clouds):
+            write_cloud(filepath, points, colors, options['format'], camera_to_world=view['camera_to_world'], K=rendered['K'])
+        count = sum(len(points) for points, _ in clouds)
+    return {'model': rendered['model'], 'status': 'converted', 'points': count, 'duration': time.time() - start}
+
+def convert_model_star(task):
+    return convert_model(*task)
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Back-projects the rendered depth maps into colored point clouds.')
+    parser.add_argument('--directory', type=str, default=None,
+                        help='Output folder of render_blender.py, with a <model id>_cameras.json file per model.')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='JSON lines file listing the rendered models, as given to render_blender.py.')
+    parser.add_argument('--file', type=str, default=None,
+                        help='The file containing the list of commands that rendered the models.')
+    parser.add_argument('--output_folder', type=str, default=None,
+                        help='The folder where the clouds are written, in a folder per model. Default is next to the renders.')
+    parser.add_argument('--format', type=str, default='ply', choices=['ply', 'npz'],
+                        help='Binary PLY or compressed numpy files. Default is ply.')
+    parser.add_argument('--fuse', type=int, default=0,
+                        help='1 to merge the views of a model into a single cloud in the world frame, 0 for a cloud per view.')
+    parser.add_argument('--frame', type=str, default='world', choices=['world', 'camera'],
+                        help='The frame of the clouds of the views when they are not fused. Default is world.')
+    parser.add_argument('--voxel_size', type=float, default=0.0,
+                        help='Size in meters of the voxels used to downsample the fused clouds. Default is 0 (no downsampling).')
+    parser.add_argument('--depth_invalid_value', type=int, default=0,
+                        help='Value of the pixels without depth in 16-bit PNG depth maps, for the models of --directory.')
+    parser.add_argument('--max_workers', type=int, default=None,
+                        help='The number of processes converting models. Default is the number of cores.')
+    args = parser.parse_args()
+    if sum(source is not None for source in (args.directory, args.manifest, args.file)) != 1:
+        parser.error('exactly one of --directory, --manifest or --file must be given')
+
+    import render_blender_parallel
+    if args.directory is not None:
+        models = find_models(args.directory, args.depth_invalid_value)
+    elif args.manifest is not None:
+        models = render_blender_parallel.read_manifest(args.manifest)
+    else:
+        commands = render_blender_parallel.read_commands(args.file)
+        models = [model for command in commands for model in render_blender_parallel.command_models(command)]
+    options = {'output_folder': args.output_folder, 'format': args.format, 'fuse': bool(args.fuse),
+               'frame': args.frame, 'voxel_size': args.voxel_size}
+
+    start = time.time()
+    counts = {'converted': 0, 'skipped': 0, 'missing': 0}
+    points = 0
+    with ProcessPoolExecutor(max_workers=args.max_workers) as executor:
+        for result in executor.map(convert_model_star, [(model, options) for model in models]):
+            counts[result['status']] += 1
+            points += result['points']
+    elapsed = max(time.time() - start, 1e-9)
+    print('{} models converted, {} skipped (up to date), {} missing renders in {:.1f} s ({:.1f} models/s, {:.1f} M points/s)'.format(
+        counts['converted'], counts['skipped'], counts['missing'], elapsed, counts['converted'] / elapsed, points / elapsed / 1e6))
+
+if __name__ == "__main__":
+    main()
@@ -9,50 +9,195 @@
 # Overwrite of the original files:
 # Usage: python fix_shapenetsem.py --directory /path/to/ShapeNetSem/models-OBJ/models/
 #
+# The files are processed by a pool of processes, streamed line by line, and only written (with an atomic replace)
+# when their content actually changes. The hash and the size/modification time of every fixed file are recorded in
+# a manifest (.fix_shapenetsem.jsonl in the output folder), so running the script again is a no-op that only looks
+# at the file stats, instead of inverting the "d" values a second time.
+#
 # Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
 
-import argparse, os
-
-# Parse command line arguments
-parser = argparse.ArgumentParser(description='Renders given obj file by rotating a camera around it.')
-parser.add_argument('--directory', type=str,
-                    help='Directory containing the .mtl files.')
-parser.add_argument('--output_folder', type=str, default=None,
-                    help='The output directory to save the modified .mtl files. If not specified, the original files will be overwritten.')
-args = parser.parse_args()
-
-# Iterate over all files in the directory
-for filename in os.listdir(args.directory):
-    # Check if the file is a .mtl file
-    if filename.endswith('.mtl'):
-        # Construct the full file path to the input file
-        filepath_input = os.path.join(args.directory, filename)
-
-        # Read the file
-        with open(filepath_input, 'r') as file:
-            lines = file.readlines()
-
-        # Modify the lines
-        # lines = ['d 1\n' if line.startswith('d 0') else line for line in lines]
-        new_lines = []
-        for line in lines:
-            components = line.split()
-            if components[0] == 'd':
-                components[1] = str(1.0 - float(components[1]))
-            new_lines.append(' '.join(components) + '\n')
-        lines = new_lines
-
-        # Construct the full file path to the output file
-        if args.output_folder is None:
-            filepath_output = filepath_input
-        else:
-            # Check if the output folder exists
-            if not os.path.exists(args.output_folder):
-                os.makedirs(args.output_folder)
-            filepath_output = os.path.join(args.output_folder, filename)
-        
-        # Write the modified content back to a file
-        with open(filepath_output, 'w') as file:
-            file.writelines(lines)
-        print('fixed and saved ', filepath_output)
-print('\n\ndone')
\ No newline at end of file
+import argparse, hashlib, json, os, time
+from concurrent.futures import ProcessPoolExecutor
+
+MANIFEST_FILENAME = '.fix_shapenetsem.jsonl'
+
+def fix_line(line):
+    # Invert the "Dissolve (d)" value, leaving every other line (including blank ones) untouched
+    components = line.split()
+    if len(components) == 2 and components[0] == 'd':
+        ending = line[len(line.rstrip('\r\n')):]
+        return 'd ' + str(1.0 - float(components[1])) + ending
+    return line
+
+def hash_file(filepath):
+    sha = hashlib.sha1()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def process_file(filepath_input, filepath_output, fixed_hash=None):
+    # Fix a single file. Returns the status ('skipped', 'unchanged' or 'changed'), the path of the temporary file
+    # holding the fixed content (to be moved over the output by the caller), the hash of the fixed content and
+    # the number of bytes read.
+    # latin-1 maps every byte to a character, so the files round-trip exactly whatever their encoding.
+    size = os.path.getsize(filepath_input)
+    in_place = filepath_input == filepath_output
+
+    # The manifest says the file was already fixed, but its stats changed (e.g. it was copied): compare the content
+    if in_place and fixed_hash is not None and hash_file(filepath_input) == fixed_hash:
+        return 'skipped', None, fixed_hash, size
+
+    sha = hashlib.sha1()
+    changed = False
+    with open(filepath_input, 'r', encoding='latin-1', newline='') as file:
+        for line in file:
+            fixed = fix_line(line)
+            changed |= fixed != line
+            sha.update(fixed.encode('latin-1'))
+    digest = sha.hexdigest()
+
+    if in_place and not changed:
+        return 'unchanged', None, digest, size
+    if not in_place and os.path.exists(filepath_output) and hash_file(filepath_output) == digest:
+        return 'unchanged', None, digest, size
+
+    # Stream the fixed lines to a temporary file next to the output
+    directory, filename = os.path.split(filepath_output)
+    filepath_tmp = os.path.join(directory, '.{}.{}.tmp'.format(filename, os.getpid()))
+    with open(filepath_input, 'r', encoding='latin-1', newline='') as file, \
+         open(filepath_tmp, 'w', encoding='latin-1', newline='') as file_output:
+        for line in file:
+            file_output.write(fix_line(line))
+    return 'changed', filepath_tmp, digest, size
+
+def process_file_star(task):
+    return process_file(*task)
+
+class Manifest:
+    # Append-only JSON lines file with the state of every fixed file. The last record of each file wins,
+    # and the file is compacted every time it is loaded.
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.records = {}
+        if os.path.exists(filepath):
+            with open(filepath, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # An interrupted run may have left a truncated last line
+                        continue
+                    self.records[record['file']] = record
+        filepath_tmp = filepath + '.tmp'
+        with open(filepath_tmp, 'w') as file:
+            for record in self.records.values():
+                file.write(json.dumps(record) + '\n')
+        os.replace(filepath_tmp, filepath)
+        self.file = open(filepath, 'a')
+
+    def get(self, filename):
+        return self.records.get(filename)
+
+    def update(self, record):
+        self.records[record['file']] = record
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def stat_record(filename, digest, filepath_input, filepath_output):
+    stat_output = os.stat(filepath_output)
+    record = {'file': filename, 'hash': digest, 'size': stat_output.st_size, 'mtime_ns': stat_output.st_mtime_ns}
+    if filepath_input != filepath_output:
+        stat_input = os.stat(filepath_input)
+        record['source_size'] = stat_input.st_size
+        record['source_mtime_ns'] = stat_input.st_mtime_ns
+    return record
+
+def is_up_to_date(record, filepath_input, filepath_output):
+    # Whether the manifest proves the output is already fixed, looking only at the file stats
+    if record is None or 'size' not in record:
+        return False
+    try:
+        stat_output = os.stat(filepath_output)
+        if (stat_output.st_size, stat_output.st_mtime_ns) != (record['size'], record['mtime_ns']):
+            return False
+        if filepath_input != filepath_output:
+            stat_input = os.stat(filepath_input)
+            return (stat_input.st_size, stat_input.st_mtime_ns) == (record['source_size'], record['source_mtime_ns'])
+    except OSError:
+        return False
+    return True
+
+def fix_directory(directory, output_folder=None, max_workers=None, verbose=False):
+    if output_folder is None:
+        output_folder = directory
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = Manifest(os.path.join(output_folder, MANIFEST_FILENAME))
+
+    start = time.time()
+    scanned = 0
+    skipped = 0
+    unchanged = 0
+    changed = 0
+    bytes_read = 0
+    try:
+        # Only the files that the manifest cannot prove to be fixed are sent to the pool
+        tasks = []
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.mtl'):
+                continue
+            scanned += 1
+            filepath_input = os.path.join(directory, filename)
+            filepath_output = os.path.join(output_folder, filename)
+            record = manifest.get(filename)
+            if is_up_to_date(record, filepath_input, filepath_output):
+                skipped += 1
+            else:
+                fixed_hash = record['hash'] if record is not None and filepath_input == filepath_output else None
+                tasks.append((filepath_input, filepath_output, fixed_hash))
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(process_file_star, tasks, chunksize=64)
+            for (filepath_input, filepath_output, _), (status, filepath_tmp, digest, size) in zip(tasks, results):
+                filename = os.path.basename(filepath_output)
+                bytes_read += size
+                if status == 'changed':
+                    # Record the hash before replacing the file, so that an interrupted run never inverts it twice
+                    manifest.update({'file': filename, 'hash': digest})
+                    os.replace(filepath_tmp, filepath_output)
+                    changed += 1
+                    if verbose:
+                        print('fixed and saved ', filepath_output)
+                elif status == 'skipped':
+                    skipped += 1
+                else:
+                    unchanged += 1
+                manifest.update(stat_record(filename, digest, filepath_input, filepath_output))
+    finally:
+        manifest.close()
+
+    elapsed = max(time.time() - start, 1e-9)
+    print('{} files scanned, {} changed, {} unchanged, {} skipped (already fixed) in {:.1f} s'.format(
+        scanned, changed, unchanged, skipped, elapsed))
+    print('{:.0f} files/s, {:.1f} MB/s read'.format(scanned / elapsed, bytes_read / 1024**2 / elapsed))
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Renders given obj file by rotating a camera around it.')
+    parser.add_argument('--directory', type=str,
+                        help='Directory containing the .mtl files.')
+    parser.add_argument('--output_folder', type=str, default=None,
+                        help='The output directory to save the modified .mtl files. If not specified, the original files will be overwritten.')
+    parser.add_argument('--max_workers', type=int, default=None,
+                        help='The number of processes used to fix the files. Default is the number of cores.')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Print every file that is fixed.')
+    args = parser.parse_args()
+
+    fix_directory(args.directory, args.output_folder, args.max_workers, args.verbose)
+
+if __name__ == "__main__":
+    main()
@@ -5,59 +5,174 @@
 #
 # Usage: python generate_commands.py --metadata /path/to/ShapeNetSem/metadata.txt --obj_directory /path/to/ShapeNetSem/models-OBJ/models/ --render_blender_path /path/to/render_blender.py --output_directory /path/to/output/
 #
+# The models can also be written as a JSON lines manifest (one model per line, with the obj path, up, front, unit,
+# aligned_dims, output folder and estimated cost), which render_blender.py renders in batch mode with --manifest:
+# Usage: python generate_commands.py --metadata /path/to/ShapeNetSem/metadata.txt --obj_directory /path/to/ShapeNetSem/models-OBJ/models/ --output_directory /path/to/output/ --output manifest.jsonl
+#
+# Subsets of the models are selected with the index built by index_metadata.py, which also gives the .obj paths:
+# Usage: python generate_commands.py --index /path/to/shapenetsem.sqlite --category Chair --max_faces 50000 --has_texture 1 --output_directory /path/to/output/
+#
+# Extra render_blender.py options (e.g. --depth_format png16) are added to every command with --render_options.
+#
+# To split the dataset across several render hosts, --num_shards N writes N files with balanced estimated costs
+# (manifest.shard-0-of-N.jsonl, ...), and --shard i/N writes only the i-th of them. The split is deterministic.
+#
 # Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
 
 import pandas as pd
-import argparse, os
-
-# Parse command line arguments
-parser = argparse.ArgumentParser(description='Renders given obj file by rotating a camera around it.')
-parser.add_argument('--metadata', type=str,
-                    help='Path to the metadata file provided by ShapeNetSem.')
-parser.add_argument('--obj_directory', type=str,
-                    help='The absulute path to the directory containing the .obj files.')
-parser.add_argument('--render_blender_path', type=str,
-                    help='The absulute path to the render_blender.py file.')
-parser.add_argument('--output_directory', type=str,
-                    help='The absulute path to the output directory.')
-args = parser.parse_args()
-
-# Read the metadata file
-df = pd.read_csv(args.metadata)
-
-# Filter rows where the 'weight' column is not NaN
-filtered_df = df[df['unit'].notna()]
-number_elements = filtered_df.shape[0]
-
-lines = []
-for index, counter in zip(filtered_df.index, range(1, number_elements + 1)):
-    # Construct the command
-    line = 'blender --background --python ' + args.render_blender_path + ' -- --output_folder ' + args.output_directory
-    
-    # Up, front, aligned dimensions and unit of the object
-    up = filtered_df['up'][index]
-    if isinstance(up, str):
-        line += ' --up ' + up
-    front = filtered_df['front'][index]
-    if isinstance(front, str):
-        line += ' --front ' + front
-    aligned_dims = filtered_df['aligned.dims'][index]
-    if isinstance(aligned_dims, str):
-        line += ' --aligned_dims ' + aligned_dims
-    unit = str(filtered_df['unit'][index])
-    if isinstance(unit, str):
-        line += ' --unit ' + unit
-    
-    # Path to the .obj file
-    filename = (filtered_df['fullId'][index]).split('.')[1]
-    filepath = os.path.join(args.obj_directory, filename) + '.obj'
-    line += ' ' + filepath + '\n'
-    
-    lines.append(line)
-    print(counter, ' out of ', number_elements)
-
-print('Save data')
-
-# Write the modified content back to a file
-with open('commands.txt', 'w') as file:
-    file.writelines(lines)
\ No newline at end of file
+import argparse, heapq, json, os, time
+
+import index_metadata
+
+def parse_vectors(column, labels=None):
+    # Convert a column of strings like 0\,0\,1 into lists of 3 floats (None where the value is missing). Values with
+    # another number of components raise a ValueError naming the row (and its label, e.g. the .obj path).
+    values = column.str.replace('\\,', ',', regex=False)
+    counts = values.str.split(',').str.len()
+    bad = column.notna() & (counts != 3)
+    if bad.any():
+        index = bad.idxmax()
+        label = '' if labels is None else ' ({})'.format(labels[index])
+        raise ValueError('{} of row {}{} has {} components instead of 3: {!r}'.format(
+            column.name, index, label, int(counts[index]), column[index]))
+    components = values.str.split(',', expand=True).astype(float)
+    vectors = pd.Series(components.values.tolist(), index=column.index, dtype=object)
+    return vectors.where(column.notna(), None)
+
+def file_sizes(paths):
+    sizes = []
+    for path in paths:
+        try:
+            sizes.append(os.path.getsize(path))
+        except OSError:
+            sizes.append(None)
+    return pd.Series(sizes, index=paths.index, dtype=float)
+
+def build_manifest(df, obj_directory, output_directory):
+    # Keep only the models with a unit, since the depth of the others would be dimensionless
+    filtered_df = df[df['unit'].notna()]
+
+    manifest = pd.DataFrame(index=filtered_df.index)
+    if obj_directory is None and 'obj_path' in filtered_df:
+        # The paths of the index of index_metadata.py
+        manifest['obj'] = filtered_df['obj_path']
+    else:
+        manifest['obj'] = os.path.join(obj_directory, '') + filtered_df['fullId'].str.split('.').str[1] + '.obj'
+    manifest['up'] = filtered_df['up']
+    manifest['front'] = filtered_df['front']
+    manifest['unit'] = filtered_df['unit'].astype(float)
+    manifest['aligned_dims'] = filtered_df['aligned.dims']
+    manifest['output_folder'] = output_directory
+
+    # The estimated cost of a model is the size of its .obj file (the median when the file is missing)
+    cost = filtered_df['obj_size'].astype(float) if 'obj_size' in filtered_df else file_sizes(manifest['obj'])
+    if len(cost) and cost.isna().all():
+        print('Warning: none of the .obj files could be read, so every model has the same estimated cost and the shards '
+              'are balanced by model count only (check --obj_directory)')
+    manifest['cost'] = cost.fillna(cost.median() if cost.notna().any() else 0).astype('int64')
+    return manifest
+
+def to_commands(manifest, render_blender_path, render_options=''):
+    # Command lines in the format read by render_blender_parallel.py
+    separator = ' -- ' + render_options + ' ' if render_options else ' -- '
+    lines = 'blender --background --python ' + render_blender_path + separator + '--output_folder ' + manifest['output_folder']
+    for option, column in (('up', 'up'), ('front', 'front'), ('aligned_dims', 'aligned_dims')):
+        lines += (' --' + option + ' ' + manifest[column]).where(manifest[column].notna(), '')
+    lines += ' --unit ' + manifest['unit'].astype(str)
+    lines += ' ' + manifest['obj'] + '\n'
+    return lines.tolist()
+
+def to_jsonl(manifest):
+    # JSON lines in the format read by render_blender.py --manifest, without the missing values
+    records = manifest.copy()
+    for column in ('up', 'front', 'aligned_dims'):
+        records[column] = parse_vectors(manifest[column].astype(object), manifest['obj'])
+    lines = []
+    for record in records.to_dict('records'):
+        lines.append(json.dumps({key: value for key, value in record.items() if value is not None}) + '\n')
+    return lines
+
+def assign_shards(manifest, num_shards):
+    # Greedy longest-processing-time partition: the most expensive model goes to the shard with the lowest total cost.
+    # Equal costs go to the shard with the fewest models (so models of unknown cost are still spread evenly), and the
+    # remaining ties are broken by the obj path and the shard number, so every host computes the same split.
+    order = manifest.sort_values(['cost', 'obj'], ascending=[False, True])
+    loads = [(0, 0, shard) for shard in range(num_shards)]
+    shards = pd.Series(0, index=manifest.index)
+    for index, cost in zip(order.index, order['cost']):
+        load, count, shard = heapq.heappop(loads)
+        shards[index] = shard
+        heapq.heappush(loads, (load + cost, count + 1, shard))
+    return shards
+
+def shard_path(output, shard, num_shards):
+    stem, extension = os.path.splitext(output)
+    return '{}.shard-{}-of-{}{}'.format(stem, shard, num_shards, extension)
+
+def write_lines(filepath, manifest, output_format, render_blender_path, render_options=''):
+    if output_format == 'jsonl':
+        lines = to_jsonl(manifest)
+    else:
+        lines = to_commands(manifest, render_blender_path, render_options)
+    with open(filepath, 'w') as file:
+        file.writelines(lines)
+    print('Saved {} models ({:.1f} MB of .obj files) to {}'.format(len(lines), manifest['cost'].sum() / 1024**2, filepath))
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Renders given obj file by rotating a camera around it.')
+    parser.add_argument('--metadata', type=str,
+                        help='Path to the metadata file provided by ShapeNetSem.')
+    parser.add_argument('--index', type=str, default=None,
+                        help='The SQLite index built by index_metadata.py, used instead of --metadata to select the models with the filters below.')
+    parser.add_argument('--obj_directory', type=str, default=None,
+                        help='The absulute path to the directory containing the .obj files. Optional with --index.')
+    parser.add_argument('--render_blender_path', type=str, default='render_blender.py',
+                        help='The absulute path to the render_blender.py file.')
+    parser.add_argument('--render_options', type=str, default='',
+                        help='Extra render_blender.py options added to every command, e.g. "--depth_format png16".')
+    parser.add_argument('--output_directory', type=str,
+                        help='The absulute path to the output directory.')
+    parser.add_argument('--output', type=str, default='commands.txt',
+                        help='The file to write. Default is commands.txt.')
+    parser.add_argument('--format', type=str, default=None, choices=['commands', 'jsonl'],
+                        help='Write command lines or a JSON lines manifest. Default is jsonl for .jsonl outputs and commands otherwise.')
+    parser.add_argument('--num_shards', type=int, default=1,
+                        help='Split the models into this many files with balanced estimated costs.')
+    parser.add_argument('--shard', type=str, default=None,
+                        help='Only write the i-th shard, given as i/N.')
+    index_metadata.add_filter_arguments(parser)
+    args = parser.parse_args()
+    if (args.metadata is None) == (args.index is None):
+        parser.error('exactly one of --metadata or --index must be given')
+
+    output_format = args.format or ('jsonl' if args.output.endswith('.jsonl') else 'commands')
+
+    if args.index is not None:
+        # Select the models in the index (the models without a unit are still left out by build_manifest)
+        start = time.perf_counter()
+        df = index_metadata.query_models(args.index, **index_metadata.filters_from_args(args))
+        print('Selected {} models from the index in {:.1f} ms'.format(len(df), (time.perf_counter() - start) * 1000))
+    else:
+        # Read the metadata file
+        df = pd.read_csv(args.metadata)
+    manifest = build_manifest(df, args.obj_directory, args.output_directory)
+
+    if args.shard is not None:
+        shard, num_shards = map(int, args.shard.split('/'))
+        selected_shards = [shard]
+    else:
+        num_shards = args.num_shards
+        selected_shards = range(num_shards)
+
+    if num_shards == 1:
+        write_lines(args.output, manifest, output_format, args.render_blender_path, args.render_options)
+        return
+
+    shards = assign_shards(manifest, num_shards)
+    for shard in selected_shards:
+        write_lines(shard_path(args.output, shard, num_shards), manifest[shards == shard], output_format, args.render_blender_path,
+                    args.render_options)
+
+if __name__ == "__main__":
+    main()
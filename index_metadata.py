@@ -0,0 +1,257 @@
+# A script to index the ShapeNetSem metadata once, so that subsets of the models can be selected in milliseconds.
+# It joins metadata.csv, categories.synset.csv and the statistics of the .obj files (size, vertex and face counts,
+# textures referenced by their .mtl files) into a SQLite database with indexes on the fields used to filter the models.
+#
+# Usage: python index_metadata.py --metadata /path/to/ShapeNetSem/metadata.csv --synsets /path/to/ShapeNetSem/categories.synset.csv --obj_directory /path/to/ShapeNetSem/models-OBJ/models/ --index /path/to/shapenetsem.sqlite
+#
+# The .obj files are scanned by a pool of processes. Running the script again only scans the .obj files that changed
+# (different size or modification time), so the index can be refreshed when a new metadata file is downloaded.
+#
+# The index is then queried with the same filters that generate_commands.py --index accepts:
+# Usage: python index_metadata.py --index /path/to/shapenetsem.sqlite --category Chair,Table --max_faces 50000 --has_texture 1
+#
+# Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
+
+import argparse, os, re, sqlite3, time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS models (
+    id TEXT PRIMARY KEY, full_id TEXT, name TEXT, category TEXT, wnsynset TEXT, wnlemmas TEXT,
+    up TEXT, front TEXT, unit REAL, aligned_dims TEXT,
+    obj_path TEXT, obj_size INTEGER, obj_mtime REAL, vertices INTEGER, faces INTEGER, textures INTEGER);
+CREATE TABLE IF NOT EXISTS model_categories (id TEXT, category TEXT COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS category_synsets (category TEXT COLLATE NOCASE, synset TEXT);
+CREATE INDEX IF NOT EXISTS models_wnsynset ON models (wnsynset);
+CREATE INDEX IF NOT EXISTS models_obj_size ON models (obj_size);
+CREATE INDEX IF NOT EXISTS models_faces ON models (faces);
+CREATE INDEX IF NOT EXISTS model_categories_category ON model_categories (category, id);
+CREATE INDEX IF NOT EXISTS category_synsets_synset ON category_synsets (synset, category);
+'''
+
+MTLLIB = re.compile(rb'^mtllib[ \t]+(.+?)[ \t\r]*$', re.MULTILINE)
+TEXTURE_MAP = re.compile(rb'^[ \t]*(?:map_\w+|bump|disp|decal|refl)[ \t]+(.+?)[ \t\r]*$', re.MULTILINE)
+TOKEN = re.compile(rb'\S+')
+# Largest number of values of the texture map options that take more than one (-o u [v [w]], -mm base [gain]),
+# the other options (-blendu on, -bm 0.5, -imfchan r, ...) take exactly one
+MAP_OPTION_VALUES = {b'-o': 3, b'-s': 3, b'-t': 3, b'-mm': 2}
+
+def is_number(token):
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
+
+def map_filename(statement):
+    # The file name of a texture map statement (without the map keyword), after its options. The last token is
+    # always kept, and the file name may contain spaces.
+    tokens = list(TOKEN.finditer(statement))
+    i = 0
+    while i < len(tokens) - 1 and tokens[i].group().startswith(b'-') and not is_number(tokens[i].group()):
+        values = MAP_OPTION_VALUES.get(tokens[i].group().lower(), 1)
+        i += 1
+        if values == 1:
+            i += 1
+            continue
+        # The values after the first one are optional
+        for _ in range(values):
+            if i < len(tokens) - 1 and is_number(tokens[i].group()):
+                i += 1
+    return statement[tokens[min(i, len(tokens) - 1)].start():]
+
+def mtl_textures(mtl_data):
+    # The texture file names referenced by the bytes of a .mtl file
+    return [map_filename(statement).decode(errors='replace') for statement in TEXTURE_MAP.findall(mtl_data)]
+
+def count_lines_starting_with(data, prefix):
+    return data.count(b'\n' + prefix) + data.startswith(prefix)
+
+def obj_statistics(obj_path):
+    # Size, vertex and face counts of an .obj file, and the number of distinct textures referenced by its .mtl files.
+    # Returns None when the file is missing.
+    try:
+        size = os.path.getsize(obj_path)
+        mtime = os.path.getmtime(obj_path)
+        with open(obj_path, 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+    textures = set()
+    for mtllib in MTLLIB.findall(data):
+        mtl_path = os.path.join(os.path.dirname(obj_path), mtllib.decode(errors='replace'))
+        try:
+            with open(mtl_path, 'rb') as file:
+                textures.update(texture.lower() for texture in mtl_textures(file.read()))
+        except OSError:
+            continue
+    return {'obj_size': size, 'obj_mtime': mtime, 'vertices': count_lines_starting_with(data, b'v '),
+            'faces': count_lines_starting_with(data, b'f '), 'textures': len(textures)}
+
+def split_categories(value):
+    # The category field lists several comma separated categories (the ones starting with _ are internal)
+    if not isinstance(value, str):
+        return []
+    return [category.strip() for category in value.split(',') if category.strip()]
+
+def none_if_missing(value):
+    return None if pd.isna(value) else value
+
+def build_index(index_path, metadata_path, obj_directory, synsets_path=None, max_workers=None):
+    # Create or refresh the index. Returns the number of models and the number of .obj files scanned.
+    df = pd.read_csv(metadata_path)
+    ids = df['fullId'].str.split('.').str[1]
+    obj_paths = os.path.join(os.path.abspath(obj_directory), '') + ids + '.obj'
+
+    connection = sqlite3.connect(index_path)
+    connection.executescript(SCHEMA)
+    # Statistics of the previous run, reused for the .obj files that did not change
+    previous = {row[0]: row[1:] for row in connection.execute(
+        'SELECT obj_path, obj_size, obj_mtime, vertices, faces, textures FROM models WHERE obj_size IS NOT NULL')}
+    statistics = {}
+    to_scan = []
+    for obj_path in obj_paths:
+        row = previous.get(obj_path)
+        try:
+            unchanged = row is not None and row[0] == os.path.getsize(obj_path) and row[1] == os.path.getmtime(obj_path)
+        except OSError:
+            unchanged = False
+        if unchanged:
+            statistics[obj_path] = dict(zip(('obj_size', 'obj_mtime', 'vertices', 'faces', 'textures'), row))
+        else:
+            to_scan.append(obj_path)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for obj_path, result in zip(to_scan, executor.map(obj_statistics, to_scan, chunksize=64)):
+            statistics[obj_path] = result
+
+    rows = []
+    categories = []
+    for model_id, obj_path, record in zip(ids, obj_paths, df.to_dict('records')):
+        stats = statistics.get(obj_path) or {}
+        rows.append((model_id, record['fullId'], none_if_missing(record.get('name')), none_if_missing(record.get('category')),
+                     none_if_missing(record.get('wnsynset')), none_if_missing(record.get('wnlemmas')),
+                     none_if_missing(record.get('up')), none_if_missing(record.get('front')), none_if_missing(record.get('unit')),
+                     none_if_missing(record.get('aligned.dims')), obj_path, stats.get('obj_size'), stats.get('obj_mtime'),
+                     stats.get('vertices'), stats.get('faces'), stats.get('textures')))
+        categories += [(model_id, category) for category in split_categories(record.get('category'))]
+
+    with connection:
+        connection.execute('DELETE FROM models')
+        connection.execute('DELETE FROM model_categories')
+        connection.executemany('INSERT OR REPLACE INTO models VALUES ({})'.format(', '.join('?' * 16)), rows)
+        connection.executemany('INSERT INTO model_categories VALUES (?, ?)', categories)
+        if synsets_path is not None:
+            synsets = pd.read_csv(synsets_path)
+            category_column = 'category' if 'category' in synsets else synsets.columns[0]
+            synset_column = 'synset' if 'synset' in synsets else synsets.columns[1]
+            connection.execute('DELETE FROM category_synsets')
+            connection.executemany('INSERT INTO category_synsets VALUES (?, ?)',
+                                   synsets[[category_column, synset_column]].dropna().astype(str).values.tolist())
+    connection.execute('ANALYZE')
+    connection.close()
+    return len(rows), len(to_scan)
+
+def add_filter_arguments(parser):
+    # Options of the model filters, shared with generate_commands.py
+    parser.add_argument('--category', type=str, default=None,
+                        help='Only the models of these comma separated categories (e.g. Chair,Table), case insensitive.')
+    parser.add_argument('--synset', type=str, default=None,
+                        help='Only the models of these comma separated WordNet synsets, directly or through their categories.')
+    parser.add_argument('--min_size_mb', type=float, default=None,
+                        help='Only the models whose .obj file is at least this large.')
+    parser.add_argument('--max_size_mb', type=float, default=None,
+                        help='Only the models whose .obj file is at most this large.')
+    parser.add_argument('--min_faces', type=int, default=None,
+                        help='Only the models with at least this many faces.')
+    parser.add_argument('--max_faces', type=int, default=None,
+                        help='Only the models with at most this many faces.')
+    parser.add_argument('--has_texture', type=int, default=None, choices=[0, 1],
+                        help='1 for only the models with textures, 0 for only the models without.')
+    parser.add_argument('--has_unit', type=int, default=None, choices=[0, 1],
+                        help='1 for only the models with a unit, 0 for only the models without.')
+
+def split_list(value):
+    return None if value is None else [item.strip() for item in value.split(',') if item.strip()]
+
+def megabytes_to_bytes(value):
+    return None if value is None else int(value * 1024**2)
+
+def filters_from_args(args):
+    # Keyword arguments of query_models from the options of add_filter_arguments
+    return {'categories': split_list(args.category), 'synsets': split_list(args.synset),
+            'min_size': megabytes_to_bytes(args.min_size_mb), 'max_size': megabytes_to_bytes(args.max_size_mb),
+            'min_faces': args.min_faces, 'max_faces': args.max_faces,
+            'has_texture': None if args.has_texture is None else bool(args.has_texture),
+            'has_unit': None if args.has_unit is None else bool(args.has_unit)}
+
+def query_models(index_path, categories=None, synsets=None, min_size=None, max_size=None, min_faces=None, max_faces=None,
+                 has_texture=None, has_unit=None):
+    # The models matching every given filter, with the columns of metadata.csv used by generate_commands.py
+    # (fullId, up, front, unit, aligned.dims) and the statistics of their .obj files
+    conditions = []
+    parameters = []
+    if categories:
+        conditions.append('id IN (SELECT id FROM model_categories WHERE category IN ({}))'.format(', '.join('?' * len(categories))))
+        parameters += categories
+    if synsets:
+        placeholders = ', '.join('?' * len(synsets))
+        conditions.append('(wnsynset IN ({0}) OR id IN (SELECT model_categories.id FROM model_categories JOIN category_synsets '
+                          'ON model_categories.category = category_synsets.category WHERE category_synsets.synset IN ({0})))'.format(placeholders))
+        parameters += synsets + synsets
+    for column, operator, value in (('obj_size', '>=', min_size), ('obj_size', '<=', max_size),
+                                    ('faces', '>=', min_faces), ('faces', '<=', max_faces)):
+        if value is not None:
+            conditions.append('{} {} ?'.format(column, operator))
+            parameters.append(value)
+    if has_texture is not None:
+        conditions.append('textures > 0' if has_texture else 'textures = 0')
+    if has_unit is not None:
+        conditions.append('unit IS NOT NULL' if has_unit else 'unit IS NULL')
+
+    query = ('SELECT full_id AS fullId, up, front, unit, aligned_dims AS "aligned.dims", category, wnsynset, obj_path, obj_size, '
+             'vertices, faces, textures FROM models')
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY id'
+    connection = sqlite3.connect(index_path)
+    try:
+        return pd.read_sql_query(query, connection, params=parameters)
+    finally:
+        connection.close()
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Indexes the ShapeNetSem metadata and .obj statistics, or queries the index.')
+    parser.add_argument('--index', type=str,
+                        help='The SQLite file of the index.')
+    parser.add_argument('--metadata', type=str, default=None,
+                        help='Path to the metadata file provided by ShapeNetSem. When given, the index is built or refreshed.')
+    parser.add_argument('--synsets', type=str, default=None,
+                        help='Path to the categories.synset.csv file provided by ShapeNetSem.')
+    parser.add_argument('--obj_directory', type=str, default=None,
+                        help='The absolute path to the directory containing the .obj files.')
+    parser.add_argument('--max_workers', type=int, default=None,
+                        help='The number of processes scanning the .obj files. Default is the number of cores.')
+    add_filter_arguments(parser)
+    args = parser.parse_args()
+
+    if args.metadata is not None:
+        if args.obj_directory is None:
+            parser.error('--obj_directory is required to build the index')
+        start = time.time()
+        models, scanned = build_index(args.index, args.metadata, args.obj_directory, args.synsets, args.max_workers)
+        print('Indexed {} models ({} .obj files scanned, {} unchanged) in {:.1f} s'.format(models, scanned, models - scanned, time.time() - start))
+        return
+
+    start = time.perf_counter()
+    models = query_models(args.index, **filters_from_args(args))
+    elapsed = time.perf_counter() - start
+    for full_id in models['fullId']:
+        print(full_id)
+    print('{} models ({:.1f} MB of .obj files, {} with a unit, {} with textures) in {:.1f} ms'.format(
+        len(models), models['obj_size'].sum() / 1024**2, int(models['unit'].notna().sum()),
+        int((models['textures'] > 0).sum()), elapsed * 1000))
+
+if __name__ == "__main__":
+    main()
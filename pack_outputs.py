@@ -0,0 +1,332 @@
+# A script to pack the renders of render_blender.py (14 .png and 14 .exr files per model by default) into a few
+# large files, so that the dataset does not end up as hundreds of thousands of small files.
+#
+# Two formats are supported:
+#   tar: WebDataset style shards of many models, with one sample per view. The files of a sample share the key
+#        <model id><view name> (e.g. 1a2b3c_r_000) and are <key>.png (RGB, as rendered), <key>.depth.exr (depth, as
+#        rendered, or <key>.depth.png with --depth_format png16) and <key>.json (model, view, image size, intrinsics K and 4x4 camera-to-world matrix).
+#        The images are copied byte for byte, so packing costs no decoding or re-encoding.
+#   npz: one compressed numpy file per model, with the arrays names (V), rgb (V, H, W, 4) uint8, depth (V, H, W)
+#        float32 in meters, camera_to_world (V, 4, 4) and K (3, 3).
+# The camera poses follow the conventions of rgbd_camera.py (Blender camera: X right, Y up, looking along -Z).
+#
+# Packing usually runs alongside rendering (render_blender_parallel.py --pack tar), but the outputs of a finished
+# run can also be packed afterwards:
+# Usage: python pack_outputs.py --manifest /path/to/manifest.jsonl --format tar --pack_folder /path/to/packed/
+# Usage: python pack_outputs.py --file /path/to/commands.txt --format npz --pack_folder /path/to/packed/
+#
+# The packed samples are read back with iter_samples, which streams the tar shards without unpacking them:
+#   for sample in pack_outputs.iter_samples(glob.glob('/path/to/packed/*.tar'), decode=True):
+#       sample['rgb'], sample['depth'], sample['K'], sample['camera_to_world']
+#
+# Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
+
+import argparse, io, json, os, queue, socket, tarfile, threading, time
+import numpy as np
+
+import rgbd_camera, rgbd_io
+
+def parse_vector(value):
+    # Vectors come either as lists (manifest) or as strings like 0\,0\,1 (command line)
+    if isinstance(value, str):
+        value = value.replace('\\,', ',').split(',')
+    return np.array(list(map(float, value)))
+
+def model_identifier(model):
+    return os.path.split(model['obj'])[1].split('.')[0]
+
+def model_views(model):
+    # The rendered views of a model (as given by render_blender.py with the options of the model): the image size,
+    # the intrinsics and, for every view, its name, the paths of its .png and .exr files and its camera-to-world matrix
+    identifier = model_identifier(model)
+    folder = os.path.join(os.path.abspath(model.get('output_folder', '/tmp')), identifier)
+    width = int(model.get('image_width', rgbd_camera.IMAGE_WIDTH))
+    height = int(model.get('image_height', rgbd_camera.IMAGE_HEIGHT))
+    ox = width / 2 if model.get('ox') is None else float(model['ox'])
+    oy = height / 2 if model.get('oy') is None else float(model['oy'])
+    K = rgbd_camera.intrinsics_matrix(float(model.get('fx', rgbd_camera.FX)), float(model.get('fy', rgbd_camera.FY)), ox, oy)
+    depth_extension = rgbd_io.DEPTH_EXTENSIONS[model.get('depth_format', 'exr_rgb')]
+    depth_invalid_value = int(model.get('depth_invalid_value', 0))
+
+    # The cameras file written by render_blender.py has the exact poses of every viewpoint set
+    cameras_path = os.path.join(folder, identifier + '_cameras.json')
+    if os.path.exists(cameras_path):
+        cameras = rgbd_camera.read_cameras(cameras_path)
+        views = [{'name': frame['name'], 'rgb': os.path.join(folder, frame['rgb']),
+                  'depth': os.path.join(folder, frame['depth']), 'camera_to_world': frame['camera_to_world']}
+                 for frame in cameras['frames']]
+        return {'model': identifier, 'folder': folder, 'width': cameras['width'], 'height': cameras['height'],
+                'K': cameras['K'], 'views': views, 'depth_invalid_value': depth_invalid_value, 'cameras': cameras_path}
+
+    distance = rgbd_camera.camera_distance(parse_vector(model.get('aligned_dims', '1,1,1')),
+                                           float(model.get('model_distance_scale', 2.1)))
+    # render_blender.py parses --canonical_views with type=bool, so any non-empty value enables them
+    rotations = rgbd_camera.view_rotations(int(model.get('views', 8)), float(model.get('camera_angle', 30)),
+                                           bool(model.get('canonical_views', True)))
+    views = []
+    for name, rx, rz in rotations:
+        fp = os.path.join(folder, identifier + name)
+        views.append({'name': name, 'rgb': fp + '.png', 'depth': fp + '_depth0001' + depth_extension,
+                      'camera_to_world': rgbd_camera.camera_to_world(rx, rz, distance)})
+    return {'model': identifier, 'folder': folder, 'width': width, 'height': height, 'K': K, 'views': views,
+            'depth_invalid_value': depth_invalid_value}
+
+def remove_loose_files(rendered):
+    # Delete the .png and .exr files (and the cameras file) of a packed model, and its folder once it is empty
+    filepaths = [filepath for view in rendered['views'] for filepath in (view['rgb'], view['depth'])]
+    if 'cameras' in rendered:
+        filepaths.append(rendered['cameras'])
+    for filepath in filepaths:
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+    try:
+        os.rmdir(rendered['folder'])
+    except OSError:
+        pass
+
+def pack_model_npz(model, pack_folder):
+    # Write every view of a model in a single compressed .npz file. Returns the path of the file.
+    rendered = model_views(model)
+    rgb = np.stack([rgbd_io.read_png(view['rgb']) for view in rendered['views']])
+    if rgb.ndim == 3:
+        rgb = rgb[..., np.newaxis]
+    depth = np.stack([rgbd_io.read_depth(view['depth'], rendered['depth_invalid_value']) for view in rendered['views']])
+
+    os.makedirs(pack_folder, exist_ok=True)
+    filepath = os.path.join(pack_folder, rendered['model'] + '.npz')
+    # Write to a temporary file first, so that an interrupted run never leaves a partial file behind
+    filepath_tmp = '{}.{}.tmp.npz'.format(filepath[:-len('.npz')], os.getpid())
+    np.savez_compressed(filepath_tmp, names=np.array([view['name'] for view in rendered['views']]),
+                        rgb=rgb, depth=depth, K=rendered['K'],
+                        camera_to_world=np.stack([view['camera_to_world'] for view in rendered['views']]))
+    os.replace(filepath_tmp, filepath)
+    return filepath
+
+class ShardWriter:
+    # Writes the views of many models to tar shards of about max_size bytes. A shard is written as <name>.tar.tmp
+    # and only renamed to <name>.tar once it is complete; on_finalized is then called with the models it holds,
+    # so that their loose files can be deleted. The prefix must be unique per writer (e.g. host name and pid).
+    def __init__(self, pack_folder, prefix, max_size=1024**3, on_finalized=None):
+        self.pack_folder = pack_folder
+        self.prefix = prefix
+        self.max_size = max_size
+        self.on_finalized = on_finalized
+        self.index = 0
+        self.tar = None
+        self.filepath = None
+        self.models = []
+        os.makedirs(pack_folder, exist_ok=True)
+
+    def open_shard(self):
+        # Never overwrite the shards of a previous run with the same prefix
+        while True:
+            self.filepath = os.path.join(self.pack_folder, '{}-{:06d}.tar'.format(self.prefix, self.index))
+            self.index += 1
+            if not os.path.exists(self.filepath):
+                break
+        self.tar = tarfile.open(self.filepath + '.tmp', 'w', format=tarfile.PAX_FORMAT)
+
+    def add_bytes(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def add_file(self, name, filepath):
+        info = tarfile.TarInfo(name)
+        info.size = os.path.getsize(filepath)
+        info.mtime = time.time()
+        with open(filepath, 'rb') as file:
+            self.tar.addfile(info, file)
+
+    def add_model(self, model, context=None):
+        # Append the views of a model, in view order. context is handed back to on_finalized with the model.
+        rendered = model_views(model)
+        # Check the files first, so that a shard never holds some of the views of a model
+        for view in rendered['views']:
+            for filepath in (view['rgb'], view['depth']):
+                if not os.path.exists(filepath):
+                    raise FileNotFoundError(filepath)
+        if self.tar is None:
+            self.open_shard()
+        for view in rendered['views']:
+            key = rendered['model'] + view['name']
+            metadata = {'model': rendered['model'], 'view': view['name'], 'width': rendered['width'],
+                        'height': rendered['height'], 'K': rendered['K'].tolist(),
+                        'camera_to_world': view['camera_to_world'].tolist()}
+            if view['depth'].endswith('.png'):
+                metadata['depth_invalid_value'] = rendered['depth_invalid_value']
+            self.add_file(key + '.png', view['rgb'])
+            self.add_file(key + '.depth' + os.path.splitext(view['depth'])[1], view['depth'])
+            self.add_bytes(key + '.json', json.dumps(metadata).encode())
+        self.models.append((rendered, context))
+        if self.tar.fileobj.tell() >= self.max_size:
+            self.finalize()
+
+    def finalize(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        with open(self.filepath + '.tmp', 'rb+') as file:
+            os.fsync(file.fileno())
+        os.replace(self.filepath + '.tmp', self.filepath)
+        models, self.models, self.tar = self.models, [], None
+        if self.on_finalized is not None:
+            self.on_finalized(models)
+
+    def close(self):
+        self.finalize()
+
+class Packer:
+    # Packs the models of finished commands in a background thread while the next commands render.
+    # on_packed(command) is called once every model of a command is in a finalized shard (or .npz file),
+    # after its loose files were deleted (unless keep_loose is set).
+    def __init__(self, pack_format, pack_folder, shard_size=1024**3, keep_loose=False, on_packed=None):
+        self.pack_format = pack_format
+        self.pack_folder = pack_folder
+        self.keep_loose = keep_loose
+        self.on_packed = on_packed
+        self.remaining = {}
+        self.queue = queue.Queue()
+        self.writer = None
+        if pack_format == 'tar':
+            prefix = 'shard-{}-{}'.format(socket.gethostname(), os.getpid())
+            self.writer = ShardWriter(pack_folder, prefix, shard_size, self.models_finalized)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, command, models):
+        self.queue.put((command, models))
+
+    def models_finalized(self, models):
+        for rendered, command in models:
+            if not self.keep_loose:
+                remove_loose_files(rendered)
+            if command not in self.remaining:
+                # Another model of the command could not be packed
+                continue
+            self.remaining[command] -= 1
+            if self.remaining[command] == 0:
+                del self.remaining[command]
+                if self.on_packed is not None:
+                    self.on_packed(command)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            command, models = item
+            self.remaining[command] = len(models)
+            try:
+                for model in models:
+                    if self.writer is not None:
+                        self.writer.add_model(model, command)
+                    else:
+                        pack_model_npz(model, self.pack_folder)
+                        self.models_finalized([(model_views(model), command)])
+            except Exception as e:
+                # The loose files stay, so the command is packed again by the next run
+                print(f"Error packing the outputs of '{command}': {e}")
+                self.remaining.pop(command, None)
+        if self.writer is not None:
+            self.writer.close()
+
+    def close(self):
+        # Pack what is left and finalize the last shard
+        self.queue.put(None)
+        self.thread.join()
+
+# Extensions of the files of a sample in the tar shards, longest first (keys may contain dots, extensions too)
+SAMPLE_EXTENSIONS = ['depth.exr', 'depth.png', 'png', 'json']
+
+def split_member_name(name):
+    # Key and extension of a file of a tar shard, matching the known extensions from the end of the name
+    for extension in SAMPLE_EXTENSIONS:
+        if name.endswith('.' + extension):
+            return name[:-len(extension) - 1], extension
+    key, _, extension = name.rpartition('.')
+    return key, extension
+
+def sample_from_tar(key, files, decode):
+    metadata = json.loads(files['json'])
+    sample = {'key': key, 'model': metadata['model'], 'view': metadata['view'], 'K': np.array(metadata['K']),
+              'camera_to_world': np.array(metadata['camera_to_world']), 'rgb': files.get('png'), 'depth': files.get('depth.exr', files.get('depth.png'))}
+    if decode:
+        sample['rgb'] = rgbd_io.decode_png(sample['rgb'])
+        sample['depth'] = rgbd_io.decode_depth(sample['depth'], metadata.get('depth_invalid_value', 0))
+    return sample
+
+def iter_samples(paths, decode=False):
+    # Yield one sample per view from .tar shards and .npz files, streaming the shards without unpacking them.
+    # Samples are dictionaries with the keys key, model, view, K, camera_to_world, rgb and depth. The images of the
+    # tar shards are the raw .png and .exr bytes unless decode is set; the ones of .npz files are always arrays.
+    for path in paths:
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                names, rgb, depth = data['names'], data['rgb'], data['depth']
+                K, camera_to_world = data['K'], data['camera_to_world']
+            model = os.path.basename(path)[:-len('.npz')]
+            for i, name in enumerate(names):
+                yield {'key': model + str(name), 'model': model, 'view': str(name), 'K': K,
+                       'camera_to_world': camera_to_world[i], 'rgb': rgb[i], 'depth': depth[i]}
+            continue
+
+        # The files of a sample are consecutive in the shard
+        with tarfile.open(path, 'r|') as tar:
+            key, files = None, {}
+            for member in tar:
+                if not member.isfile():
+                    continue
+                member_key, extension = split_member_name(member.name)
+                if member_key != key:
+                    if files:
+                        yield sample_from_tar(key, files, decode)
+                    key, files = member_key, {}
+                files[extension] = tar.extractfile(member).read()
+            if files:
+                yield sample_from_tar(key, files, decode)
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Packs the renders of render_blender.py into tar shards or .npz files.')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='JSON lines file listing the rendered models, as given to render_blender.py.')
+    parser.add_argument('--file', type=str, default=None,
+                        help='The file containing the list of commands that rendered the models.')
+    parser.add_argument('--format', type=str, default='tar', choices=['tar', 'npz'],
+                        help='WebDataset style tar shards of many models, or one .npz file per model. Default is tar.')
+    parser.add_argument('--pack_folder', type=str,
+                        help='The folder where the packed files are written.')
+    parser.add_argument('--shard_size_mb', type=float, default=1024,
+                        help='Approximate size of the tar shards in MB. Default is 1024.')
+    parser.add_argument('--keep_loose', action='store_true',
+                        help='Keep the .png and .exr files after packing them.')
+    args = parser.parse_args()
+    if (args.manifest is None) == (args.file is None):
+        parser.error('exactly one of --manifest or --file must be given')
+
+    import render_blender_parallel
+    if args.manifest is not None:
+        models = render_blender_parallel.read_manifest(args.manifest)
+    else:
+        commands = render_blender_parallel.read_commands(args.file)
+        models = [model for command in commands for model in render_blender_parallel.command_models(command)]
+
+    start = time.time()
+    packed = []
+    skipped = 0
+    packer = Packer(args.format, args.pack_folder, args.shard_size_mb * 1024**2, args.keep_loose, packed.append)
+    for i, model in enumerate(models):
+        # Models without complete outputs (not rendered, or already packed by a previous run) are left out
+        if not all(os.path.exists(view['rgb']) and os.path.exists(view['depth']) for view in model_views(model)['views']):
+            skipped += 1
+            continue
+        packer.submit(i, [model])
+    packer.close()
+    print('{} models packed, {} skipped in {:.1f} s'.format(len(packed), skipped, time.time() - start))
+
+if __name__ == "__main__":
+    main()
@@ -10,13 +10,65 @@
 # Example (run from the Blender installation directory):
 # blender --background --python /path/to/render_blender.py -- --output_folder /path/to/outputs --up 0\,0\,1 --front 1\,0\,0 --aligned_dims 1.0\,1.0\,1.0 --unit 1.0 /path/to/my.obj
 #
+# Re-rendering the same models (e.g. with other views or lights) can skip the import and mesh preprocessing with --mesh_cache_folder.
+# With --texture_folder /path/to/ShapeNetSem/models-textures/textures, the textures are found there instead of next to the
+# .obj files, so the textures do not need to be copied into the models folder (see also stage_models.py).
+#
+# The depth maps are 32-bit float OpenEXR files with three identical channels by default. --depth_format exr writes a
+# single channel instead (--depth_exr_codec ZIP, PIZ or DWAA, --depth_precision full or half), and --depth_format png16
+# writes 16-bit PNG files in millimeters like the Kinect (pixels without depth get --depth_invalid_value).
+# The loss of each format is documented in rgbd_io.py.
+#
+# The views are a turntable around the model by default (--viewpoints turntable, with --views azimuths at --camera_angle
+# elevation). Other viewpoint sets are turntables at several elevations (--viewpoints elevations --elevations 0,30,60),
+# a Fibonacci sphere (--viewpoints fibonacci --viewpoint_count 50) and a pose file (--viewpoints file --pose_file
+# /path/to/poses.json, a list of {"name": "_my_view", "elevation": 30, "azimuth": 45} in degrees). The canonical views
+# are added to every set but the pose file. With --render_mode animation, the poses are keyframed on the timeline and
+# all the views are rendered with a single animation render, paying the per-render setup only once.
+# Every model gets a <model id>_cameras.json file with the intrinsics K and, for every frame, the view name, the file
+# names and the 4x4 camera-to-world matrix (Blender convention: X right, Y up, looking along -Z).
+#
+# --profile fast, balanced or reference trades fidelity for throughput (passes, samples, denoising, render threads and
+# decimation of the meshes over a face budget, see QUALITY_PROFILES); --samples, --threads and --max_faces override it.
+#
+# With --stats_file /path/to/stats.jsonl, one JSON record is appended per model with the wall-clock time of every
+# phase (import, scaling, remove doubles, edge split, centering, mesh cache, rendering and compositing of the views,
+# cleanup), the vertex, face, material and texture counts and the peak memory of the Blender process.
+# render_blender_parallel.py adds this option to the commands it runs and aggregates the records in a run report.
+#
+# Batch mode, rendering every model listed in a manifest with a single Blender process:
+# blender --background --python /path/to/render_blender.py -- --output_folder /path/to/outputs --manifest /path/to/manifest.jsonl
+#
+# The manifest has one JSON object per line, with the keys "obj" (required), "up", "front", "unit", "aligned_dims"
+# and "output_folder" (optional, the command line values are used when missing). Vectors can be given either as
+# lists of numbers or as strings in the command line format, e.g.
+# {"obj": "/path/to/my.obj", "up": [0, 0, 1], "front": [1, 0, 0], "unit": 1.0, "aligned_dims": [1.0, 1.0, 1.0]}
+#
 # Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
 # Forked from: https://github.com/panmari/stanford-shapenet-renderer
 
-import argparse, sys, os, math
+import argparse, sys, os, math, json, traceback, tempfile, hashlib, time, contextlib
 import bpy
 import mathutils
 
+# Helper modules shipped next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import rgbd_camera, rgbd_io
+
+# Render quality profiles, trading fidelity for throughput. 'default' leaves Blender's settings untouched (as before
+# the profiles existed). The other profiles only enable the passes used by the compositor (Image, Alpha and Depth),
+# set the anti-aliasing samples of EEVEE (taa_render_samples, 64 by default) or the path tracing samples of Cycles
+# (128 by default), the Cycles denoiser, the number of render threads of each Blender instance (0 for one per core)
+# and the face budget above which meshes are decimated (0 for no decimation). The cost per view of each profile and
+# its error against the reference profile depend on the machine and the models; measure them with
+# benchmark.py --stages render --profiles default,fast,balanced,reference (see the README "Quality profiles" section).
+QUALITY_PROFILES = {
+    'default': None,
+    'fast': {'extra_passes': False, 'eevee_samples': 4, 'cycles_samples': 16, 'denoise': True, 'threads': 2, 'max_faces': 100000},
+    'balanced': {'extra_passes': False, 'eevee_samples': 16, 'cycles_samples': 64, 'denoise': True, 'threads': 0, 'max_faces': 500000},
+    'reference': {'extra_passes': False, 'eevee_samples': 64, 'cycles_samples': 256, 'denoise': False, 'threads': 0, 'max_faces': 0},
+}
+
 # Parse command line arguments
 parser = argparse.ArgumentParser(description='Renders given obj file by rotating a camera around it.')
 parser.add_argument('--up', type=str, default = '0\\,-1\\,0',
@@ -35,8 +87,10 @@ parser.add_argument('--canonical_views', type=bool, default=True,
                     help='Whether to render top, bottom, left, right, front and back views in addition to turntable views.')
 parser.add_argument('--model_distance_scale', type=float, default=2.1,
                     help='Scaling factor used to compute the distance from the the model to the camera.')
-parser.add_argument('obj', type=str,
+parser.add_argument('obj', type=str, nargs='?', default=None,
                     help='Path to the obj file to be rendered.')
+parser.add_argument('--manifest', type=str, default=None,
+                    help='Path to a JSON lines file listing the models to render in batch mode (one Blender process for all of them).')
 parser.add_argument('--output_folder', type=str, default='/tmp',
                     help='The path the output will be dumped to.')
 parser.add_argument('--remove_doubles', type=bool, default=True,
@@ -45,20 +99,72 @@ parser.add_argument('--edge_split', type=bool, default=True,
                     help='Adds edge split filter.')
 parser.add_argument('--engine', type=str, default='BLENDER_EEVEE',
                     help='Blender internal engine for rendering. E.g. CYCLES, BLENDER_EEVEE, ...')
+parser.add_argument('--image_width', type=int, default=rgbd_camera.IMAGE_WIDTH,
+                    help='Width of the rendered images in pixels.')
+parser.add_argument('--image_height', type=int, default=rgbd_camera.IMAGE_HEIGHT,
+                    help='Height of the rendered images in pixels.')
+parser.add_argument('--fx', type=float, default=rgbd_camera.FX,
+                    help='Focal length in pixels along the image width.')
+parser.add_argument('--fy', type=float, default=rgbd_camera.FY,
+                    help='Focal length in pixels along the image height.')
+parser.add_argument('--ox', type=float, default=None,
+                    help='Principal point along the image width. Default is the image center.')
+parser.add_argument('--oy', type=float, default=None,
+                    help='Principal point along the image height. Default is the image center.')
+parser.add_argument('--camera_fov', type=float, default=rgbd_camera.CAMERA_FOV,
+                    help='Camera field of view in degrees.')
+parser.add_argument('--projection_cache_folder', type=str,
+                    default=os.path.join(tempfile.gettempdir(), 'shapenetsem_to_rgbd_cache'),
+                    help='Folder where the projection factor maps are cached. Use an empty string to disable the cache.')
+parser.add_argument('--mesh_cache_folder', type=str, default=None,
+                    help='Folder where the imported and preprocessed meshes are cached as .blend files. Disabled by default.')
+parser.add_argument('--mesh_cache_max_size_gb', type=float, default=20.0,
+                    help='The least recently used meshes are evicted from the mesh cache above this size.')
+parser.add_argument('--profile', type=str, default='default', choices=list(QUALITY_PROFILES),
+                    help='Render quality profile (passes, samples, denoising, threads and mesh decimation). The default profile leaves the Blender settings untouched.')
+parser.add_argument('--samples', type=int, default=None,
+                    help='Render samples (EEVEE anti-aliasing or Cycles path tracing), overriding the profile.')
+parser.add_argument('--threads', type=int, default=None,
+                    help='Render threads of this Blender instance (0 for one per core), overriding the profile.')
+parser.add_argument('--max_faces', type=int, default=None,
+                    help='Decimate the meshes with more faces than this (0 disables it), overriding the profile.')
+parser.add_argument('--texture_folder', type=str, default=None,
+                    help='Folder searched for the textures that are not next to the .obj file (e.g. ShapeNetSem models-textures/textures), instead of copying them.')
+parser.add_argument('--depth_format', type=str, default='exr_rgb', choices=rgbd_io.DEPTH_FORMATS,
+                    help='OpenEXR with three identical channels, single channel OpenEXR or 16-bit PNG in millimeters.')
+parser.add_argument('--depth_exr_codec', type=str, default='ZIP', choices=['ZIP', 'PIZ', 'DWAA'],
+                    help='Compression of the single channel OpenEXR depth maps. DWAA is lossy.')
+parser.add_argument('--depth_precision', type=str, default='full', choices=['full', 'half'],
+                    help='32-bit or 16-bit floats for the single channel OpenEXR depth maps.')
+parser.add_argument('--depth_invalid_value', type=int, default=0,
+                    help='Value of the pixels without depth in the 16-bit PNG depth maps.')
+parser.add_argument('--viewpoints', type=str, default='turntable', choices=rgbd_camera.VIEWPOINT_SETS,
+                    help='The set of views to render: a turntable, turntables at several elevations, a Fibonacci sphere or a pose file.')
+parser.add_argument('--elevations', type=str, default='0\\,30\\,60',
+                    help='Camera elevations in degrees of the elevations viewpoint set.')
+parser.add_argument('--viewpoint_count', type=int, default=50,
+                    help='Number of views of the fibonacci viewpoint set.')
+parser.add_argument('--pose_file', type=str, default=None,
+                    help='JSON file listing the views of the file viewpoint set, with their name, elevation and azimuth in degrees.')
+parser.add_argument('--render_mode', type=str, default='stills', choices=['stills', 'animation'],
+                    help='Render every view separately, or keyframe the views and render them as a single animation.')
+parser.add_argument('--stats_file', type=str, default=None,
+                    help='JSON lines file where a record with the timing of every phase and the mesh statistics of each model is appended.')
 
 argv = sys.argv[sys.argv.index("--") + 1:]
 args = parser.parse_args(argv)
-
-# Camera intrinsics (for a kinect camera)
-ImageWidth = 640
-ImageHeight = 480
-ox = ImageWidth/2
-oy = ImageHeight/2
-CameraFOV = 57
-fx = 588
-fy = 588
+if (args.obj is None) == (args.manifest is None):
+    parser.error('exactly one of obj or --manifest must be given')
+
+# Camera intrinsics (a kinect camera by default)
+ImageWidth = args.image_width
+ImageHeight = args.image_height
+ox = ImageWidth/2 if args.ox is None else args.ox
+oy = ImageHeight/2 if args.oy is None else args.oy
+CameraFOV = args.camera_fov
+fx = args.fx
+fy = args.fy
 K = mathutils.Matrix(((fx, 0, ox), (0, fy, oy), (0, 0, 1)))
-Kinv = K.inverted()
 
 # Camera clipping (in meters)
 Clip_start = 0.1
@@ -67,25 +173,9 @@ Clip_end = 10
 # Image with the conversion factor from point projection to plane projection
 # (Blender captures the depth to the camera center, so we need to convert it to the depth to the camera plane
 # in order to simulate the depth map that would be obtained by a real camera)
-projection_image = [[0]*ImageWidth for _ in range(ImageHeight)]
-for w in range(ImageWidth):
-    for h in range(ImageHeight):
-        # Back-project pixel to 3D space
-        pixel_vector = mathutils.Vector((w, h, 1)) # homogeneous coordinates
-        world_vector = Kinv @ pixel_vector
-        world_vector.normalize()
-        projection_image[ImageHeight - 1 - h][w] = world_vector.z
-
-# Convert the projection_image to a flat array in RGBA, column-major format
-# since Blender uses column-major format for images
-projection_image_flat = [item for sublist in projection_image for item in sublist]
-projection_image_rgba_flat = []
-if args.engine == 'CYCLES':
-    for value in projection_image_flat:
-        projection_image_rgba_flat.extend([value, value, value, 1.0])
-else:
-    for value in projection_image_flat:
-        projection_image_rgba_flat.extend([1.0, 1.0, 1.0, 1.0])
+# The map is built with numpy as a flat RGBA array and cached on disk for each set of intrinsics and engine.
+projection_image_rgba_flat = rgbd_camera.cached_projection_factor_rgba(args.projection_cache_folder or None,
+                                                                       ImageWidth, ImageHeight, fx, fy, ox, oy, args.engine)
 
 # Set up rendering
 context = bpy.context
@@ -102,8 +192,27 @@ render.resolution_percentage = 100
 render.film_transparent = True
 
 scene.use_nodes = True
-scene.view_layers["View Layer"].use_pass_normal = True
-scene.view_layers["View Layer"].use_pass_diffuse_color = True
+# The settings of the quality profile, with the command line overrides
+profile = dict(QUALITY_PROFILES[args.profile] or {})
+for option in ('samples', 'threads', 'max_faces'):
+    if getattr(args, option) is not None:
+        profile[option] = getattr(args, option)
+max_faces = profile.get('max_faces', 0)
+# The normal and diffuse color passes are not used by the compositor
+scene.view_layers["View Layer"].use_pass_normal = profile.get('extra_passes', True)
+scene.view_layers["View Layer"].use_pass_diffuse_color = profile.get('extra_passes', True)
+if 'samples' in profile or 'eevee_samples' in profile:
+    scene.eevee.taa_render_samples = profile.get('samples', profile.get('eevee_samples'))
+if 'samples' in profile or 'cycles_samples' in profile:
+    scene.cycles.samples = profile.get('samples', profile.get('cycles_samples'))
+if 'denoise' in profile and args.engine == 'CYCLES':
+    scene.cycles.use_denoising = profile['denoise']
+    scene.view_layers["View Layer"].cycles.use_denoising = profile['denoise']
+if profile.get('threads'):
+    render.threads_mode = 'FIXED'
+    render.threads = profile['threads']
+elif 'threads' in profile:
+    render.threads_mode = 'AUTO'
 scene.unit_settings.system = 'METRIC'
 scene.unit_settings.system_rotation = 'RADIANS'
 
@@ -120,7 +229,7 @@ render_layers = nodes.new('CompositorNodeRLayers')
 
 # Create a node with the projection_image_rgba_flat as the image
 projection_image_object = bpy.data.images.new("OutputImage", width=ImageWidth, height=ImageHeight)
-projection_image_object.pixels = projection_image_rgba_flat # Blender always stores pixel data as 32-bit floating point numbers
+projection_image_object.pixels.foreach_set(projection_image_rgba_flat) # Blender always stores pixel data as 32-bit floating point numbers
 projection_image_texture_node = nodes.new('CompositorNodeImage')
 projection_image_texture_node.image = projection_image_object
 
@@ -151,8 +260,19 @@ depth_file_output.label = 'Depth Output'
 depth_file_output.base_path = ''
 depth_file_output.file_slots[0].use_node_format = True
 depth_file_output.format.file_format = 'OPEN_EXR'
-depth_file_output.format.color_mode = 'RGB'
-depth_file_output.format.color_depth = '32'
+if args.depth_format == 'exr_rgb':
+    depth_file_output.format.color_mode = 'RGB'
+    depth_file_output.format.color_depth = '32'
+elif args.depth_format == 'exr':
+    depth_file_output.format.color_mode = 'BW'
+    depth_file_output.format.color_depth = '16' if args.depth_precision == 'half' else '32'
+    depth_file_output.format.exr_codec = args.depth_exr_codec
+else:
+    # Blender would apply the view transform to a PNG, so the depth goes through a lossless temporary OpenEXR file
+    # that is converted to millimeters after the render
+    depth_file_output.format.color_mode = 'BW'
+    depth_file_output.format.color_depth = '32'
+    depth_file_output.format.exr_codec = 'NONE'
 
 # Link nodes to produce the depth map with distance to camera plane
 # and save it to a file
@@ -169,67 +289,6 @@ links.new(multiply_node_2.outputs[0], depth_file_output.inputs[0])
 context.active_object.select_set(True)
 bpy.ops.object.delete()
 
-# Import textured mesh
-bpy.ops.object.select_all(action='DESELECT')
-
-bpy.ops.import_scene.obj(filepath=args.obj)
-
-obj = bpy.context.selected_objects[0]
-context.view_layer.objects.active = obj
-
-# Get model orientation
-# Split the string by '\\,' and convert each element to float
-up_model = mathutils.Vector(list(map(float, args.up.split('\\,'))))
-front_model = mathutils.Vector(list(map(float, args.front.split('\\,'))))
-up_blender = mathutils.Vector((0.0, 0.0, 1.0))
-front_blender = mathutils.Vector((0.0, -1.0, 0.0))
-
-# Compute rotation to align up_model and front_model with up_blender and front_blender
-rotation_up = up_model.rotation_difference(up_blender)
-front_model_rotated = rotation_up @ front_model
-rotation_front = front_model_rotated.rotation_difference(front_blender)
-rotation = rotation_front @ rotation_up
-rotation_matrix = rotation.to_matrix().to_4x4()
-
-# Apply the rotation to the object's matrix world
-obj.matrix_world = rotation_matrix @ obj.matrix_world
-
-# Possibly disable specular shading
-for slot in obj.material_slots:
-    node = slot.material.node_tree.nodes['Principled BSDF']
-    node.inputs['Specular'].default_value = 0.05
-
-# Scale the object
-bpy.ops.transform.resize(value=(args.unit,args.unit,args.unit))
-bpy.ops.object.transform_apply(scale=True)
-
-if args.remove_doubles:
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.mesh.remove_doubles()
-    bpy.ops.object.mode_set(mode='OBJECT')
-if args.edge_split:
-    bpy.ops.object.modifier_add(type='EDGE_SPLIT')
-    context.object.modifiers["EdgeSplit"].split_angle = 1.32645
-    bpy.ops.object.modifier_apply(modifier="EdgeSplit")
-
-'''
-# Compute the geometric center of the object
-center = sum((mathutils.Vector(vertex.co) for vertex in obj.data.vertices), mathutils.Vector()) / len(obj.data.vertices)
-# Center the object's geometry
-for vertex in obj.data.vertices:
-    vertex.co -= center
-# Update the scene
-bpy.context.view_layer.update()
-'''
-
-# Compute the geometric center of the object's bounding box
-local_bbox_center = 0.125 * sum((mathutils.Vector(b) for b in obj.bound_box), mathutils.Vector())
-# Translate the mesh
-bpy.ops.object.mode_set(mode='EDIT')
-bpy.ops.mesh.select_all(action='SELECT')
-bpy.ops.transform.translate(value=-local_bbox_center)
-bpy.ops.object.mode_set(mode='OBJECT')
-
 # Make light just directional, disable shadows.
 light = bpy.data.lights['Light']
 light.type = 'SUN'
@@ -247,11 +306,8 @@ light2.energy = 0.015
 bpy.data.objects['Sun'].rotation_euler = bpy.data.objects['Light'].rotation_euler
 bpy.data.objects['Sun'].rotation_euler[0] += 180
 
-# Place camera
+# Set up camera (the distance to the model is set for each model)
 cam = scene.objects['Camera']
-aligned_dims = mathutils.Vector(list(map(float, args.aligned_dims.split('\\,'))))
-max_model_dimension = max(aligned_dims) / 100.0 # in meters
-cam.location = (0.0, args.model_distance_scale * max_model_dimension, 0.0)
 cam.data.type = 'PERSP'
 cam.data.lens_unit = 'FOV'
 cam.data.angle = math.radians(CameraFOV)
@@ -274,53 +330,468 @@ scene.collection.objects.link(cam_empty)
 context.view_layer.objects.active = cam_empty
 cam_constraint.target = cam_empty
 
-stepsize = 360.0 / args.views
 rotation_mode = 'XYZ'
 
-model_identifier = os.path.split(args.obj)[1].split('.')[0]
-fp = os.path.join(os.path.abspath(args.output_folder), model_identifier, model_identifier)
+def parse_vector(value):
+    # Vectors come either as lists (manifest) or as strings like 0\,0\,1 (command line).
+    # Plain commas are also accepted, since some shells strip the backslashes.
+    if isinstance(value, str):
+        value = value.replace('\\,', ',').split(',')
+    return mathutils.Vector(list(map(float, value)))
+
+# Wall-clock time of the phases of the model being rendered, in seconds
+phase_times = {}
+
+@contextlib.contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_times[phase] = phase_times.get(phase, 0.0) + time.perf_counter() - start
+
+# Blender calls these handlers around the rendering of each view. The compositor (which writes the depth map) runs
+# between composite_pre and render_post, and the .png is saved right before render_post. Blender versions without the
+# composite handlers count the compositing in the render phase.
+render_events = {}
+
+def record_render_event(event):
+    def handler(*_):
+        render_events[event] = time.perf_counter()
+    return handler
+
+for event in ('render_pre', 'composite_pre', 'render_post'):
+    handlers = getattr(bpy.app.handlers, event, None)
+    if handlers is not None:
+        handlers.append(record_render_event(event))
+
+def peak_rss():
+    # Peak resident memory of the Blender process so far, in bytes
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import ctypes, ctypes.wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', ctypes.wintypes.DWORD), ('PageFaultCount', ctypes.wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except (AttributeError, OSError):
+        pass
+    return None
+
+def model_images(materials):
+    # The images of the texture nodes of the materials
+    images = set()
+    for material in materials:
+        if material.node_tree is not None:
+            for node in material.node_tree.nodes:
+                if node.type == 'TEX_IMAGE' and node.image is not None:
+                    images.add(node.image)
+    return images
+
+def mesh_statistics(imported_objects):
+    # Vertex, face, material and texture counts of the imported model
+    meshes = [obj.data for obj in imported_objects if obj.type == 'MESH']
+    materials = {slot.material for obj in imported_objects for slot in obj.material_slots if slot.material is not None}
+    images = model_images(materials)
+    return {'vertices': sum(len(mesh.vertices) for mesh in meshes), 'faces': sum(len(mesh.polygons) for mesh in meshes),
+            'materials': len(materials), 'textures': len(images),
+            'texture_pixels': sum(image.size[0] * image.size[1] for image in images)}
+
+def decimate_model(imported_objects):
+    # Collapse the edges of the meshes of a model with more faces than the face budget, sharing the budget between
+    # the meshes in proportion to their face counts
+    meshes = [obj for obj in imported_objects if obj.type == 'MESH']
+    faces = sum(len(obj.data.polygons) for obj in meshes)
+    if faces <= max_faces:
+        return
+    ratio = max_faces / faces
+    for obj in meshes:
+        context.view_layer.objects.active = obj
+        modifier = obj.modifiers.new(name='Decimate', type='DECIMATE')
+        modifier.ratio = ratio
+        bpy.ops.object.modifier_apply(modifier=modifier.name)
+    context.view_layer.objects.active = imported_objects[0]
+
+# Path of every texture of --texture_folder by its lower case file name, listed once per Blender process
+texture_paths = None
+
+def resolve_textures(imported_objects):
+    # Point the images that the importer did not find next to the .obj file to the textures of --texture_folder
+    global texture_paths
+    if texture_paths is None:
+        texture_paths = {}
+        for root, _, filenames in os.walk(args.texture_folder):
+            for filename in filenames:
+                texture_paths.setdefault(filename.lower(), os.path.join(root, filename))
+    materials = {slot.material for obj in imported_objects for slot in obj.material_slots if slot.material is not None}
+    for image in model_images(materials):
+        if image.source != 'FILE' or os.path.exists(bpy.path.abspath(image.filepath)):
+            continue
+        filepath = texture_paths.get(os.path.basename(image.filepath.replace('\\', '/')).lower())
+        if filepath is not None:
+            image.filepath = filepath
+            image.reload()
+
+def import_model(obj_path, up, front, unit):
+    # Import textured mesh
+    bpy.ops.object.select_all(action='DESELECT')
+
+    with timed('import'):
+        # With a texture folder, skip the importer's recursive search of the models folder for the missing textures
+        bpy.ops.import_scene.obj(filepath=obj_path, use_image_search=args.texture_folder is None)
+
+    imported_objects = list(bpy.context.selected_objects)
+    if args.texture_folder is not None:
+        with timed('textures'):
+            resolve_textures(imported_objects)
+    obj = imported_objects[0]
+    context.view_layer.objects.active = obj
+
+    # Get model orientation
+    up_model = parse_vector(up)
+    front_model = parse_vector(front)
+    up_blender = mathutils.Vector((0.0, 0.0, 1.0))
+    front_blender = mathutils.Vector((0.0, -1.0, 0.0))
+
+    # Compute rotation to align up_model and front_model with up_blender and front_blender
+    rotation_up = up_model.rotation_difference(up_blender)
+    front_model_rotated = rotation_up @ front_model
+    rotation_front = front_model_rotated.rotation_difference(front_blender)
+    rotation = rotation_front @ rotation_up
+    rotation_matrix = rotation.to_matrix().to_4x4()
+
+    # Apply the rotation to the object's matrix world
+    obj.matrix_world = rotation_matrix @ obj.matrix_world
+
+    # Possibly disable specular shading
+    for slot in obj.material_slots:
+        node = slot.material.node_tree.nodes['Principled BSDF']
+        node.inputs['Specular'].default_value = 0.05
+
+    # Scale the object
+    with timed('scale'):
+        bpy.ops.transform.resize(value=(unit,unit,unit))
+        bpy.ops.object.transform_apply(scale=True)
+
+    if args.remove_doubles:
+        with timed('remove_doubles'):
+            bpy.ops.object.mode_set(mode='EDIT')
+            bpy.ops.mesh.remove_doubles()
+            bpy.ops.object.mode_set(mode='OBJECT')
+    if args.edge_split:
+        with timed('edge_split'):
+            bpy.ops.object.modifier_add(type='EDGE_SPLIT')
+            context.object.modifiers["EdgeSplit"].split_angle = 1.32645
+            bpy.ops.object.modifier_apply(modifier="EdgeSplit")
+    if max_faces > 0:
+        with timed('decimate'):
+            decimate_model(imported_objects)
+
+    '''
+    # Compute the geometric center of the object
+    center = sum((mathutils.Vector(vertex.co) for vertex in obj.data.vertices), mathutils.Vector()) / len(obj.data.vertices)
+    # Center the object's geometry
+    for vertex in obj.data.vertices:
+        vertex.co -= center
+    # Update the scene
+    bpy.context.view_layer.update()
+    '''
+
+    # Compute the geometric center of the object's bounding box
+    local_bbox_center = 0.125 * sum((mathutils.Vector(b) for b in obj.bound_box), mathutils.Vector())
+    # Translate the mesh
+    with timed('center'):
+        bpy.ops.object.mode_set(mode='EDIT')
+        bpy.ops.mesh.select_all(action='SELECT')
+        bpy.ops.transform.translate(value=-local_bbox_center)
+        bpy.ops.object.mode_set(mode='OBJECT')
+
+    return imported_objects
+
+# Version of the preprocessing in import_model, part of the mesh cache key. Increment it when import_model changes.
+MESH_CACHE_VERSION = 1
+
+def mesh_cache_key(obj_path, up, front, unit):
+    # Hash of the .obj and .mtl files and of every option that changes the preprocessed mesh
+    sha = hashlib.sha1()
+    mtl_filenames = []
+    with open(obj_path, 'rb') as file:
+        for line in file:
+            sha.update(line)
+            if line.startswith(b'mtllib'):
+                mtl_filenames.append(line.split(None, 1)[1].strip().decode(errors='replace'))
+    for mtl_filename in mtl_filenames:
+        try:
+            with open(os.path.join(os.path.dirname(obj_path), mtl_filename), 'rb') as file:
+                sha.update(file.read())
+        except OSError:
+            pass
+    options = (MESH_CACHE_VERSION, tuple(parse_vector(up)), tuple(parse_vector(front)), unit, args.remove_doubles, args.edge_split)
+    if max_faces > 0:
+        # Only added when decimating, so that the keys of the existing cache entries do not change
+        options += (max_faces,)
+    if args.texture_folder is not None:
+        # The cached images point to the textures found there, so another texture folder needs another entry
+        options += ('texture_folder', os.path.realpath(args.texture_folder))
+    sha.update(repr(options).encode())
+    return sha.hexdigest()
+
+def load_cached_model(cache_path):
+    # Append the objects of a cached .blend file (with their meshes, materials and images) to the scene
+    with bpy.data.libraries.load(cache_path, link=False) as (data_from, data_to):
+        data_to.objects = data_from.objects
+    for obj in data_to.objects:
+        scene.collection.objects.link(obj)
+    # Mark the entry as recently used, for the eviction
+    os.utime(cache_path)
+    return list(data_to.objects)
+
+def save_cached_model(cache_path, imported_objects):
+    # Write to a temporary file first, so that concurrent Blender instances never load a partial file
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    cache_path_tmp = '{}.{}.tmp.blend'.format(cache_path[:-len('.blend')], os.getpid())
+    bpy.data.libraries.write(cache_path_tmp, set(imported_objects), compress=False)
+    os.replace(cache_path_tmp, cache_path)
+    evict_cached_models(os.path.dirname(cache_path), args.mesh_cache_max_size_gb * 1024**3)
+
+def evict_cached_models(cache_folder, max_size):
+    # Remove the least recently used entries until the cache fits in max_size bytes
+    entries = []
+    for filename in os.listdir(cache_folder):
+        if filename.endswith('.blend') and '.tmp.' not in filename:
+            try:
+                stat = os.stat(os.path.join(cache_folder, filename))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, filename in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_folder, filename))
+        except OSError:
+            pass
+        total_size -= size
+
+def load_model(obj_path, up, front, unit):
+    # Import and preprocess the model, or load it from the mesh cache when it was already preprocessed
+    if args.mesh_cache_folder is None:
+        return import_model(obj_path, up, front, unit)
+    with timed('cache_key'):
+        cache_path = os.path.join(args.mesh_cache_folder, mesh_cache_key(obj_path, up, front, unit) + '.blend')
+    if os.path.exists(cache_path):
+        try:
+            with timed('cache_load'):
+                return load_cached_model(cache_path)
+        except (OSError, RuntimeError):
+            # Removed by another instance in the meantime, or corrupted
+            traceback.print_exc()
+    imported_objects = import_model(obj_path, up, front, unit)
+    with timed('cache_save'):
+        save_cached_model(cache_path, imported_objects)
+    return imported_objects
+
+# The kinds of datablocks created by importing (or loading from the mesh cache) a model, in the order they are removed
+MODEL_DATABLOCKS = ('objects', 'meshes', 'materials', 'textures', 'images')
+
+def model_datablocks():
+    # The datablocks that exist before a model is imported, to purge only the ones created for the model
+    return {name: set(getattr(bpy.data, name)) for name in MODEL_DATABLOCKS}
+
+def purge_model(existing):
+    # Remove the datablocks created since existing was taken (the objects of the model and their meshes, materials,
+    # textures and images, also when the import failed half way), so that the next model in a batch starts from the
+    # same scene as the first one. The images of the renders and of the compositor are kept.
+    for name in MODEL_DATABLOCKS:
+        collection = getattr(bpy.data, name)
+        for block in list(collection):
+            if block in existing[name]:
+                continue
+            if name == 'images' and block.type in ('RENDER_RESULT', 'COMPOSITING'):
+                continue
+            if name == 'objects' or block.users == 0:
+                collection.remove(block)
+
+def convert_depth_png(render_file_path, depth_tmp_path):
+    with timed('depth_png'):
+        depth = rgbd_io.read_depth(depth_tmp_path)
+        rgbd_io.write_depth(render_file_path + "_depth0001.png", depth, 'png16', invalid_value=args.depth_invalid_value)
+        os.remove(depth_tmp_path)
+
+def record_render_times(start, end):
+    # Split the time of the render call with the handler events (when Blender called them)
+    render_start = render_events.get('render_pre', start)
+    render_end = render_events.get('composite_pre', render_events.get('render_post', end))
+    phase_times['render_setup'] = phase_times.get('render_setup', 0.0) + render_start - start
+    phase_times['render'] = phase_times.get('render', 0.0) + render_end - render_start
+    phase_times['composite_write'] = phase_times.get('composite_write', 0.0) + end - render_end
 
 def render_stil(render_file_path):
     scene.render.filepath = render_file_path
-    depth_file_output.file_slots[0].path = render_file_path + "_depth"
+    if args.depth_format == 'png16':
+        depth_file_output.file_slots[0].path = render_file_path + "_depth_tmp"
+    else:
+        depth_file_output.file_slots[0].path = render_file_path + "_depth"
+    render_events.clear()
+    start = time.perf_counter()
     bpy.ops.render.render(write_still=True)
-
-for i in range(0, args.views):
-    print("Rotation {}, {}".format((stepsize * i), math.radians(stepsize * i)))
-    render_file_path = fp + '_r_{0:03d}'.format(int(i * stepsize))
-    render_stil(render_file_path)
-    cam_empty.rotation_euler[2] += math.radians(stepsize)
-
-if args.canonical_views:
-    # Top
-    cam_empty.rotation_euler = (math.radians(90), 0.0, 0.0)
-    render_file_path = fp + '_top'
-    render_stil(render_file_path)
-
-    # Bottom
-    cam_empty.rotation_euler = (math.radians(-90), 0.0, 0.0)
-    render_file_path = fp + '_bottom'
-    render_stil(render_file_path)
-
-    # Left
-    cam_empty.rotation_euler = (0.0, 0.0, math.radians(90))
-    render_file_path = fp + '_left'
-    render_stil(render_file_path)
-
-    # Right
-    cam_empty.rotation_euler = (0.0, 0.0, math.radians(-90))
-    render_file_path = fp + '_right'
-    render_stil(render_file_path)
-
-    # Front
-    cam_empty.rotation_euler = (0.0, 0.0, 0.0)
-    render_file_path = fp + '_front'
-    render_stil(render_file_path)
-
-    # Back
-    cam_empty.rotation_euler = (0.0, 0.0, math.radians(180))
-    render_file_path = fp + '_back'
-    render_stil(render_file_path)
+    end = time.perf_counter()
+    record_render_times(start, end)
+    view_times.append(end - start)
+
+    if args.depth_format == 'png16':
+        # The compositor file output node appends the frame number
+        convert_depth_png(render_file_path, render_file_path + "_depth_tmp0001.exr")
+
+def render_animation(fp, rotations):
+    # Keyframe the views on the timeline and render them all with a single animation render
+    for frame, (_, rx, rz) in enumerate(rotations, 1):
+        cam_empty.rotation_euler = (rx, 0.0, rz)
+        cam_empty.keyframe_insert(data_path='rotation_euler', frame=frame)
+    # Jump from view to view instead of interpolating between them
+    for fcurve in cam_empty.animation_data.action.fcurves:
+        for keyframe in fcurve.keyframe_points:
+            keyframe.interpolation = 'CONSTANT'
+    scene.frame_start = 1
+    scene.frame_end = len(rotations)
+
+    # Both the render and the file output node append the frame number
+    scene.render.filepath = fp + '_frame'
+    depth_file_output.file_slots[0].path = fp + '_depth_frame'
+    start = time.perf_counter()
+    try:
+        bpy.ops.render.render(animation=True)
+    finally:
+        action = cam_empty.animation_data.action
+        cam_empty.animation_data_clear()
+        bpy.data.actions.remove(action)
+        scene.frame_set(1)
+    end = time.perf_counter()
+    phase_times['render'] = phase_times.get('render', 0.0) + end - start
+    view_times.extend([(end - start) / len(rotations)] * len(rotations))
+
+    # Give the frames the names of the renders of the stills mode
+    for frame, (name, _, _) in enumerate(rotations, 1):
+        render_file_path = fp + name
+        os.replace('{}_frame{:04d}.png'.format(fp, frame), render_file_path + '.png')
+        depth_path = '{}_depth_frame{:04d}.exr'.format(fp, frame)
+        if args.depth_format == 'png16':
+            convert_depth_png(render_file_path, depth_path)
+        else:
+            os.replace(depth_path, render_file_path + '_depth0001.exr')
+
+def render_views(obj_path, aligned_dims, output_folder):
+    # Place camera
+    aligned_dims = parse_vector(aligned_dims)
+    max_model_dimension = max(aligned_dims) / 100.0 # in meters
+    cam.location = (0.0, args.model_distance_scale * max_model_dimension, 0.0)
+
+    model_identifier = os.path.split(obj_path)[1].split('.')[0]
+    fp = os.path.join(os.path.abspath(output_folder), model_identifier, model_identifier)
+
+    rotations = rgbd_camera.viewpoints(args.viewpoints, args.views, args.camera_angle, args.canonical_views,
+                                       list(parse_vector(args.elevations)), args.viewpoint_count, args.pose_file)
+    # Camera-to-world matrix of every view, with the camera tracking the model
+    frames = []
+    for frame, (name, rx, rz) in enumerate(rotations, 1):
+        cam_empty.rotation_euler = (rx, 0.0, rz)
+        bpy.context.view_layer.update()
+        frames.append({'frame': frame, 'name': name, 'rgb': model_identifier + name + '.png',
+                       'depth': model_identifier + name + '_depth0001' + rgbd_io.DEPTH_EXTENSIONS[args.depth_format],
+                       'camera_to_world': [list(row) for row in cam.matrix_world]})
+
+    if args.render_mode == 'animation':
+        render_animation(fp, rotations)
+    else:
+        for name, rx, rz in rotations:
+            print("Rotation {}, {}".format(math.degrees(rz), rz))
+            cam_empty.rotation_euler = (rx, 0.0, rz)
+            render_stil(fp + name)
+
+    # Written last, so that its presence means that all the views were rendered
+    rgbd_camera.write_cameras(fp + '_cameras.json', model_identifier, ImageWidth, ImageHeight, [list(row) for row in K],
+                              frames, camera_fov=CameraFOV, viewpoints=args.viewpoints, render_mode=args.render_mode)
+
+# Time of the render call of every view of the model being rendered
+view_times = []
+
+def write_stats(record):
+    # One line per model, written at once so that concurrent Blender instances can share the file
+    with open(args.stats_file, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+def render_model(model):
+    # Render a single model, described by a dictionary with the same keys as a manifest line
+    obj_path = model['obj']
+    phase_times.clear()
+    view_times.clear()
+    start = time.time()
+    record = {'obj': obj_path, 'model': os.path.split(obj_path)[1].split('.')[0], 'status': 'failed', 'start': start,
+              'profile': args.profile}
+    existing = model_datablocks()
+    try:
+        imported_objects = load_model(obj_path,
+                                      model.get('up', args.up),
+                                      model.get('front', args.front),
+                                      float(model.get('unit', args.unit)))
+        record.update(mesh_statistics(imported_objects))
+        render_views(obj_path, model.get('aligned_dims', args.aligned_dims), model.get('output_folder', args.output_folder))
+        record['status'] = 'done'
+    finally:
+        with timed('purge'):
+            purge_model(existing)
+        if args.stats_file is not None:
+            record.update({'duration': time.time() - start, 'phases': dict(phase_times), 'views': list(view_times),
+                           'peak_rss': peak_rss()})
+            write_stats(record)
+
+def read_manifest(manifest_path):
+    models = []
+    with open(manifest_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                models.append(json.loads(line))
+    return models
+
+if args.manifest is None:
+    render_model({'obj': args.obj})
+else:
+    # Batch mode: the scene and compositor were built once above, only the models change
+    models = read_manifest(args.manifest)
+    failed = []
+    for counter, model in enumerate(models, 1):
+        print('Model {} out of {}: {}'.format(counter, len(models), model['obj']))
+        existing = model_datablocks()
+        try:
+            render_model(model)
+        except Exception:
+            # Keep going with the rest of the batch, the failed models are reported at the end
+            traceback.print_exc()
+            failed.append(model['obj'])
+            if bpy.context.object is not None and bpy.context.object.mode != 'OBJECT':
+                bpy.ops.object.mode_set(mode='OBJECT')
+            # The purge of render_model may have failed in edit mode, so remove whatever the model left behind
+            purge_model(existing)
+    print('Rendered {} out of {} models'.format(len(models) - len(failed), len(models)))
+    for obj_path in failed:
+        print('Failed: ', obj_path)
+    if failed:
+        sys.exit(1)
 
 # For debugging the workflow
 #bpy.ops.wm.save_as_mainfile(filepath='debug.blend')
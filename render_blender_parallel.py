@@ -4,33 +4,880 @@
 # Similar to the render_blender.py script, this script is executed from the Blender installation directory.
 # Usage: python /path/to/render_blender_parallel.py --file /path/to/commands.txt
 #
+# The status of every command (pending, running, done or failed, with the attempt count, duration and exit code)
+# is appended to a ledger file (by default /path/to/commands.txt.ledger.jsonl), so the runner can be stopped and
+# restarted at any time: commands whose outputs (14 .png and 14 .exr files per model by default) already exist and
+# are valid are skipped, and failed commands are retried up to --max_attempts times in total. Commands that used up
+# their attempts in previous runs are reported as given up (and the runner exits with an error) until they are run
+# again with --retry_failed.
+#
+# To render with several machines, start a coordinator on one of them, which serves the commands over HTTP:
+# Usage: python /path/to/render_blender_parallel.py --file /path/to/commands.txt --serve 0.0.0.0:8765
+# and then start any number of workers, on any host that sees the same dataset and output folders:
+# Usage: python /path/to/render_blender_parallel.py --coordinator http://coordinator-host:8765
+# Workers lease commands from the coordinator, renew the leases while rendering and report the results.
+# Commands whose worker dies go back to the pool when their lease expires.
+#
+# With --pack tar (or --pack npz), the outputs of every finished command are packed by a background thread while the
+# next commands render (see pack_outputs.py), and the loose .png and .exr files are deleted once they are in a
+# complete shard. Packed commands are marked in the ledger, so later runs skip them without looking for their files.
+# Usage: python /path/to/render_blender_parallel.py --file /path/to/commands.txt --pack tar --pack_folder /path/to/packed/
+#
+# The runner adds --stats_file to the render_blender.py options of every command it runs, and appends the per-model
+# records (time of every phase, mesh statistics and peak memory) to /path/to/commands.txt.stats.jsonl. At the end of
+# the run it prints a report (models/hour, p50/p95/p99 of every phase and the slowest models with their mesh
+# statistics), also written to /path/to/commands.txt.report.json. The report of all the runs so far is printed with
+# Usage: python /path/to/render_blender_parallel.py --file /path/to/commands.txt --report
+#
 # Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
 
 import subprocess
 from concurrent.futures import ThreadPoolExecutor
-import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse, json, math, os, shlex, shutil, signal, socket, tempfile, threading, time, urllib.error, urllib.request, uuid
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+EXR_MAGIC = b'\x76\x2f\x31\x01'
+CANONICAL_VIEWS = ['top', 'bottom', 'left', 'right', 'front', 'back']
+
+def parse_command(command):
+    # Extract the render_blender.py arguments of a command line, i.e. everything after the '--' separator.
+    # Every render_blender.py option takes a value, so the remaining token is the path to the .obj file.
+    tokens = shlex.split(command, posix=(os.name != 'nt'))
+    tokens = [token.strip('"\'') for token in tokens]
+    if '--' in tokens:
+        tokens = tokens[tokens.index('--') + 1:]
+    options = {}
+    positionals = []
+    i = 0
+    while i < len(tokens):
+        if tokens[i].startswith('--') and i + 1 < len(tokens):
+            options[tokens[i][2:]] = tokens[i + 1]
+            i += 2
+        else:
+            positionals.append(tokens[i])
+            i += 1
+    if positionals:
+        options['obj'] = positionals[-1]
+    return options
+
+def view_names(views=8, canonical_views=True):
+    # Names of the renders of a model, as given by render_blender.py
+    stepsize = 360.0 / views
+    names = ['_r_{0:03d}'.format(int(i * stepsize)) for i in range(views)]
+    if canonical_views:
+        names += ['_' + name for name in CANONICAL_VIEWS]
+    return names
+
+def read_manifest(manifest_path):
+    models = []
+    with open(manifest_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                models.append(json.loads(line))
+    return models
+
+def command_models(command):
+    # The models rendered by a command (one model, or every model of a manifest), each with the command line
+    # options merged in, as render_blender.py sees them
+    options = parse_command(command)
+    if 'manifest' in options:
+        models = read_manifest(options.pop('manifest'))
+    elif 'obj' in options:
+        models = [{'obj': options.pop('obj')}]
+    else:
+        return []
+    return [dict(options, **model) for model in models]
+
+def camera_file_outputs(cameras_path):
+    # The cameras file of a model and the renders it lists (just the cameras file when it is missing or broken)
+    try:
+        with open(cameras_path, 'r') as file:
+            frames = json.load(file)['frames']
+    except (OSError, ValueError, KeyError):
+        return [cameras_path]
+    folder = os.path.dirname(cameras_path)
+    outputs = [cameras_path]
+    for frame in frames:
+        outputs += [os.path.join(folder, frame['rgb']), os.path.join(folder, frame['depth'])]
+    return outputs
+
+def expected_outputs(command):
+    # List the files that render_blender.py writes for a command
+    outputs = []
+    for model in command_models(command):
+        views = int(model.get('views', 8))
+        # render_blender.py parses --canonical_views with type=bool, so any non-empty value enables them
+        canonical_views = bool(model.get('canonical_views', True))
+        depth_extension = '.png' if model.get('depth_format') == 'png16' else '.exr'
+        model_identifier = os.path.split(model['obj'])[1].split('.')[0]
+        fp = os.path.join(os.path.abspath(model.get('output_folder', '/tmp')), model_identifier, model_identifier)
+        if model.get('viewpoints', 'turntable') != 'turntable':
+            # The views of the other viewpoint sets are listed by the cameras file, written after the last view
+            outputs += camera_file_outputs(fp + '_cameras.json')
+            continue
+        for name in view_names(views, canonical_views):
+            outputs.append(fp + name + '.png')
+            # The compositor file output node appends the frame number
+            outputs.append(fp + name + '_depth0001' + depth_extension)
+    return outputs
+
+def is_valid_output(filepath):
+    # Cheap validity check: the file exists and starts with the PNG signature or the OpenEXR magic number
+    try:
+        with open(filepath, 'rb') as file:
+            header = file.read(len(PNG_SIGNATURE) + 1)
+    except OSError:
+        return False
+    if filepath.endswith('.png'):
+        return header.startswith(PNG_SIGNATURE) and len(header) > len(PNG_SIGNATURE)
+    if filepath.endswith('.exr'):
+        return header.startswith(EXR_MAGIC) and len(header) > len(EXR_MAGIC)
+    return len(header) > 0
+
+def outputs_complete(command):
+    outputs = expected_outputs(command)
+    return len(outputs) > 0 and all(is_valid_output(filepath) for filepath in outputs)
+
+class Ledger:
+    # Append-only JSON lines file with one record per status change of a command.
+    # The last record of each command wins, and the file is compacted every time it is loaded.
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.records = {}
+        if os.path.exists(filepath):
+            with open(filepath, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A crash may have left a truncated last line
+                        continue
+                    self.records[record['command']] = record
+        self.compact()
+        self.file = open(filepath, 'a')
+
+    def compact(self):
+        filepath_tmp = self.filepath + '.tmp'
+        with open(filepath_tmp, 'w') as file:
+            for record in self.records.values():
+                file.write(json.dumps(record) + '\n')
+        os.replace(filepath_tmp, self.filepath)
+
+    def get(self, command):
+        with self.lock:
+            return self.records.get(command)
+
+    def update(self, command, **fields):
+        with self.lock:
+            record = dict(self.records.get(command, {'command': command, 'attempts': 0}))
+            record.update(fields)
+            record['time'] = time.time()
+            self.records[command] = record
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            return record
+
+    def close(self):
+        self.file.close()
+
+def stats_command(command, stats_path):
+    # Add --stats_file to the render_blender.py options of a command (the ones after the '--' separator)
+    head, separator, tail = command.partition(' -- ')
+    if not separator:
+        return command
+    return '{} -- --stats_file "{}" {}'.format(head, stats_path, tail)
+
+def read_job_stats(stats_path):
+    # The records written by render_blender.py for a job, removing the file
+    records = []
+    try:
+        with open(stats_path, 'r') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # The job was killed while writing
+                    continue
+        os.remove(stats_path)
+    except FileNotFoundError:
+        pass
+    return records
+
+class StatsLog:
+    # Append-only JSON lines file with the per-model records of every command. The jobs write their records to
+    # their own file in a temporary folder, which is collected here when they finish.
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.folder = tempfile.mkdtemp(prefix='render_blender_stats_')
+        self.records = []
+        self.file = open(filepath, 'a')
+
+    def job_command(self, job):
+        # The command line that runs a job, writing its records to its own file
+        job.stats_path = os.path.join(self.folder, uuid.uuid4().hex + '.jsonl')
+        return stats_command(job.command, job.stats_path)
+
+    def collect(self, job, **fields):
+        self.add(job.command, read_job_stats(job.stats_path), **fields)
+
+    def add(self, command, records, **fields):
+        with self.lock:
+            for record in records:
+                record = dict(record, command=command, **fields)
+                self.records.append(record)
+                self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+def read_stats(filepath):
+    records = []
+    with open(filepath, 'r') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+def percentile(values, q):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100.0 * len(ordered)) - 1))]
+
+def run_report(records, elapsed=None, slowest=10):
+    # Aggregate the per-model records: throughput, percentiles of every phase and the slowest models.
+    # Without the elapsed time of the run, the throughput is computed over the time spanned by the records.
+    done = [record for record in records if record.get('status') == 'done']
+    if elapsed is None:
+        elapsed = (max((record['start'] + record['duration'] for record in records), default=0.0) -
+                   min((record['start'] for record in records), default=0.0))
+    phases = {}
+    for record in done:
+        for phase, seconds in record.get('phases', {}).items():
+            phases.setdefault(phase, []).append(seconds)
+        phases.setdefault('view', []).extend(record.get('views', []))
+        phases.setdefault('model', []).append(record['duration'])
+    report = {'models': len(records), 'done': len(done), 'failed': len(records) - len(done), 'elapsed': elapsed,
+              'models_per_hour': len(done) / elapsed * 3600 if elapsed > 0 else None, 'phases': {}}
+    for phase, values in phases.items():
+        if values:
+            report['phases'][phase] = {'count': len(values), 'total': sum(values), 'p50': percentile(values, 50),
+                                       'p95': percentile(values, 95), 'p99': percentile(values, 99)}
+    # Cost per view of every quality profile of render_blender.py, to compare the profiles of several runs
+    profiles = {}
+    for record in done:
+        profiles.setdefault(record.get('profile', 'default'), []).extend(record.get('views', []))
+    report['profiles'] = {profile: {'views': len(values), 'p50': percentile(values, 50), 'p95': percentile(values, 95)}
+                          for profile, values in profiles.items() if values}
+    keys = ('model', 'duration', 'vertices', 'faces', 'materials', 'textures', 'texture_pixels', 'peak_rss', 'command')
+    report['slowest'] = [{key: record.get(key) for key in keys}
+                         for record in sorted(done, key=lambda record: record['duration'], reverse=True)[:slowest]]
+    return report
+
+def print_report(report):
+    rate = report['models_per_hour']
+    print(f"{report['done']} models rendered, {report['failed']} failed in {report['elapsed']:.0f} s"
+          + (f" ({rate:.0f} models/hour)" if rate is not None else ''))
+    if not report['phases']:
+        return
+    print(f"{'phase':<16}{'count':>8}{'total s':>10}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}")
+    for phase, times in sorted(report['phases'].items(), key=lambda item: item[1]['total'], reverse=True):
+        print(f"{phase:<16}{times['count']:>8}{times['total']:>10.1f}{times['p50']:>10.3f}{times['p95']:>10.3f}{times['p99']:>10.3f}")
+    for profile, times in sorted(report.get('profiles', {}).items()):
+        print(f"Profile {profile}: {times['views']} views, {times['p50']:.3f} s per view (p50), {times['p95']:.3f} s (p95)")
+    print('Slowest models:')
+    for record in report['slowest']:
+        peak_rss = '?' if record['peak_rss'] is None else f"{record['peak_rss'] / 1024**2:.0f}"
+        print(f"  {record['model']}: {record['duration']:.1f} s, {record['vertices']} vertices, {record['faces']} faces, "
+              f"{record['materials']} materials, {record['textures']} textures, peak RSS {peak_rss} MB")
+
+def write_report(report, filepath):
+    filepath_tmp = filepath + '.tmp'
+    with open(filepath_tmp, 'w') as file:
+        json.dump(report, file, indent=2)
+    os.replace(filepath_tmp, filepath)
+
+def estimate_job(command, memory_base, memory_factor):
+    # Estimate the cost of a command from the size of the .obj files it renders, which is cheap to get and
+    # proportional to the number of vertices and faces. A batch (manifest) command renders its models one at
+    # a time, so its memory is the one of its largest model, while its cost is the sum over all models.
+    # Manifests written by generate_commands.py already carry the estimated cost of every model.
+    options = parse_command(command)
+    if 'manifest' in options:
+        models = read_manifest(options['manifest'])
+    elif 'obj' in options:
+        models = [{'obj': options['obj']}]
+    else:
+        models = []
+    sizes = []
+    for model in models:
+        if 'cost' in model:
+            sizes.append(model['cost'])
+            continue
+        try:
+            sizes.append(os.path.getsize(model['obj']))
+        except OSError:
+            sizes.append(0)
+    cost = sum(sizes)
+    memory = memory_base + memory_factor * max(sizes, default=0)
+    return cost, memory
+
+def total_memory():
+    # Physical memory of the machine in bytes
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+    if os.name == 'nt':
+        import ctypes
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('sullAvailExtendedVirtual', ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys
+    return 8 * 1024**3
+
+def default_max_workers(memory_budget, typical_job_memory=2 * 1024**3):
+    # One Blender instance per two cores (Blender already renders with several threads),
+    # limited by how many typical jobs fit in the memory budget
+    by_cores = max(1, (os.cpu_count() or 2) // 2)
+    by_memory = max(1, int(memory_budget // typical_job_memory))
+    return min(by_cores, by_memory)
+
+def start_process(command):
+    # Start the command in its own process group, so that a timeout can kill the shell and Blender together
+    if os.name == 'nt':
+        return subprocess.Popen(command, shell=True, creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+    return subprocess.Popen(command, shell=True, start_new_session=True)
+
+def kill_process(process):
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    process.wait()
 
-# Parse command line arguments
-parser = argparse.ArgumentParser(description='Renders given obj file by rotating a camera around it.')
-parser.add_argument('--file', type=str,
-                    help='The file containing the list of commands to be executed. Default is commands.txt.')
-parser.add_argument('--max_workers', type=int, default=5,
-                    help='The maximum number of workers to use. Default is 5.')
-args = parser.parse_args()
+class Job:
+    def __init__(self, command, cost, memory):
+        self.command = command
+        self.cost = cost
+        self.memory = memory
+        self.process = None
+        self.start = None
+        self.lease_id = None
+        self.lease_seconds = None
+        self.renewed = None
+        self.stats_path = None
 
-def execute_command(command):
+class Scheduler:
+    # Runs the jobs as subprocesses, largest estimated cost first to cut the tail of the run.
+    # A job is only started when its estimated memory fits in the budget next to the running jobs
+    # (a job larger than the whole budget runs alone), and jobs running for longer than the timeout are killed.
+    def __init__(self, ledger, max_workers, memory_budget, timeout=None, max_attempts=3, poll_interval=0.5, on_done=None,
+                 stats_log=None):
+        self.ledger = ledger
+        self.on_done = on_done
+        self.stats_log = stats_log
+        self.max_workers = max_workers
+        self.memory_budget = memory_budget
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+
+    def start_job(self, job):
+        record = self.ledger.update(job.command, status='running', attempts=self.ledger.get(job.command)['attempts'] + 1)
+        job.start = time.time()
+        command = job.command if self.stats_log is None else self.stats_log.job_command(job)
+        try:
+            job.process = start_process(command)
+        except OSError as e:
+            print(f"Error executing command '{job.command}': {e}")
+            job.process = None
+        return record
+
+    def finish_job(self, job, exit_code, timed_out):
+        # Record the result of a job and return whether it succeeded
+        duration = time.time() - job.start
+        if self.stats_log is not None:
+            self.stats_log.collect(job)
+        if exit_code == 0 and outputs_complete(job.command):
+            self.ledger.update(job.command, status='done', duration=duration, exit_code=exit_code, timed_out=False)
+            if self.on_done is not None:
+                self.on_done(job.command)
+            return True
+        record = self.ledger.update(job.command, status='failed', duration=duration, exit_code=exit_code, timed_out=timed_out)
+        reason = f"timed out after {duration:.0f} s" if timed_out else f"exit code {exit_code}"
+        print(f"Error executing command '{job.command}': {reason}, attempt {record['attempts']} out of {self.max_attempts}")
+        return False
+
+    def run(self, jobs):
+        pending = sorted(jobs, key=lambda job: job.cost, reverse=True)
+        running = []
+        done = 0
+        failed = 0
+        try:
+            while pending or running:
+                # Start as many jobs as the worker count and the memory budget allow
+                memory_used = sum(job.memory for job in running)
+                for job in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    if running and memory_used + job.memory > self.memory_budget:
+                        continue
+                    pending.remove(job)
+                    self.start_job(job)
+                    running.append(job)
+                    memory_used += job.memory
+
+                time.sleep(self.poll_interval)
+
+                # Collect finished jobs and kill the ones over the timeout
+                for job in list(running):
+                    timed_out = False
+                    if job.process is None:
+                        exit_code = None
+                    else:
+                        exit_code = job.process.poll()
+                        if exit_code is None:
+                            if not self.timeout or time.time() - job.start < self.timeout:
+                                continue
+                            kill_process(job.process)
+                            exit_code = job.process.returncode
+                            timed_out = True
+                    running.remove(job)
+                    if self.finish_job(job, exit_code, timed_out):
+                        done += 1
+                    elif self.ledger.get(job.command)['attempts'] < self.max_attempts:
+                        pending.append(job)
+                        pending.sort(key=lambda job: job.cost, reverse=True)
+                    else:
+                        failed += 1
+        except KeyboardInterrupt:
+            # Interrupted jobs go back to pending without using up an attempt
+            for job in running:
+                if job.process is not None:
+                    kill_process(job.process)
+                self.ledger.update(job.command, status='pending', attempts=self.ledger.get(job.command)['attempts'] - 1)
+            raise
+        return done, failed
+
+class Coordinator:
+    # Hands out the jobs to the workers of any host, largest estimated cost first. Every job is leased to a worker,
+    # which renews the lease while rendering and reports the result. Jobs whose lease expires (the worker died or
+    # lost the connection) count as a failed attempt and go back to the pool.
+    def __init__(self, ledger, jobs, max_attempts=3, lease_seconds=120, stats_log=None):
+        self.ledger = ledger
+        self.stats_log = stats_log
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.pending = sorted(jobs, key=lambda job: job.cost, reverse=True)
+        self.leases = {}
+        self.done = 0
+        self.failed = 0
+
+    def requeue(self, job):
+        # Put a failed job back in the pool, or give up on it once it used all its attempts
+        if self.ledger.get(job.command)['attempts'] < self.max_attempts:
+            self.pending.append(job)
+            self.pending.sort(key=lambda job: job.cost, reverse=True)
+        else:
+            self.failed += 1
+
+    def expire_leases(self):
+        with self.lock:
+            now = time.time()
+            for lease_id, (job, worker, expires) in list(self.leases.items()):
+                if expires < now:
+                    del self.leases[lease_id]
+                    self.ledger.update(job.command, status='failed', duration=now - job.start, exit_code=None,
+                                       timed_out=False, lease_expired=True, worker=worker)
+                    print(f"Lease of command '{job.command}' on worker {worker} expired")
+                    self.requeue(job)
+
+    def lease(self, worker, memory_available, idle):
+        # Lease the largest job that fits in the free memory of the worker (any job when the worker is idle)
+        self.expire_leases()
+        with self.lock:
+            for job in self.pending:
+                if idle or job.memory <= memory_available:
+                    self.pending.remove(job)
+                    lease_id = uuid.uuid4().hex
+                    job.start = time.time()
+                    self.leases[lease_id] = (job, worker, job.start + self.lease_seconds)
+                    self.ledger.update(job.command, status='running', attempts=self.ledger.get(job.command)['attempts'] + 1,
+                                       worker=worker)
+                    return {'command': job.command, 'cost': job.cost, 'memory': job.memory,
+                            'lease_id': lease_id, 'lease_seconds': self.lease_seconds}
+            return {'command': None, 'finished': not self.pending and not self.leases}
+
+    def renew(self, lease_id):
+        with self.lock:
+            if lease_id not in self.leases:
+                return {'ok': False}
+            job, worker, _ = self.leases[lease_id]
+            self.leases[lease_id] = (job, worker, time.time() + self.lease_seconds)
+            return {'ok': True}
+
+    def complete(self, lease_id, success, exit_code, duration, timed_out, stats=()):
+        with self.lock:
+            if lease_id not in self.leases:
+                # The lease already expired and the job went back to the pool
+                return {'ok': False}
+            job, worker, _ = self.leases.pop(lease_id)
+            if self.stats_log is not None:
+                self.stats_log.add(job.command, stats, worker=worker)
+            if success:
+                self.ledger.update(job.command, status='done', duration=duration, exit_code=exit_code, timed_out=False, worker=worker)
+                self.done += 1
+            else:
+                self.ledger.update(job.command, status='failed', duration=duration, exit_code=exit_code, timed_out=timed_out, worker=worker)
+                print(f"Error executing command '{job.command}' on worker {worker}: exit code {exit_code}")
+                self.requeue(job)
+            return {'ok': True}
+
+    def packed(self, command):
+        # The worker packed the outputs of a command (which may come after the end of its lease)
+        self.ledger.update(command, packed=True)
+        return {'ok': True}
+
+    def finished(self):
+        with self.lock:
+            return not self.pending and not self.leases
+
+    def status(self):
+        with self.lock:
+            return {'pending': len(self.pending), 'running': len(self.leases), 'done': self.done, 'failed': self.failed}
+
+def make_request_handler(coordinator):
+    class RequestHandler(BaseHTTPRequestHandler):
+        def send_json(self, response):
+            body = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/status':
+                self.send_json(coordinator.status())
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path == '/lease':
+                self.send_json(coordinator.lease(request['worker'], request['memory_available'], request['idle']))
+            elif self.path == '/renew':
+                self.send_json(coordinator.renew(request['lease_id']))
+            elif self.path == '/complete':
+                self.send_json(coordinator.complete(request['lease_id'], request['success'], request['exit_code'],
+                                                    request['duration'], request['timed_out'], request.get('stats', [])))
+            elif self.path == '/packed':
+                self.send_json(coordinator.packed(request['command']))
+            else:
+                self.send_error(404)
+
+        def log_message(self, format, *args):
+            # Workers poll constantly, so don't log every request
+            pass
+
+    return RequestHandler
+
+def serve_commands(commands_file, address, ledger_file=None, max_attempts=3, retry_failed=False, lease_seconds=120,
+                   memory_base=500 * 1024**2, memory_factor=12, linger=30):
+    # Coordinator mode: serve the commands to the workers until all of them are done or failed
+    host, port = address.rsplit(':', 1)
+    commands = read_commands(commands_file)
+    ledger = Ledger(ledger_file or commands_file + '.ledger.jsonl')
+    stats_log = StatsLog(commands_file + '.stats.jsonl')
+    start = time.time()
     try:
-        subprocess.run(command, shell=True, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing command '{command}': {e}")
+        pending, skipped, given_up = select_commands(commands, ledger, max_attempts, retry_failed)
+        jobs = [Job(command, *estimate_job(command, memory_base, memory_factor)) for command in pending]
+        coordinator = Coordinator(ledger, jobs, max_attempts, lease_seconds, stats_log)
+        server = ThreadingHTTPServer((host, int(port)), make_request_handler(coordinator))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"{len(commands)} commands, {skipped} skipped, {given_up} given up, {len(pending)} to run, serving on {host}:{port}")
 
-def execute_commands_in_parallel(commands_file, max_workers=args.max_workers):
+        last_status = None
+        while not coordinator.finished():
+            time.sleep(1)
+            coordinator.expire_leases()
+            status = coordinator.status()
+            if status != last_status:
+                print(f"{status['pending']} pending, {status['running']} running, {status['done']} done, {status['failed']} failed")
+                last_status = status
+        elapsed = time.time() - start
+        # Keep answering for a while, so that idle workers learn that there is nothing left and exit
+        time.sleep(linger)
+        server.shutdown()
+    finally:
+        ledger.close()
+        stats_log.close()
+
+    print(f"{coordinator.done} done, {coordinator.failed + given_up} failed ({given_up} given up in previous runs), {skipped} skipped")
+    report = run_report(stats_log.records, elapsed)
+    write_report(report, commands_file + '.report.json')
+    print_report(report)
+    if given_up:
+        print(f"{given_up} commands failed {max_attempts} times in previous runs, use --retry_failed to run them again")
+    return coordinator.failed + given_up == 0
+
+def coordinator_request(url, path, payload, retries=5):
+    # POST a JSON request to the coordinator, retrying with an exponential backoff on connection errors
+    request = urllib.request.Request(url.rstrip('/') + path, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    for attempt in range(retries):
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return json.loads(response.read())
+        except (urllib.error.URLError, OSError):
+            if attempt == retries - 1:
+                raise
+            time.sleep(2**attempt)
+
+def run_worker(url, max_workers, memory_budget, timeout=None, poll_interval=1.0, packer=None):
+    # Worker mode: lease commands from the coordinator and run them with the same memory admission and timeout
+    # as the local scheduler, renewing the leases while the commands run
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    stats_folder = tempfile.mkdtemp(prefix='render_blender_stats_')
+    if packer is not None:
+        packer.on_packed = lambda command: coordinator_request(url, '/packed', {'command': command})
+    running = []
+    print(f"Worker {worker} with {max_workers} slots and a memory budget of {memory_budget / 1024**3:.1f} GB")
+    try:
+        while True:
+            finished = False
+            memory_used = sum(job.memory for job in running)
+            while len(running) < max_workers:
+                response = coordinator_request(url, '/lease', {'worker': worker, 'memory_available': memory_budget - memory_used,
+                                                               'idle': not running})
+                if response['command'] is None:
+                    finished = response['finished']
+                    break
+                job = Job(response['command'], response['cost'], response['memory'])
+                job.lease_id = response['lease_id']
+                job.lease_seconds = response['lease_seconds']
+                job.start = job.renewed = time.time()
+                job.stats_path = os.path.join(stats_folder, job.lease_id + '.jsonl')
+                job.process = start_process(stats_command(job.command, job.stats_path))
+                running.append(job)
+                memory_used += job.memory
+            if finished and not running:
+                break
+
+            time.sleep(poll_interval)
+
+            for job in list(running):
+                timed_out = False
+                exit_code = job.process.poll()
+                if exit_code is None:
+                    if timeout and time.time() - job.start > timeout:
+                        kill_process(job.process)
+                        exit_code = job.process.returncode
+                        timed_out = True
+                    else:
+                        if time.time() - job.renewed > job.lease_seconds / 3:
+                            if not coordinator_request(url, '/renew', {'lease_id': job.lease_id})['ok']:
+                                # The coordinator gave the job to another worker
+                                kill_process(job.process)
+                                running.remove(job)
+                            job.renewed = time.time()
+                        continue
+                running.remove(job)
+                success = exit_code == 0 and outputs_complete(job.command)
+                response = coordinator_request(url, '/complete', {'lease_id': job.lease_id, 'success': success, 'exit_code': exit_code,
+                                                                  'duration': time.time() - job.start, 'timed_out': timed_out,
+                                                                  'stats': read_job_stats(job.stats_path)})
+                if success and response['ok'] and packer is not None:
+                    packer.submit(job.command, command_models(job.command))
+    except BaseException:
+        # Stop rendering, the coordinator gives the jobs to other workers once the leases expire
+        for job in running:
+            kill_process(job.process)
+        raise
+    finally:
+        shutil.rmtree(stats_folder, ignore_errors=True)
+
+def is_packed(record):
+    return record is not None and record['status'] == 'done' and record.get('packed', False)
+
+def select_commands(commands, ledger, max_attempts, retry_failed=False):
+    # Decide which commands still have to run. Commands with complete outputs are marked as done without running them,
+    # and packed commands are skipped without looking for their outputs (the loose files were deleted). Returns the
+    # pending commands, the number of skipped (finished) commands and the number of commands given up, which failed
+    # max_attempts times in previous runs.
+    pending = []
+    skipped = 0
+    given_up = 0
+    # Checking the outputs means opening 28 files per model, so do it with a few threads
+    unpacked = [command for command in commands if not is_packed(ledger.get(command))]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        complete = dict(zip(unpacked, executor.map(outputs_complete, unpacked)))
+    for command in commands:
+        record = ledger.get(command)
+        if is_packed(record):
+            skipped += 1
+            continue
+        if complete[command]:
+            if record is None or record['status'] != 'done':
+                ledger.update(command, status='done', attempts=0 if record is None else record['attempts'])
+            skipped += 1
+            continue
+        if record is None:
+            record = ledger.update(command, status='pending')
+        elif retry_failed:
+            record = ledger.update(command, status='pending', attempts=0)
+        if record['status'] == 'failed' and record['attempts'] >= max_attempts:
+            given_up += 1
+            continue
+        pending.append(command)
+    return pending, skipped, given_up
+
+def read_commands(commands_file):
     with open(commands_file, 'r') as file:
-        commands = file.readlines()
+        return [line.strip() for line in file if line.strip()]
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        executor.map(execute_command, commands)
+def make_packer(pack_format, pack_folder, shard_size, keep_loose):
+    # pack_outputs.py needs numpy, so it is only imported when packing
+    import pack_outputs
+    return pack_outputs.Packer(pack_format, pack_folder, shard_size, keep_loose)
+
+def execute_commands_in_parallel(commands_file, max_workers=None, ledger_file=None, max_attempts=3, retry_failed=False,
+                                 memory_budget=None, timeout=None, memory_base=500 * 1024**2, memory_factor=12, packer=None):
+    if memory_budget is None:
+        memory_budget = 0.8 * total_memory()
+    if max_workers is None:
+        max_workers = default_max_workers(memory_budget)
+
+    commands = read_commands(commands_file)
+    ledger = Ledger(ledger_file or commands_file + '.ledger.jsonl')
+    stats_log = StatsLog(commands_file + '.stats.jsonl')
+    start = time.time()
+    try:
+        pending, skipped, given_up = select_commands(commands, ledger, max_attempts, retry_failed)
+        print(f"{len(commands)} commands, {skipped} skipped, {given_up} given up, {len(pending)} to run with {max_workers} workers "
+              f"and a memory budget of {memory_budget / 1024**3:.1f} GB")
+
+        on_done = None
+        if packer is not None:
+            packer.on_packed = lambda command: ledger.update(command, packed=True)
+            on_done = lambda command: packer.submit(command, command_models(command))
+            # Pack the outputs that previous runs rendered but did not pack
+            pending_set = set(pending)
+            for command in commands:
+                record = ledger.get(command)
+                if command not in pending_set and record['status'] == 'done' and not is_packed(record):
+                    on_done(command)
+
+        jobs = [Job(command, *estimate_job(command, memory_base, memory_factor)) for command in pending]
+        scheduler = Scheduler(ledger, max_workers, memory_budget, timeout, max_attempts, on_done=on_done, stats_log=stats_log)
+        try:
+            done, failed = scheduler.run(jobs)
+        finally:
+            if packer is not None:
+                packer.close()
+    finally:
+        ledger.close()
+        stats_log.close()
+
+    print(f"{done} done, {failed + given_up} failed ({given_up} given up in previous runs), {skipped} skipped")
+    report = run_report(stats_log.records, time.time() - start)
+    write_report(report, commands_file + '.report.json')
+    print_report(report)
+    if given_up:
+        print(f"{given_up} commands failed {max_attempts} times in previous runs, use --retry_failed to run them again")
+    return failed + given_up == 0
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Renders given obj file by rotating a camera around it.')
+    parser.add_argument('--file', type=str, default='commands.txt',
+                        help='The file containing the list of commands to be executed. Default is commands.txt.')
+    parser.add_argument('--max_workers', type=int, default=None,
+                        help='The maximum number of workers to use. Default is one per two cores, limited by the memory budget.')
+    parser.add_argument('--memory_budget_gb', type=float, default=None,
+                        help='Jobs are only started while their estimated memory fits in this budget. Default is 80%% of the physical memory.')
+    parser.add_argument('--job_memory_base_mb', type=float, default=500,
+                        help='Estimated memory of a Blender instance before loading a model, in MB. Default is 500.')
+    parser.add_argument('--job_memory_factor', type=float, default=12,
+                        help='Estimated memory per byte of .obj file. Default is 12.')
+    parser.add_argument('--timeout', type=float, default=3600,
+                        help='Jobs running for longer than this many seconds are killed (0 disables it). Default is 3600.')
+    parser.add_argument('--ledger', type=str, default=None,
+                        help='The file where the status of every command is recorded. Default is the commands file with the .ledger.jsonl suffix.')
+    parser.add_argument('--max_attempts', type=int, default=3,
+                        help='How many times a failing command is run in total, across restarts. Default is 3.')
+    parser.add_argument('--retry_failed', action='store_true',
+                        help='Reset the attempt count of the commands that failed in previous runs.')
+    parser.add_argument('--serve', type=str, default=None,
+                        help='Run as the coordinator of several workers, serving the commands on this address, e.g. 0.0.0.0:8765.')
+    parser.add_argument('--coordinator', type=str, default=None,
+                        help='Run as a worker, leasing the commands from the coordinator at this URL, e.g. http://host:8765.')
+    parser.add_argument('--lease_seconds', type=float, default=120,
+                        help='How long a worker can go without renewing the lease of a command before it goes back to the pool. Default is 120.')
+    parser.add_argument('--report', action='store_true',
+                        help='Print the report of all the runs of the commands file so far, without running anything.')
+    parser.add_argument('--pack', type=str, default=None, choices=['tar', 'npz'],
+                        help='Pack the outputs of every finished command into tar shards or one .npz file per model, and delete the loose files.')
+    parser.add_argument('--pack_folder', type=str, default=None,
+                        help='The folder where the packed outputs are written. Default is the packed folder next to the commands file.')
+    parser.add_argument('--shard_size_mb', type=float, default=1024,
+                        help='Approximate size of the tar shards in MB. Default is 1024.')
+    parser.add_argument('--keep_loose', action='store_true',
+                        help='Keep the .png and .exr files after packing them.')
+    args = parser.parse_args()
 
-if __name__ == "__main__":
     commands_file = args.file
-    execute_commands_in_parallel(commands_file)
\ No newline at end of file
+    if args.report:
+        stats_path = commands_file + '.stats.jsonl'
+        records = read_stats(stats_path) if os.path.exists(stats_path) else []
+        if not records:
+            print(f"No stats recorded for {commands_file} yet ({stats_path} is missing or empty), run the commands first")
+            raise SystemExit(1)
+        print_report(run_report(records))
+        return
+    memory_base = args.job_memory_base_mb * 1024**2
+    memory_budget = None if args.memory_budget_gb is None else args.memory_budget_gb * 1024**3
+    packer = None
+    if args.pack is not None and args.serve is None:
+        pack_folder = args.pack_folder or os.path.join(os.path.dirname(os.path.abspath(commands_file)), 'packed')
+        packer = make_packer(args.pack, pack_folder, args.shard_size_mb * 1024**2, args.keep_loose)
+    if args.serve is not None:
+        success = serve_commands(commands_file, args.serve, args.ledger, args.max_attempts, args.retry_failed,
+                                 args.lease_seconds, memory_base, args.job_memory_factor)
+    elif args.coordinator is not None:
+        if memory_budget is None:
+            memory_budget = 0.8 * total_memory()
+        max_workers = args.max_workers or default_max_workers(memory_budget)
+        try:
+            run_worker(args.coordinator, max_workers, memory_budget, args.timeout, packer=packer)
+        finally:
+            if packer is not None:
+                packer.close()
+        success = True
+    else:
+        success = execute_commands_in_parallel(commands_file, args.max_workers, args.ledger, args.max_attempts, args.retry_failed,
+                                               memory_budget, args.timeout, memory_base, args.job_memory_factor, packer)
+    raise SystemExit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# A script to render only the depth maps of 3D models from the ShapeNetSem dataset, without Blender.
+# It reproduces the depth output of render_blender.py (same model alignment, scaling, centering, camera placement,
+# Kinect intrinsics and file names) with a vectorized z-buffer in numpy, and renders the models of a manifest
+# in parallel with a pool of processes.
+#
+# Usage: python render_depth_numpy.py --output_folder /path/to/outputs --up 0\,0\,1 --front 1\,0\,0 --aligned_dims 1.0\,1.0\,1.0 --unit 1.0 /path/to/my.obj
+# Usage: python render_depth_numpy.py --output_folder /path/to/outputs --manifest /path/to/manifest.jsonl
+#
+# With --compare_folder /path/to/blender/outputs, the depth maps are compared with the ones rendered by
+# render_blender.py for the same models, and the agreement (mask IoU and depth errors) is reported with the throughput.
+#
+# The viewpoint sets of render_blender.py (--viewpoints, --elevations, --viewpoint_count, --pose_file) are supported.
+#
+# Differences with render_blender.py: only the depth is rendered (no .png files), triangles crossing the near clipping
+# plane are dropped instead of clipped, and the focal length comes from K (fx = fy = 588) while Blender's camera is set
+# from the 57 degree field of view (about 589.4 pixels); use --camera_fov 57 to reproduce Blender's camera exactly.
+#
+# A model takes about 1 s per view on one core: 14 views of a 100k-face sphere in about 14 s (18 s with 160k faces) on
+# an x86_64 Xeon, measured with benchmark.py --stages depth (see the README).
+#
+# Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
+
+import argparse, json, math, os, time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import rgbd_camera, rgbd_io
+
+# Camera clipping (in meters), as in render_blender.py
+Clip_start = 0.1
+Clip_end = 10
+
+# Number of candidate pixels processed at once by the rasterizer
+RASTER_CHUNK_SIZE = 1 << 21
+
+def parse_vector(value):
+    # Vectors come either as lists (manifest) or as strings like 0\,0\,1 (command line)
+    if isinstance(value, str):
+        value = value.replace('\\,', ',').split(',')
+    return np.array(list(map(float, value)))
+
+def load_obj(filepath):
+    # Vertices and triangles (polygons are split in fans) of an .obj file, ignoring everything else
+    vertices = []
+    triangles = []
+    with open(filepath, 'r', errors='replace') as file:
+        for line in file:
+            if line.startswith('v '):
+                vertices.append(line.split()[1:4])
+            elif line.startswith('f '):
+                face = []
+                for token in line.split()[1:]:
+                    index = int(token.split('/', 1)[0])
+                    # Negative indices are relative to the vertices read so far
+                    face.append(index + len(vertices) if index < 0 else index - 1)
+                for i in range(1, len(face) - 1):
+                    triangles.append((face[0], face[i], face[i + 1]))
+    return np.array(vertices, dtype=np.float64).reshape(-1, 3), np.array(triangles, dtype=np.int64).reshape(-1, 3)
+
+def place_model(vertices, up, front, unit):
+    # World coordinates of the vertices after the preprocessing of render_blender.py: the importer's axis conversion
+    # and the up/front alignment are kept in the object matrix, the unit scale is applied to the mesh, and the mesh
+    # is translated by minus the center of its local bounding box. That translation is done in edit mode along the
+    # global axes, so it is not rotated by the object matrix.
+    scaled = vertices * unit
+    bbox_center = 0.5 * (scaled.min(axis=0) + scaled.max(axis=0))
+    rotation = rgbd_camera.alignment_rotation(up, front) @ rgbd_camera.OBJ_TO_BLENDER
+    return scaled @ rotation.T - bbox_center
+
+def rasterize_depth(points, triangles, width, height, fx, fy, ox, oy):
+    # Plane depth of the closest triangle at the center of every pixel (0 where there is none), for points in the
+    # camera frame (Blender convention: X right, Y up, looking along -Z). Rows are indexed from the top.
+    z = -points[:, 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = fx * points[:, 0] / z + ox
+        v = oy - fy * points[:, 1] / z
+
+    triangle_z = z[triangles]
+    triangle_u = u[triangles]
+    triangle_v = v[triangles]
+    # Pixels whose centers (i + 0.5, j + 0.5) fall in the bounding box of each triangle
+    x0 = np.maximum(np.ceil(triangle_u.min(axis=1) - 0.5), 0)
+    x1 = np.minimum(np.floor(triangle_u.max(axis=1) - 0.5), width - 1)
+    y0 = np.maximum(np.ceil(triangle_v.min(axis=1) - 0.5), 0)
+    y1 = np.minimum(np.floor(triangle_v.max(axis=1) - 0.5), height - 1)
+    keep = (triangle_z > Clip_start).all(axis=1) & (triangle_z.min(axis=1) < Clip_end) & (x1 >= x0) & (y1 >= y0)
+
+    x0, x1, y0, y1 = x0[keep].astype(np.int64), x1[keep].astype(np.int64), y0[keep].astype(np.int64), y1[keep].astype(np.int64)
+    triangle_u, triangle_v = triangle_u[keep].astype(np.float32), triangle_v[keep].astype(np.float32)
+    inverse_z = (1.0 / triangle_z[keep]).astype(np.float32)
+    box_width = x1 - x0 + 1
+    box_height = y1 - y0 + 1
+    area = box_width * box_height
+
+    # Process the triangles by increasing bounding box size, in chunks of about RASTER_CHUNK_SIZE candidate pixels
+    order = np.argsort(area, kind='stable')
+    zbuffer = np.full(width * height, np.inf, dtype=np.float32)
+    start = 0
+    while start < len(order):
+        count = max(1, RASTER_CHUNK_SIZE // int(area[order[start]]))
+        end = min(start + count, len(order))
+        while end - start > 1 and (end - start) * int(area[order[end - 1]]) > RASTER_CHUNK_SIZE:
+            end = start + (end - start) // 2
+        chunk = order[start:end]
+        start = end
+
+        max_width = int(box_width[chunk].max())
+        max_height = int(box_height[chunk].max())
+        offset_x = np.tile(np.arange(max_width), max_height)
+        offset_y = np.repeat(np.arange(max_height), max_width)
+        px = x0[chunk, np.newaxis] + offset_x
+        py = y0[chunk, np.newaxis] + offset_y
+        valid = (px <= x1[chunk, np.newaxis]) & (py <= y1[chunk, np.newaxis])
+
+        # Barycentric coordinates of the pixel centers (both windings are accepted, there is no backface culling)
+        sx = px.astype(np.float32) + 0.5
+        sy = py.astype(np.float32) + 0.5
+        u0, u1, u2 = (triangle_u[chunk, i, np.newaxis] for i in range(3))
+        v0, v1, v2 = (triangle_v[chunk, i, np.newaxis] for i in range(3))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse_area = 1.0 / ((u1 - u0) * (v2 - v0) - (u2 - u0) * (v1 - v0))
+            w0 = ((u1 - sx) * (v2 - sy) - (u2 - sx) * (v1 - sy)) * inverse_area
+            w1 = ((u2 - sx) * (v0 - sy) - (u0 - sx) * (v2 - sy)) * inverse_area
+            w2 = 1.0 - w0 - w1
+            inside = valid & (w0 >= 0) & (w1 >= 0) & (w2 >= 0) & np.isfinite(inverse_area)
+            # The inverse of the depth is linear in screen space
+            depth = 1.0 / (w0 * inverse_z[chunk, 0, np.newaxis] + w1 * inverse_z[chunk, 1, np.newaxis] + w2 * inverse_z[chunk, 2, np.newaxis])
+        np.minimum.at(zbuffer, (py * width + px)[inside], depth[inside])
+
+    # Same mask as the compositor of render_blender.py
+    zbuffer[zbuffer > Clip_end - 0.1] = 0.0
+    return zbuffer.reshape(height, width)
+
+def compare_depth(depth, reference):
+    # Agreement between a depth map and the one rendered by Blender for the same view
+    mask = depth > 0
+    reference_mask = reference > 0
+    union = np.count_nonzero(mask | reference_mask)
+    both = mask & reference_mask
+    error = np.abs(depth[both] - reference[both])
+    return {'iou': np.count_nonzero(both) / union if union else 1.0,
+            'mean_abs_error': float(error.mean()) if error.size else 0.0,
+            'max_abs_error': float(error.max()) if error.size else 0.0,
+            'within_1cm': float(np.count_nonzero(error < 0.01) / error.size) if error.size else 1.0}
+
+def render_model(model, options):
+    # Render and write the depth maps of every view of a model. Returns the model statistics.
+    start = time.time()
+    vertices, triangles = load_obj(model['obj'])
+    points = place_model(vertices, parse_vector(model.get('up', options['up'])), parse_vector(model.get('front', options['front'])),
+                         float(model.get('unit', options['unit'])))
+    distance = rgbd_camera.camera_distance(parse_vector(model.get('aligned_dims', options['aligned_dims'])),
+                                           options['model_distance_scale'])
+
+    model_identifier = os.path.split(model['obj'])[1].split('.')[0]
+    output_folder = os.path.join(os.path.abspath(model.get('output_folder', options['output_folder'])), model_identifier)
+    os.makedirs(output_folder, exist_ok=True)
+
+    comparisons = []
+    # The viewpoint options are optional, so that callers written for the turntable (e.g. benchmark.py) keep working
+    views = rgbd_camera.viewpoints(options.get('viewpoints', 'turntable'), options['views'], options['camera_angle'],
+                                   options['canonical_views'], options.get('elevations', (0, 30, 60)),
+                                   options.get('viewpoint_count', 50), options.get('pose_file'))
+    for name, rx, rz in views:
+        world_to_camera = np.linalg.inv(rgbd_camera.camera_to_world(rx, rz, distance))
+        points_camera = points @ world_to_camera[:3, :3].T + world_to_camera[:3, 3]
+        depth = rasterize_depth(points_camera, triangles, options['width'], options['height'],
+                                options['fx'], options['fy'], options['ox'], options['oy'])
+        # Same file name as the compositor of render_blender.py, which appends the frame number
+        filename = model_identifier + name + '_depth0001' + rgbd_io.DEPTH_EXTENSIONS[options['depth_format']]
+        rgbd_io.write_depth(os.path.join(output_folder, filename), depth, options['depth_format'], options['exr_compression'],
+                            options['depth_precision'] == 'half', options['depth_invalid_value'])
+
+        if options['compare_folder'] is not None:
+            reference_path = os.path.join(options['compare_folder'], model_identifier, filename)
+            if os.path.exists(reference_path):
+                comparisons.append(compare_depth(depth, rgbd_io.read_depth(reference_path, options['depth_invalid_value'])))
+
+    return {'model': model_identifier, 'vertices': len(vertices), 'faces': len(triangles), 'views': len(views),
+            'duration': time.time() - start, 'comparisons': comparisons}
+
+def render_model_star(task):
+    return render_model(*task)
+
+def read_manifest(manifest_path):
+    models = []
+    with open(manifest_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                models.append(json.loads(line))
+    return models
+
+def main():
+    # Parse command line arguments (the same as render_blender.py for the options they share)
+    parser = argparse.ArgumentParser(description='Renders the depth maps of given obj file by rotating a camera around it, without Blender.')
+    parser.add_argument('--up', type=str, default = '0\\,-1\\,0',
+                        help='Normalized vector in original model space coordinates indicating semantic "upright" orientation of model.')
+    parser.add_argument('--front', type=str, default = '-1\\,0\\,0',
+                        help='Normalized vector in original model space coordinates indicating semantic "front" orientation of model.')
+    parser.add_argument('--unit', type=float, default = 1.0,
+                        help='The scale unit converting model virtual units to meters.')
+    parser.add_argument('--aligned_dims', type=str, default = '1.000000\\,1.000000\\,1.000000',
+                        help='Aligned dimensions of model after rescaling to meters and upright-front realignment (X-right, Y-back, Z-up).')
+    parser.add_argument('--views', type=int, default=8,
+                        help='How many equally-spaced turntable positions (increments of the camera azimuth angle) to render.')
+    parser.add_argument('--camera_angle', type=float, default=30,
+                        help='Camera elevation in degrees from horizontal (ground) plane.')
+    parser.add_argument('--canonical_views', type=bool, default=True,
+                        help='Whether to render top, bottom, left, right, front and back views in addition to turntable views.')
+    parser.add_argument('--viewpoints', type=str, default='turntable', choices=rgbd_camera.VIEWPOINT_SETS,
+                        help='The set of views to render, as in render_blender.py.')
+    parser.add_argument('--elevations', type=str, default='0\\,30\\,60',
+                        help='Camera elevations in degrees of the elevations viewpoint set.')
+    parser.add_argument('--viewpoint_count', type=int, default=50,
+                        help='Number of views of the fibonacci viewpoint set.')
+    parser.add_argument('--pose_file', type=str, default=None,
+                        help='JSON file listing the views of the file viewpoint set, with their name, elevation and azimuth in degrees.')
+    parser.add_argument('--model_distance_scale', type=float, default=2.1,
+                        help='Scaling factor used to compute the distance from the the model to the camera.')
+    parser.add_argument('obj', type=str, nargs='?', default=None,
+                        help='Path to the obj file to be rendered.')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Path to a JSON lines file listing the models to render.')
+    parser.add_argument('--output_folder', type=str, default='/tmp',
+                        help='The path the output will be dumped to.')
+    parser.add_argument('--image_width', type=int, default=rgbd_camera.IMAGE_WIDTH,
+                        help='Width of the rendered images in pixels.')
+    parser.add_argument('--image_height', type=int, default=rgbd_camera.IMAGE_HEIGHT,
+                        help='Height of the rendered images in pixels.')
+    parser.add_argument('--fx', type=float, default=rgbd_camera.FX,
+                        help='Focal length in pixels along the image width.')
+    parser.add_argument('--fy', type=float, default=rgbd_camera.FY,
+                        help='Focal length in pixels along the image height.')
+    parser.add_argument('--ox', type=float, default=None,
+                        help='Principal point along the image width. Default is the image center.')
+    parser.add_argument('--oy', type=float, default=None,
+                        help='Principal point along the image height. Default is the image center.')
+    parser.add_argument('--camera_fov', type=float, default=None,
+                        help='If given, the focal lengths are computed from this horizontal field of view in degrees, as Blender does.')
+    parser.add_argument('--exr_compression', type=str, default='ZIP', choices=['NONE', 'ZIPS', 'ZIP', 'PIZ', 'DWAA'],
+                        help='Compression of the .exr files. Default is ZIP, as Blender. PIZ and DWAA need the OpenEXR Python bindings.')
+    parser.add_argument('--depth_format', type=str, default='exr_rgb', choices=rgbd_io.DEPTH_FORMATS,
+                        help='OpenEXR with three identical channels, single channel OpenEXR or 16-bit PNG in millimeters.')
+    parser.add_argument('--depth_precision', type=str, default='full', choices=['full', 'half'],
+                        help='32-bit or 16-bit floats for the OpenEXR depth maps.')
+    parser.add_argument('--depth_invalid_value', type=int, default=0,
+                        help='Value of the pixels without depth in the 16-bit PNG depth maps.')
+    parser.add_argument('--max_workers', type=int, default=None,
+                        help='The number of processes rendering models in parallel. Default is the number of cores.')
+    parser.add_argument('--compare_folder', type=str, default=None,
+                        help='Output folder of render_blender.py for the same models, to report the agreement of the depth maps.')
+    args = parser.parse_args()
+    if (args.obj is None) == (args.manifest is None):
+        parser.error('exactly one of obj or --manifest must be given')
+
+    fx, fy = args.fx, args.fy
+    if args.camera_fov is not None:
+        fx = fy = (args.image_width / 2) / math.tan(math.radians(args.camera_fov) / 2)
+    options = {'up': args.up, 'front': args.front, 'unit': args.unit, 'aligned_dims': args.aligned_dims,
+               'views': args.views, 'camera_angle': args.camera_angle, 'canonical_views': args.canonical_views,
+               'viewpoints': args.viewpoints, 'elevations': list(parse_vector(args.elevations)),
+               'viewpoint_count': args.viewpoint_count, 'pose_file': args.pose_file,
+               'model_distance_scale': args.model_distance_scale, 'output_folder': args.output_folder,
+               'width': args.image_width, 'height': args.image_height, 'fx': fx, 'fy': fy,
+               'ox': args.image_width / 2 if args.ox is None else args.ox,
+               'oy': args.image_height / 2 if args.oy is None else args.oy,
+               'exr_compression': args.exr_compression, 'depth_format': args.depth_format,
+               'depth_precision': args.depth_precision, 'depth_invalid_value': args.depth_invalid_value,
+               'compare_folder': args.compare_folder}
+
+    models = [{'obj': args.obj}] if args.manifest is None else read_manifest(args.manifest)
+    start = time.time()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.max_workers) as executor:
+        for result in executor.map(render_model_star, [(model, options) for model in models]):
+            results.append(result)
+            print('{} ({} faces): {} views in {:.2f} s'.format(result['model'], result['faces'], result['views'], result['duration']))
+    elapsed = time.time() - start
+
+    views = sum(result['views'] for result in results)
+    print('{} models, {} views in {:.1f} s: {:.0f} models/hour, {:.1f} views/s'.format(
+        len(results), views, elapsed, len(results) / elapsed * 3600, views / elapsed))
+    comparisons = [comparison for result in results for comparison in result['comparisons']]
+    if comparisons:
+        print('Agreement with Blender over {} views: mask IoU {:.4f}, mean abs error {:.5f} m, max abs error {:.4f} m, {:.2%} of pixels within 1 cm'.format(
+            len(comparisons), np.mean([c['iou'] for c in comparisons]), np.mean([c['mean_abs_error'] for c in comparisons]),
+            np.max([c['max_abs_error'] for c in comparisons]), np.mean([c['within_1cm'] for c in comparisons])))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# Camera helpers shared by the rendering scripts.
+# Only depends on numpy, so it can be imported both from Blender's own Python distribution (render_blender.py)
+# and from a regular Python installation (the helper scripts).
+#
+# Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
+
+import json, math, os
+import numpy as np
+
+# Default camera intrinsics (for a kinect camera)
+IMAGE_WIDTH = 640
+IMAGE_HEIGHT = 480
+CAMERA_FOV = 57
+FX = 588
+FY = 588
+
+def intrinsics_matrix(fx, fy, ox, oy):
+    # Camera matrix K = ((fx, 0, ox), (0, fy, oy), (0, 0, 1))
+    return np.array(((fx, 0.0, ox), (0.0, fy, oy), (0.0, 0.0, 1.0)))
+
+def projection_factor_map(width, height, fx, fy, ox, oy):
+    # Conversion factor from point projection to plane projection for every pixel, i.e. the z component of the
+    # normalized ray K^-1 @ (w + 0.5, h + 0.5, 1) through the pixel center, as in pixel_rays and the rasterizer of
+    # render_depth_numpy.py. Rows are indexed from the top of the image.
+    x = (np.arange(width, dtype=np.float64) + 0.5 - ox) / fx
+    y = (np.arange(height, dtype=np.float64) + 0.5 - oy) / fy
+    return 1.0 / np.sqrt(x[np.newaxis, :]**2 + y[:, np.newaxis]**2 + 1.0)
+
+def projection_factor_rgba(width, height, fx, fy, ox, oy, engine):
+    # The projection factor map as the flat RGBA float32 array expected by Blender's image pixels
+    # (rows start at the bottom of the image). Only Cycles renders the depth to the camera center,
+    # the other engines already render the depth to the camera plane, so their factor is 1.
+    rgba = np.ones((height, width, 4), dtype=np.float32)
+    if engine == 'CYCLES':
+        factors = projection_factor_map(width, height, fx, fy, ox, oy)[::-1]
+        rgba[:, :, 0] = factors
+        rgba[:, :, 1] = factors
+        rgba[:, :, 2] = factors
+    return rgba.ravel()
+
+def cached_projection_factor_rgba(cache_folder, width, height, fx, fy, ox, oy, engine):
+    # Same as projection_factor_rgba, but stored in cache_folder so that later runs only load it
+    if cache_folder is None:
+        return projection_factor_rgba(width, height, fx, fy, ox, oy, engine)
+
+    # The maps of the older versions (through the pixel corners) had no _centers suffix, so they are not reused
+    filename = 'projection_{}x{}_fx{:g}_fy{:g}_ox{:g}_oy{:g}_{}_centers.npy'.format(width, height, fx, fy, ox, oy, engine)
+    filepath = os.path.join(cache_folder, filename)
+    try:
+        rgba = np.load(filepath)
+        if rgba.shape == (width * height * 4,) and rgba.dtype == np.float32:
+            return rgba
+    except (OSError, ValueError):
+        pass
+
+    rgba = projection_factor_rgba(width, height, fx, fy, ox, oy, engine)
+    # Write to a temporary file first, so that concurrent Blender instances never load a partial file
+    os.makedirs(cache_folder, exist_ok=True)
+    filepath_tmp = '{}.{}.tmp.npy'.format(filepath[:-len('.npy')], os.getpid())
+    np.save(filepath_tmp, rgba)
+    os.replace(filepath_tmp, filepath)
+    return rgba
+
+# Blender's OBJ importer converts the OBJ axes (Y up, -Z forward) to Blender's axes (Z up, Y forward)
+OBJ_TO_BLENDER = np.array(((1.0, 0.0, 0.0), (0.0, 0.0, -1.0), (0.0, 1.0, 0.0)))
+
+CANONICAL_VIEWS = ['top', 'bottom', 'left', 'right', 'front', 'back']
+
+def axis_angle_matrix(axis, angle):
+    # Rotation matrix of angle radians around axis (Rodrigues' formula)
+    axis = np.asarray(axis, dtype=np.float64)
+    axis = axis / np.linalg.norm(axis)
+    cross = np.array(((0.0, -axis[2], axis[1]), (axis[2], 0.0, -axis[0]), (-axis[1], axis[0], 0.0)))
+    return np.eye(3) + math.sin(angle) * cross + (1.0 - math.cos(angle)) * cross @ cross
+
+def rotation_difference(v1, v2):
+    # Shortest arc rotation taking v1 to v2, following mathutils.Vector.rotation_difference
+    v1 = np.asarray(v1, dtype=np.float64) / np.linalg.norm(v1)
+    v2 = np.asarray(v2, dtype=np.float64) / np.linalg.norm(v2)
+    axis = np.cross(v1, v2)
+    if np.linalg.norm(axis) > np.finfo(np.float32).eps:
+        return axis_angle_matrix(axis, math.acos(min(1.0, max(-1.0, float(np.dot(v1, v2))))))
+    if np.dot(v1, v2) > 0.0:
+        return np.eye(3)
+    # Opposite vectors: half turn around an axis orthogonal to v1 (as Blender's ortho_v3_v3)
+    xn, yn, zn = np.abs(v1)
+    dominant = (0 if xn > zn else 2) if xn > yn else (1 if yn > zn else 2)
+    if dominant == 0:
+        axis = (-v1[1] - v1[2], v1[0], v1[0])
+    elif dominant == 1:
+        axis = (v1[1], -v1[0] - v1[2], v1[1])
+    else:
+        axis = (v1[2], v1[2], -v1[0] - v1[1])
+    return axis_angle_matrix(axis, math.pi)
+
+def alignment_rotation(up, front):
+    # Rotation aligning the semantic up and front of a model with Blender's up (Z) and front (-Y),
+    # as computed by render_blender.py
+    rotation_up = rotation_difference(up, (0.0, 0.0, 1.0))
+    rotation_front = rotation_difference(rotation_up @ np.asarray(front, dtype=np.float64), (0.0, -1.0, 0.0))
+    return rotation_front @ rotation_up
+
+def euler_matrix(rx, ry, rz):
+    # Rotation matrix of Blender's XYZ Euler angles
+    cx, sx, cy, sy, cz, sz = math.cos(rx), math.sin(rx), math.cos(ry), math.sin(ry), math.cos(rz), math.sin(rz)
+    rotation_x = np.array(((1.0, 0.0, 0.0), (0.0, cx, -sx), (0.0, sx, cx)))
+    rotation_y = np.array(((cy, 0.0, sy), (0.0, 1.0, 0.0), (-sy, 0.0, cy)))
+    rotation_z = np.array(((cz, -sz, 0.0), (sz, cz, 0.0), (0.0, 0.0, 1.0)))
+    return rotation_z @ rotation_y @ rotation_x
+
+def track_to_rotation(location, target=(0.0, 0.0, 0.0)):
+    # Orientation given by Blender's Track To constraint (-Z towards the target, Y up), as columns X, Y, Z
+    z_axis = np.asarray(location, dtype=np.float64) - np.asarray(target, dtype=np.float64)
+    norm = np.linalg.norm(z_axis)
+    z_axis = z_axis / norm if norm > 0.0 else np.array((0.0, 0.0, 1.0))
+    up = np.array((0.0, 0.0, 1.0))
+    y_axis = up - np.dot(up, z_axis) * z_axis
+    norm = np.linalg.norm(y_axis)
+    y_axis = y_axis / norm if norm > 0.0 else np.array((0.0, 1.0, 0.0))
+    x_axis = np.cross(y_axis, z_axis)
+    x_axis = x_axis / np.linalg.norm(x_axis)
+    return np.stack((x_axis, y_axis, z_axis), axis=1)
+
+def camera_to_world(rx, rz, distance):
+    # 4x4 camera-to-world matrix (Blender convention: X right, Y up, looking along -Z) of the camera placed by
+    # render_blender.py at distance from the origin, with the camera empty rotated by the Euler angles (rx, 0, rz).
+    # The angles are rounded to 32 bits like Blender's properties, which decides the orientation of the top and
+    # bottom views (the camera is then not exactly above the origin).
+    rx = float(np.float32(rx))
+    rz = float(np.float32(rz))
+    location = euler_matrix(rx, 0.0, rz) @ np.array((0.0, distance, 0.0))
+    matrix = np.eye(4)
+    matrix[:3, :3] = track_to_rotation(location)
+    matrix[:3, 3] = location
+    return matrix
+
+def view_rotations(views=8, camera_angle=30, canonical_views=True):
+    # Names and camera empty rotations (rx, rz in radians) of the views rendered by render_blender.py.
+    # The turntable azimuth is accumulated in 32 bits, as Blender does when incrementing rotation_euler.
+    rotations = []
+    stepsize = 360.0 / views
+    rz = 0.0
+    for i in range(views):
+        rotations.append(('_r_{0:03d}'.format(int(i * stepsize)), math.radians(camera_angle), rz))
+        rz = float(np.float32(rz + math.radians(stepsize)))
+    if canonical_views:
+        rotations += canonical_rotations()
+    return rotations
+
+VIEWPOINT_SETS = ['turntable', 'elevations', 'fibonacci', 'file']
+
+def direction_rotation(direction):
+    # Camera empty rotation (rx, rz) placing the camera along the given direction from the origin:
+    # the camera sits at Rz(rz) @ Rx(rx) @ (0, d, 0), so rx is the elevation and rz the azimuth from +Y
+    x, y, z = np.asarray(direction, dtype=np.float64) / np.linalg.norm(direction)
+    return math.asin(min(1.0, max(-1.0, z))), math.atan2(-x, y)
+
+def canonical_rotations():
+    return [('_top', math.radians(90), 0.0),
+            ('_bottom', math.radians(-90), 0.0),
+            ('_left', 0.0, math.radians(90)),
+            ('_right', 0.0, math.radians(-90)),
+            ('_front', 0.0, 0.0),
+            ('_back', 0.0, math.radians(180))]
+
+def elevation_rotations(views=8, elevations=(0, 30, 60)):
+    # A turntable of views equally-spaced azimuths at every elevation (in degrees)
+    rotations = []
+    stepsize = 360.0 / views
+    for elevation in elevations:
+        for i in range(views):
+            name = '_e{:g}_r_{:03d}'.format(elevation, int(i * stepsize))
+            rotations.append((name, math.radians(elevation), math.radians(i * stepsize)))
+    return rotations
+
+def fibonacci_rotations(count=50):
+    # Nearly uniform directions on the sphere (Fibonacci lattice), from the top to the bottom
+    rotations = []
+    golden_angle = math.pi * (3.0 - math.sqrt(5.0))
+    for i in range(count):
+        z = 1.0 - 2.0 * (i + 0.5) / count
+        radius = math.sqrt(max(0.0, 1.0 - z * z))
+        direction = (radius * math.cos(golden_angle * i), radius * math.sin(golden_angle * i), z)
+        rotations.append(('_f_{:03d}'.format(i),) + direction_rotation(direction))
+    return rotations
+
+def pose_file_rotations(filepath):
+    # Views listed in a JSON file, as a list of {"name": "_my_view", "elevation": 30, "azimuth": 45} (in degrees)
+    with open(filepath, 'r') as file:
+        poses = json.load(file)
+    return [(pose['name'], math.radians(pose['elevation']), math.radians(pose['azimuth'])) for pose in poses]
+
+def viewpoints(viewpoint_set='turntable', views=8, camera_angle=30, canonical_views=True, elevations=(0, 30, 60),
+               viewpoint_count=50, pose_file=None):
+    # Names and camera empty rotations (rx, rz in radians) of the views of a viewpoint set (one of VIEWPOINT_SETS).
+    # The canonical views are added to every set but the pose file, which lists all of its views.
+    if viewpoint_set == 'turntable':
+        return view_rotations(views, camera_angle, canonical_views)
+    if viewpoint_set == 'file':
+        return pose_file_rotations(pose_file)
+    if viewpoint_set == 'elevations':
+        rotations = elevation_rotations(views, elevations)
+    elif viewpoint_set == 'fibonacci':
+        rotations = fibonacci_rotations(viewpoint_count)
+    else:
+        raise ValueError('unknown viewpoint set {}'.format(viewpoint_set))
+    return rotations + (canonical_rotations() if canonical_views else [])
+
+def write_cameras(filepath, model, width, height, K, frames, **fields):
+    # Write the cameras of the views of a model: the intrinsics K and, for every frame, the view name, the image
+    # file names and the 4x4 camera-to-world matrix (Blender convention: X right, Y up, looking along -Z)
+    record = {'model': model, 'width': width, 'height': height, 'K': np.asarray(K, dtype=np.float64).tolist()}
+    record.update(fields)
+    record['frames'] = [dict(frame, camera_to_world=np.asarray(frame['camera_to_world'], dtype=np.float64).tolist())
+                        for frame in frames]
+    filepath_tmp = '{}.{}.tmp'.format(filepath, os.getpid())
+    with open(filepath_tmp, 'w') as file:
+        json.dump(record, file, indent=1)
+    os.replace(filepath_tmp, filepath)
+
+def read_cameras(filepath):
+    with open(filepath, 'r') as file:
+        record = json.load(file)
+    record['K'] = np.array(record['K'])
+    for frame in record['frames']:
+        frame['camera_to_world'] = np.array(frame['camera_to_world'])
+    return record
+
+def camera_distance(aligned_dims, model_distance_scale=2.1):
+    # Distance from the camera to the origin, from the aligned dimensions of the model in centimeters
+    return model_distance_scale * max(aligned_dims) / 100.0
+
+def pixel_rays(width, height, K):
+    # Ray through the center of every pixel (height, width, 3) in the camera frame (Blender convention: X right,
+    # Y up, looking along -Z), scaled to a plane depth of 1, so that the point of a pixel is its ray times its depth.
+    # Rows are indexed from the top of the image.
+    K = np.asarray(K, dtype=np.float64)
+    x = (np.arange(width, dtype=np.float64) + 0.5 - K[0, 2]) / K[0, 0]
+    y = (K[1, 2] - np.arange(height, dtype=np.float64) - 0.5) / K[1, 1]
+    rays = np.empty((height, width, 3), dtype=np.float32)
+    rays[:, :, 0] = x[np.newaxis, :]
+    rays[:, :, 1] = y[:, np.newaxis]
+    rays[:, :, 2] = -1.0
+    return rays
+
+def depth_to_points(depth, rays, camera_to_world=None):
+    # Back-project the pixels with depth (in meters, to the camera plane) to 3D points, in the camera frame or,
+    # with camera_to_world, in the world frame. Returns the points (N, 3) and the mask of the pixels they come from.
+    mask = np.isfinite(depth) & (depth > 0)
+    points = rays[mask] * depth[mask][:, np.newaxis]
+    if camera_to_world is not None:
+        camera_to_world = np.asarray(camera_to_world, dtype=np.float32)
+        points = points @ camera_to_world[:3, :3].T + camera_to_world[:3, 3]
+    return points, mask
@@ -0,0 +1,403 @@
+# Readers and writers for the image files written by the rendering scripts.
+# Only depends on numpy (and zlib from the standard library), so the outputs can be processed outside of Blender.
+#
+# OpenEXR: single part scanline files with HALF, FLOAT or UINT channels, without compression or with the ZIPS and
+# ZIP codecs (Blender's default). Files with other codecs (PIZ, DWAA, ...) are read with the OpenEXR Python
+# bindings when they are installed.
+#
+# PNG: 8 and 16 bit, grayscale, RGB and RGBA, non interlaced. Pillow is used to decode 8 bit files when it is installed,
+# the numpy fallback is correct but slower.
+#
+# Depth maps are stored in one of the DEPTH_FORMATS:
+#   exr_rgb: 32-bit float OpenEXR with three identical channels (Blender's default output, lossless).
+#   exr:     single channel OpenEXR, full (lossless) or half precision. Half floats keep 11 significant bits, so the
+#            error is at most 2^-11 of the depth: 0.49 mm at 1 m, 4.9 mm at the 10 m far clipping plane. ZIP and PIZ
+#            are lossless; DWAA is lossy and its error depends on the content, so measure it with convert_depth.py.
+#   png16:   16-bit grayscale PNG in millimeters, like the Kinect (error at most 0.5 mm, up to 65.534 m). Pixels
+#            without depth get the invalid value (0 by default, as the Kinect).
+#
+# PLY: binary little endian point clouds with float coordinates and optional uchar colors.
+#
+# Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
+
+import io, os, struct, tempfile, zlib
+import numpy as np
+
+EXR_MAGIC = b'\x76\x2f\x31\x01'
+EXR_COMPRESSIONS = {'NONE': 0, 'RLE': 1, 'ZIPS': 2, 'ZIP': 3, 'PIZ': 4, 'PXR24': 5, 'B44': 6, 'B44A': 7, 'DWAA': 8, 'DWAB': 9}
+EXR_PIXEL_TYPES = {0: np.dtype('<u4'), 1: np.dtype('<f2'), 2: np.dtype('<f4')}
+# Number of scanlines per chunk of each codec
+EXR_LINES_PER_CHUNK = {0: 1, 1: 1, 2: 1, 3: 16, 4: 32, 5: 16, 6: 32, 7: 32, 8: 32, 9: 256}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+DEPTH_FORMATS = ['exr_rgb', 'exr', 'png16']
+DEPTH_EXTENSIONS = {'exr_rgb': '.exr', 'exr': '.exr', 'png16': '.png'}
+
+def read_null_terminated(data, offset):
+    end = data.index(b'\x00', offset)
+    return data[offset:end].decode(), end + 1
+
+def parse_exr_header(data):
+    # Returns the header attributes (only the ones needed to decode the pixels are parsed) and the header size
+    if data[:4] != EXR_MAGIC:
+        raise ValueError('not an OpenEXR file')
+    version, = struct.unpack_from('<i', data, 4)
+    if version & 0x1a00:
+        raise ValueError('only single part scanline OpenEXR files are supported')
+    header = {}
+    offset = 8
+    while data[offset] != 0:
+        name, offset = read_null_terminated(data, offset)
+        attribute_type, offset = read_null_terminated(data, offset)
+        size, = struct.unpack_from('<i', data, offset)
+        offset += 4
+        value = data[offset:offset + size]
+        offset += size
+        if attribute_type == 'chlist':
+            channels = []
+            position = 0
+            while value[position] != 0:
+                channel_name, position = read_null_terminated(value, position)
+                pixel_type, = struct.unpack_from('<i', value, position)
+                position += 16
+                channels.append((channel_name, pixel_type))
+            header[name] = channels
+        elif attribute_type == 'compression':
+            header[name] = value[0]
+        elif attribute_type == 'box2i':
+            header[name] = struct.unpack('<4i', value)
+    return header, offset + 1
+
+def undo_zip_predictor(data):
+    # Inverse of OpenEXR's ZIP predictor and byte reordering
+    values = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    values[1:] -= 128
+    values = (np.cumsum(values) & 0xff).astype(np.uint8)
+    half = (len(values) + 1) // 2
+    result = np.empty_like(values)
+    result[0::2] = values[:half]
+    result[1::2] = values[half:]
+    return result.tobytes()
+
+def apply_zip_predictor(data):
+    # OpenEXR's ZIP byte reordering (even bytes first) and delta predictor
+    values = np.frombuffer(data, dtype=np.uint8)
+    values = np.concatenate((values[0::2], values[1::2])).astype(np.int64)
+    values[1:] = (values[1:] - values[:-1] + 128) & 0xff
+    return values.astype(np.uint8).tobytes()
+
+def decode_exr_with_bindings(data):
+    # Fallback for the codecs that are not implemented here
+    try:
+        import OpenEXR, Imath
+    except ImportError:
+        raise ValueError('unsupported OpenEXR compression, install the OpenEXR Python bindings to read it')
+    with tempfile.NamedTemporaryFile(suffix='.exr', delete=False) as file:
+        file.write(data)
+    try:
+        exr_file = OpenEXR.InputFile(file.name)
+        header = exr_file.header()
+        window = header['dataWindow']
+        width, height = window.max.x - window.min.x + 1, window.max.y - window.min.y + 1
+        float_type = Imath.PixelType(Imath.PixelType.FLOAT)
+        return {name: np.frombuffer(exr_file.channel(name, float_type), dtype=np.float32).reshape(height, width)
+                for name in header['channels']}
+    finally:
+        os.remove(file.name)
+
+def read_exr(filepath):
+    # Read an OpenEXR file into a dictionary of 2D arrays, one per channel
+    with open(filepath, 'rb') as file:
+        return decode_exr(file.read())
+
+def decode_exr(data, names=None, stride=1):
+    # Decode the bytes of an OpenEXR file into a dictionary of 2D arrays, one per channel (only the channels in names,
+    # when given). With stride > 1, only every stride-th scanline and pixel is returned, and only the chunks holding
+    # those scanlines are decompressed.
+    header, offset = parse_exr_header(data)
+    compression = header['compression']
+    if compression not in (0, 2, 3):
+        return {name: values[::stride, ::stride] for name, values in decode_exr_with_bindings(data).items()
+                if names is None or name in names}
+
+    x_min, y_min, x_max, y_max = header['dataWindow']
+    width, height = x_max - x_min + 1, y_max - y_min + 1
+    channels = sorted(header['channels'])
+    lines_per_chunk = EXR_LINES_PER_CHUNK[compression]
+    chunk_count = (height + lines_per_chunk - 1) // lines_per_chunk
+    line_size = sum(EXR_PIXEL_TYPES[pixel_type].itemsize for _, pixel_type in channels) * width
+    offsets = np.frombuffer(data, dtype='<u8', count=chunk_count, offset=offset)
+    needed_chunks = set(line // lines_per_chunk for line in range(0, height, stride))
+
+    pixels = bytearray(line_size * height)
+    for chunk_index, chunk_offset in enumerate(offsets):
+        if chunk_index not in needed_chunks:
+            continue
+        y, size = struct.unpack_from('<ii', data, int(chunk_offset))
+        chunk = data[int(chunk_offset) + 8:int(chunk_offset) + 8 + size]
+        first_line = y - y_min
+        expected_size = line_size * min(lines_per_chunk, height - first_line)
+        if compression != 0 and size < expected_size:
+            chunk = undo_zip_predictor(zlib.decompress(chunk))
+        pixels[first_line * line_size:first_line * line_size + expected_size] = chunk
+
+    # Each scanline holds the values of every channel (in alphabetical order) one after the other
+    result = {}
+    line_offset = 0
+    for name, pixel_type in channels:
+        dtype = EXR_PIXEL_TYPES[pixel_type]
+        if names is None or name in names:
+            values = np.ndarray((height, width), dtype=dtype, buffer=pixels, offset=line_offset, strides=(line_size, dtype.itemsize))
+            values = values[::stride, ::stride]
+            result[name] = values.astype(np.float32) if pixel_type == 1 else values.copy()
+        line_offset += dtype.itemsize * width
+    return result
+
+def exr_attribute(name, attribute_type, value):
+    return name.encode() + b'\x00' + attribute_type.encode() + b'\x00' + struct.pack('<i', len(value)) + value
+
+def write_exr_with_bindings(filepath, channels, compression, half):
+    # Fallback for the codecs that are not implemented here
+    try:
+        import OpenEXR, Imath
+    except ImportError:
+        raise ValueError('install the OpenEXR Python bindings to write {} compressed OpenEXR files'.format(compression))
+    height, width = next(iter(channels.values())).shape
+    pixel_type = Imath.PixelType(Imath.PixelType.HALF if half else Imath.PixelType.FLOAT)
+    header = OpenEXR.Header(width, height)
+    header['channels'] = {name: Imath.Channel(pixel_type) for name in channels}
+    header['compression'] = Imath.Compression(getattr(Imath.Compression, compression + '_COMPRESSION'))
+    exr_file = OpenEXR.OutputFile(filepath, header)
+    exr_file.writePixels({name: np.ascontiguousarray(values, dtype=np.float16 if half else np.float32).tobytes()
+                          for name, values in channels.items()})
+    exr_file.close()
+
+def write_exr(filepath, channels, compression='ZIP', half=False):
+    # Write a dictionary of 2D arrays (one per channel) as a scanline OpenEXR file with the NONE, ZIPS or ZIP codec,
+    # with 32-bit float channels (or 16-bit half floats). Other codecs are written with the OpenEXR Python bindings.
+    if compression not in EXR_COMPRESSIONS:
+        raise ValueError('unsupported OpenEXR compression {}'.format(compression))
+    if compression not in ('NONE', 'ZIPS', 'ZIP'):
+        return write_exr_with_bindings(filepath, channels, compression, half)
+    names = sorted(channels)
+    height, width = channels[names[0]].shape
+    pixel_type = 1 if half else 2
+    dtype = EXR_PIXEL_TYPES[pixel_type]
+
+    channel_list = b''.join(name.encode() + b'\x00' + struct.pack('<iB3xii', pixel_type, 0, 1, 1) for name in names) + b'\x00'
+    header = EXR_MAGIC + struct.pack('<i', 2)
+    header += exr_attribute('channels', 'chlist', channel_list)
+    header += exr_attribute('compression', 'compression', bytes((EXR_COMPRESSIONS[compression],)))
+    header += exr_attribute('dataWindow', 'box2i', struct.pack('<4i', 0, 0, width - 1, height - 1))
+    header += exr_attribute('displayWindow', 'box2i', struct.pack('<4i', 0, 0, width - 1, height - 1))
+    header += exr_attribute('lineOrder', 'lineOrder', b'\x00')
+    header += exr_attribute('pixelAspectRatio', 'float', struct.pack('<f', 1.0))
+    header += exr_attribute('screenWindowCenter', 'v2f', struct.pack('<2f', 0.0, 0.0))
+    header += exr_attribute('screenWindowWidth', 'float', struct.pack('<f', 1.0))
+    header += b'\x00'
+
+    # Interleave the channels scanline by scanline
+    lines = np.concatenate([np.ascontiguousarray(channels[name], dtype=dtype) for name in names], axis=1)
+    line_size = lines.shape[1] * dtype.itemsize
+    lines = lines.tobytes()
+
+    lines_per_chunk = EXR_LINES_PER_CHUNK[EXR_COMPRESSIONS[compression]]
+    chunks = []
+    for y in range(0, height, lines_per_chunk):
+        chunk = lines[y * line_size:min(y + lines_per_chunk, height) * line_size]
+        if compression != 'NONE':
+            compressed = zlib.compress(apply_zip_predictor(chunk))
+            if len(compressed) < len(chunk):
+                chunk = compressed
+        chunks.append(struct.pack('<ii', y, len(chunk)) + chunk)
+
+    offset = len(header) + 8 * len(chunks)
+    offsets = []
+    for chunk in chunks:
+        offsets.append(offset)
+        offset += len(chunk)
+    with open(filepath, 'wb') as file:
+        file.write(header)
+        file.write(np.array(offsets, dtype='<u8').tobytes())
+        for chunk in chunks:
+            file.write(chunk)
+
+def paeth(left, up, up_left):
+    estimate = left + up - up_left
+    distance_left, distance_up, distance_up_left = abs(estimate - left), abs(estimate - up), abs(estimate - up_left)
+    if distance_left <= distance_up and distance_left <= distance_up_left:
+        return left
+    return up if distance_up <= distance_up_left else up_left
+
+def unfilter_scanlines(data, height, stride, bytes_per_pixel):
+    # Undo the PNG filters of every scanline. Sub and Up are vectorized, Average and Paeth are sequential.
+    lines = np.frombuffer(data, dtype=np.uint8)[:height * (stride + 1)].reshape(height, stride + 1)
+    result = np.zeros((height, stride), dtype=np.uint8)
+    previous = np.zeros(stride, dtype=np.uint8)
+    for y in range(height):
+        filter_type = lines[y, 0]
+        line = lines[y, 1:]
+        if filter_type == 0:
+            current = line
+        elif filter_type == 1:
+            current = (np.cumsum(line.reshape(-1, bytes_per_pixel), axis=0, dtype=np.int64) & 0xff).astype(np.uint8).ravel()
+        elif filter_type == 2:
+            current = line + previous
+        else:
+            current = bytearray(line.tobytes())
+            up = previous.tolist()
+            for x in range(stride):
+                left = current[x - bytes_per_pixel] if x >= bytes_per_pixel else 0
+                if filter_type == 3:
+                    current[x] = (current[x] + ((left + up[x]) >> 1)) & 0xff
+                else:
+                    up_left = up[x - bytes_per_pixel] if x >= bytes_per_pixel else 0
+                    current[x] = (current[x] + paeth(left, up[x], up_left)) & 0xff
+            current = np.frombuffer(bytes(current), dtype=np.uint8)
+        result[y] = current
+        previous = result[y]
+    return result
+
+def decode_png(data):
+    # Decode the bytes of a PNG file into an array of shape (height, width) or (height, width, channels),
+    # of type uint8 or uint16 depending on the bit depth
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError('not a PNG file')
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack_from('>IIBBBBB', data, 16)
+    if bit_depth == 8:
+        try:
+            from PIL import Image
+            return np.asarray(Image.open(io.BytesIO(data)))
+        except ImportError:
+            pass
+    channels = {0: 1, 2: 3, 4: 2, 6: 4}.get(color_type)
+    if channels is None or bit_depth not in (8, 16) or interlace:
+        raise ValueError('unsupported PNG format')
+
+    compressed = []
+    offset = 8
+    while offset < len(data):
+        length, chunk_type = struct.unpack_from('>I4s', data, offset)
+        if chunk_type == b'IDAT':
+            compressed.append(data[offset + 8:offset + 8 + length])
+        elif chunk_type == b'IEND':
+            break
+        offset += length + 12
+    bytes_per_pixel = channels * bit_depth // 8
+    pixels = unfilter_scanlines(zlib.decompress(b''.join(compressed)), height, width * bytes_per_pixel, bytes_per_pixel)
+    if bit_depth == 16:
+        pixels = pixels.view('>u2').astype(np.uint16)
+    pixels = pixels.reshape(height, width, channels)
+    return pixels[:, :, 0] if channels == 1 else pixels
+
+def read_png(filepath):
+    with open(filepath, 'rb') as file:
+        return decode_png(file.read())
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+def write_png(filepath, pixels, level=6):
+    # Write a uint8 or uint16 array of shape (height, width) or (height, width, channels) with 1, 3 or 4 channels
+    # as a PNG file. Every scanline uses the Up filter, which is vectorized and suits smooth images like depth maps.
+    pixels = np.asarray(pixels)
+    if pixels.dtype not in (np.uint8, np.uint16):
+        raise ValueError('only uint8 and uint16 images can be written as PNG')
+    height, width = pixels.shape[:2]
+    channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+    lines = pixels.astype(pixels.dtype.newbyteorder('>')).reshape(height, -1).view(np.uint8)
+    filtered = np.empty((height, lines.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = lines[0]
+    filtered[1:, 1:] = lines[1:] - lines[:-1]
+
+    header = struct.pack('>IIBBBBB', width, height, pixels.dtype.itemsize * 8, color_type, 0, 0, 0)
+    with open(filepath, 'wb') as file:
+        file.write(PNG_SIGNATURE)
+        file.write(png_chunk(b'IHDR', header))
+        file.write(png_chunk(b'IDAT', zlib.compress(filtered.tobytes(), level)))
+        file.write(png_chunk(b'IEND', b''))
+
+def depth_to_millimeters(depth, invalid_value=0):
+    # Depth in meters (0 where there is no object) to the uint16 millimeters of the png16 format
+    millimeters = np.clip(np.rint(depth * 1000.0), 0, 65535).astype(np.uint16)
+    millimeters[depth <= 0] = invalid_value
+    return millimeters
+
+def millimeters_to_depth(millimeters, invalid_value=0):
+    depth = millimeters.astype(np.float32) / 1000.0
+    depth[millimeters == invalid_value] = 0.0
+    return depth
+
+def write_depth(filepath, depth, depth_format='exr_rgb', compression='ZIP', half=False, invalid_value=0):
+    # Write a depth map in meters (0 where there is no object) in one of the DEPTH_FORMATS
+    if depth_format == 'png16':
+        write_png(filepath, depth_to_millimeters(depth, invalid_value))
+    elif depth_format == 'exr':
+        write_exr(filepath, {'Y': depth}, compression, half)
+    elif depth_format == 'exr_rgb':
+        write_exr(filepath, {'R': depth, 'G': depth, 'B': depth}, compression, half)
+    else:
+        raise ValueError('unknown depth format {}'.format(depth_format))
+
+def decode_depth(data, invalid_value=0, stride=1):
+    # Decode the bytes of a depth map written by the rendering scripts, in meters (0 where there is no object).
+    # With stride > 1, only every stride-th row and column is returned (see decode_exr).
+    if data[:8] == PNG_SIGNATURE:
+        return millimeters_to_depth(decode_png(data)[::stride, ::stride], invalid_value)
+    # Only the depth channel is decoded (the exr_rgb format repeats it in R, G and B)
+    names = [name for name, _ in parse_exr_header(data)[0]['channels']]
+    name = next((name for name in ('Y', 'V', 'R', 'Z') if name in names), names[0])
+    return decode_exr(data, [name], stride)[name].astype(np.float32)
+
+def read_depth(filepath, invalid_value=0):
+    with open(filepath, 'rb') as file:
+        return decode_depth(file.read(), invalid_value)
+
+PLY_TYPES = {'float': np.dtype('<f4'), 'double': np.dtype('<f8'), 'uchar': np.dtype('u1'), 'ushort': np.dtype('<u2'),
+             'int': np.dtype('<i4'), 'uint': np.dtype('<u4')}
+
+def write_ply(filepath, points, colors=None):
+    # Binary little endian PLY point cloud with float x, y, z and, with colors (N, 3) uint8, uchar red, green, blue
+    fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    if colors is not None:
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    vertices = np.empty(len(points), dtype=fields)
+    vertices['x'], vertices['y'], vertices['z'] = np.asarray(points, dtype=np.float32).T
+    if colors is not None:
+        vertices['red'], vertices['green'], vertices['blue'] = np.asarray(colors, dtype=np.uint8).T
+    names = {'<f4': 'float', 'u1': 'uchar'}
+    header = ['ply', 'format binary_little_endian 1.0', 'element vertex {}'.format(len(points))]
+    header += ['property {} {}'.format(names[field_type], name) for name, field_type in fields]
+    header.append('end_header')
+    with open(filepath, 'wb') as file:
+        file.write(('\n'.join(header) + '\n').encode('ascii'))
+        file.write(vertices.tobytes())
+
+def read_ply(filepath):
+    # Read a binary little endian PLY point cloud (only the vertices). Returns the points (N, 3) float32 and the
+    # colors (N, 3) uint8, or None when there are none.
+    with open(filepath, 'rb') as file:
+        data = file.read()
+    end = data.index(b'end_header\n') + len(b'end_header\n')
+    fields = []
+    count = 0
+    element = None
+    for line in data[:end].decode('ascii').splitlines():
+        tokens = line.split()
+        if tokens[:1] == ['format'] and tokens[1] != 'binary_little_endian':
+            raise ValueError('only binary little endian PLY files are supported')
+        if tokens[:1] == ['element']:
+            element = tokens[1]
+            if element == 'vertex':
+                count = int(tokens[2])
+        elif tokens[:1] == ['property'] and element == 'vertex':
+            fields.append((tokens[2], PLY_TYPES[tokens[1]]))
+    vertices = np.frombuffer(data, dtype=fields, count=count, offset=end)
+    points = np.stack([vertices['x'], vertices['y'], vertices['z']], axis=1).astype(np.float32)
+    colors = None
+    if 'red' in vertices.dtype.names:
+        colors = np.stack([vertices['red'], vertices['green'], vertices['blue']], axis=1).astype(np.uint8)
+    return points, colors
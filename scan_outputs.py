@@ -0,0 +1,234 @@
+# A script to find the bad renders of a run of render_blender.py, which often exits without an error even when the
+# outputs are useless: an empty or fully transparent .png when the camera distance (aligned_dims, model_distance_scale)
+# is wrong, a depth map without any depth (e.g. the model is beyond the far clipping plane), a model cut by the
+# near clipping plane or by the image border, or missing views. A model cut by the far clipping plane loses its far
+# side in both the .png and the depth map, so it is not flagged by the depth range; it shows up as rgb_depth_mismatch
+# when the compositor removes the depth of the pixels just before the far clipping plane.
+#
+# Usage: python scan_outputs.py --file /path/to/commands.txt
+# Usage: python scan_outputs.py --manifest /path/to/manifest.jsonl --stride 8
+#
+# Every model is checked by a pool of processes. The image headers are checked first (format and size, from the
+# first bytes of the files), and only the views with valid headers are read and decoded. Every --stride-th row and
+# column is used to compute, for every view, the coverage of the model in the .png (alpha) and in the depth map, the
+# fraction of the image border covered by the model and the depth range. For the depth maps in OpenEXR, only the
+# depth channel of the chunks holding those rows is decompressed; the .png files are decompressed in full (the PNG
+# filters make every row depend on the previous one) and then subsampled.
+# The metrics and anomalies of every model are written to <commands file>.scan.jsonl, and the commands (or the manifest
+# lines) of the models with anomalies to <commands file>.requeue.txt (or <manifest>.requeue.jsonl), in the input format
+# of render_blender_parallel.py (or render_blender.py --manifest). With --header_only 1, only the files and their
+# headers are checked.
+#
+# The runner skips the commands whose outputs exist, so use --remove_bad 1 to delete the outputs of the bad models
+# before rendering the requeue file:
+# Usage: python scan_outputs.py --file /path/to/commands.txt --remove_bad 1
+#        python render_blender_parallel.py --file /path/to/commands.txt.requeue.txt
+#
+# Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
+
+import argparse, json, os, struct, time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import pack_outputs, render_blender_parallel, rgbd_io
+
+# Near camera clipping (in meters), as in render_blender.py
+Clip_start = 0.1
+# Bytes read to check the header of a file, enough for the headers written by Blender and rgbd_io
+HEADER_SIZE = 4096
+
+def image_size(data):
+    # Width and height from the header of a PNG or OpenEXR file
+    if data[:8] == rgbd_io.PNG_SIGNATURE:
+        return struct.unpack_from('>II', data, 16)
+    header, _ = rgbd_io.parse_exr_header(data)
+    x_min, y_min, x_max, y_max = header['dataWindow']
+    return x_max - x_min + 1, y_max - y_min + 1
+
+def border_fraction(mask):
+    # Fraction of the pixels of the image border covered by the model
+    border = np.concatenate((mask[0], mask[-1], mask[1:-1, 0], mask[1:-1, -1]))
+    return float(border.mean()) if len(border) else 0.0
+
+def scan_view(view, rendered, options):
+    # Metrics and anomalies of a single view
+    metrics = {'name': view['name'], 'anomalies': []}
+    anomalies = metrics['anomalies']
+    headers = {}
+    for key in ('rgb', 'depth'):
+        try:
+            with open(view[key], 'rb') as file:
+                headers[key] = file.read(HEADER_SIZE)
+        except OSError:
+            anomalies.append('missing_' + key)
+            continue
+        try:
+            if image_size(headers[key]) != (rendered['width'], rendered['height']):
+                anomalies.append('wrong_size_' + key)
+        except (ValueError, KeyError, IndexError, struct.error):
+            anomalies.append('unreadable_' + key)
+    if options['header_only'] or anomalies:
+        return metrics
+
+    stride = options['stride']
+    try:
+        data = {}
+        for key in ('rgb', 'depth'):
+            with open(view[key], 'rb') as file:
+                data[key] = file.read()
+        rgb = rgbd_io.decode_png(data['rgb'])[::stride, ::stride]
+        depth = rgbd_io.decode_depth(data['depth'], rendered['depth_invalid_value'], stride)
+    except (ValueError, KeyError, IndexError, struct.error, OSError):
+        anomalies.append('unreadable')
+        return metrics
+    # The renders have a transparent background; without alpha, the background is black
+    if rgb.ndim == 3 and rgb.shape[2] in (2, 4):
+        rgb_mask = rgb[..., -1] > 0
+    else:
+        rgb_mask = (rgb.reshape(rgb.shape[0], rgb.shape[1], -1) > 0).any(axis=2)
+    depth_mask = np.isfinite(depth) & (depth > 0)
+
+    metrics['rgb_coverage'] = float(rgb_mask.mean())
+    metrics['depth_coverage'] = float(depth_mask.mean())
+    metrics['border'] = max(border_fraction(rgb_mask), border_fraction(depth_mask))
+    metrics['depth_min'] = float(depth[depth_mask].min()) if depth_mask.any() else 0.0
+    metrics['depth_max'] = float(depth[depth_mask].max()) if depth_mask.any() else 0.0
+
+    if metrics['rgb_coverage'] < options['min_coverage']:
+        anomalies.append('empty_rgb')
+    if metrics['depth_coverage'] < options['min_coverage']:
+        anomalies.append('empty_depth')
+    elif metrics['depth_min'] < Clip_start + options['clip_margin']:
+        anomalies.append('near_clipped')
+    if abs(metrics['rgb_coverage'] - metrics['depth_coverage']) > options['max_mismatch']:
+        anomalies.append('rgb_depth_mismatch')
+    if metrics['border'] > options['max_border']:
+        anomalies.append('cut_by_border')
+    return metrics
+
+def scan_model(model, options):
+    # Metrics and anomalies of every view of a model
+    start = time.time()
+    rendered = pack_outputs.model_views(model)
+    result = {'model': rendered['model'], 'obj': model['obj'], 'anomalies': [], 'views': []}
+    if model.get('viewpoints', 'turntable') != 'turntable' and 'cameras' not in rendered:
+        # The views of the other viewpoint sets are only known from the cameras file
+        result['anomalies'].append('missing_cameras')
+    else:
+        for view in rendered['views']:
+            metrics = scan_view(view, rendered, options)
+            result['views'].append(metrics)
+            for anomaly in metrics['anomalies']:
+                if anomaly not in result['anomalies']:
+                    result['anomalies'].append(anomaly)
+        # Models that are empty in every view usually have a wrong scale, not a bad view
+        if result['views'] and all('empty_rgb' in metrics['anomalies'] for metrics in result['views']):
+            result['anomalies'].append('empty_model')
+    result['duration'] = time.time() - start
+    return result
+
+def scan_model_star(task):
+    return scan_model(*task)
+
+def remove_outputs(model):
+    # Delete the outputs of a model, so that the runner renders it again
+    rendered = pack_outputs.model_views(model)
+    pack_outputs.remove_loose_files(rendered)
+
+def requeue_commands(commands, bad_models, requeue_path):
+    # The commands with bad models, as lines of a commands file. The commands rendering a manifest are pointed to a
+    # manifest of only their bad models, written next to the requeue file.
+    lines = []
+    for i, command in enumerate(commands):
+        models = [model for model in render_blender_parallel.command_models(command) if model['obj'] in bad_models]
+        if not models:
+            continue
+        options = render_blender_parallel.parse_command(command)
+        if 'manifest' in options:
+            manifest_path = '{}.{}.jsonl'.format(requeue_path, i)
+            manifest = [line for line in render_blender_parallel.read_manifest(options['manifest']) if line['obj'] in bad_models]
+            write_lines(manifest_path, [json.dumps(line) + '\n' for line in manifest])
+            command = command.replace(options['manifest'], manifest_path)
+        lines.append(command + '\n')
+    return lines
+
+def write_lines(filepath, lines):
+    filepath_tmp = '{}.{}.tmp'.format(filepath, os.getpid())
+    with open(filepath_tmp, 'w') as file:
+        file.writelines(lines)
+    os.replace(filepath_tmp, filepath)
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Checks the outputs of render_blender.py and lists the models to render again.')
+    parser.add_argument('--file', type=str, default=None,
+                        help='The file containing the list of commands that rendered the models.')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='JSON lines file listing the rendered models, as given to render_blender.py.')
+    parser.add_argument('--report', type=str, default=None,
+                        help='The file where the metrics of every model are written. Default is the input file with the .scan.jsonl suffix.')
+    parser.add_argument('--requeue', type=str, default=None,
+                        help='The file where the bad models are written. Default is the input file with the .requeue.txt (or .requeue.jsonl) suffix.')
+    parser.add_argument('--stride', type=int, default=4,
+                        help='Check every stride-th pixel in both directions. Default is 4.')
+    parser.add_argument('--header_only', type=int, default=0,
+                        help='1 to only check that the files exist and have valid headers.')
+    parser.add_argument('--min_coverage', type=float, default=0.001,
+                        help='Views where the model covers less than this fraction of the image are empty. Default is 0.001.')
+    parser.add_argument('--max_border', type=float, default=0.02,
+                        help='Views where the model covers more than this fraction of the image border are cut. Default is 0.02.')
+    parser.add_argument('--max_mismatch', type=float, default=0.05,
+                        help='Largest difference between the coverage of the .png and of the depth map. Default is 0.05.')
+    parser.add_argument('--clip_margin', type=float, default=0.01,
+                        help='Depths closer than this many meters to the near clipping plane are clipped. Default is 0.01.')
+    parser.add_argument('--remove_bad', type=int, default=0,
+                        help='1 to delete the outputs of the bad models, so that the runner renders them again.')
+    parser.add_argument('--max_workers', type=int, default=None,
+                        help='The number of processes checking models. Default is the number of cores.')
+    args = parser.parse_args()
+    if (args.file is None) == (args.manifest is None):
+        parser.error('exactly one of --file or --manifest must be given')
+
+    input_path = args.file if args.file is not None else args.manifest
+    if args.file is not None:
+        commands = render_blender_parallel.read_commands(args.file)
+        models = [model for command in commands for model in render_blender_parallel.command_models(command)]
+    else:
+        models = render_blender_parallel.read_manifest(args.manifest)
+    report_path = args.report or input_path + '.scan.jsonl'
+    requeue_path = args.requeue or input_path + ('.requeue.txt' if args.file is not None else '.requeue.jsonl')
+    options = {'stride': max(1, args.stride), 'header_only': bool(args.header_only), 'min_coverage': args.min_coverage,
+               'max_border': args.max_border, 'max_mismatch': args.max_mismatch, 'clip_margin': args.clip_margin}
+
+    start = time.time()
+    results = []
+    counts = {}
+    with ProcessPoolExecutor(max_workers=args.max_workers) as executor:
+        for result in executor.map(scan_model_star, [(model, options) for model in models], chunksize=4):
+            results.append(result)
+            for anomaly in result['anomalies']:
+                counts[anomaly] = counts.get(anomaly, 0) + 1
+    elapsed = max(time.time() - start, 1e-9)
+    write_lines(report_path, [json.dumps(result) + '\n' for result in results])
+
+    bad_models = set(result['obj'] for result in results if result['anomalies'])
+    if args.file is not None:
+        lines = requeue_commands(commands, bad_models, requeue_path)
+    else:
+        lines = [json.dumps(model) + '\n' for model in models if model['obj'] in bad_models]
+    write_lines(requeue_path, lines)
+    if args.remove_bad:
+        for model in models:
+            if model['obj'] in bad_models:
+                remove_outputs(model)
+
+    views = sum(len(result['views']) for result in results)
+    print('Scanned {} models ({} views) in {:.1f} s ({:.0f} views/s)'.format(len(results), views, elapsed, views / elapsed))
+    for anomaly, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print('    {}: {} models'.format(anomaly, count))
+    print('{} bad models, {} lines written to {} (metrics in {})'.format(len(bad_models), len(lines), requeue_path, report_path))
+    if bad_models and not args.remove_bad:
+        print('The outputs of the bad models were kept, so the runner will skip them until they are removed (--remove_bad 1)')
+
+if __name__ == "__main__":
+    main()
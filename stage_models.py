@@ -0,0 +1,150 @@
+# A script to build a render-ready folder of the ShapeNetSem models without copying them. The .mtl files reference
+# their textures by bare file names, so Blender only finds them when the textures are in the same folder as the
+# models; instead of copying models-textures into the models folder (many GB per dataset version), the staged folder
+# holds hard links (or symbolic links) to the original .obj files, to the fixed .mtl files (fix_shapenetsem.py
+# --output_folder) and to the textures that the .mtl files actually reference.
+#
+# Usage: python stage_models.py --obj_directory /path/to/ShapeNetSem/models-OBJ/models/ --texture_directory /path/to/ShapeNetSem/models-textures/textures/ --mtl_folder /path/to/fixed_mtl/ --output_folder /path/to/staged/
+#
+# Hard links need the staged folder on the same file system as the dataset; --link symbolic works across file systems
+# (on Windows, symbolic links need the developer mode or administrator rights). Running the script again only links
+# the new files. The report (also written to .stage_models.json in the staged folder) lists the textures shared by
+# several models and the textures that are referenced but missing.
+#
+# Alternatively, render_blender.py --texture_folder /path/to/ShapeNetSem/models-textures/textures/ finds the textures
+# itself, without any staged folder.
+#
+# Author: Ricardo Reis Pedreiras Cardoso, IST, 2024
+
+import argparse, json, os, time
+from concurrent.futures import ProcessPoolExecutor
+
+from index_metadata import MTLLIB, mtl_textures
+
+REPORT_FILENAME = '.stage_models.json'
+
+def model_files(obj_path, mtl_folder=None):
+    # The .mtl files of a model (the fixed ones of mtl_folder when they exist) and the textures they reference
+    with open(obj_path, 'rb') as file:
+        mtl_filenames = [mtllib.decode(errors='replace') for mtllib in MTLLIB.findall(file.read())]
+    mtl_paths = []
+    textures = []
+    for mtl_filename in mtl_filenames:
+        mtl_path = os.path.join(os.path.dirname(obj_path), mtl_filename)
+        if mtl_folder is not None and os.path.exists(os.path.join(mtl_folder, mtl_filename)):
+            mtl_path = os.path.join(mtl_folder, mtl_filename)
+        try:
+            with open(mtl_path, 'rb') as file:
+                textures += mtl_textures(file.read())
+        except OSError:
+            continue
+        mtl_paths.append((mtl_filename, mtl_path))
+    return obj_path, mtl_paths, sorted(set(textures))
+
+def model_files_star(task):
+    return model_files(*task)
+
+def texture_index(texture_directory):
+    # Path of every texture by its lower case file name, since the .mtl files do not always match the case
+    paths = {}
+    for root, _, filenames in os.walk(texture_directory):
+        for filename in filenames:
+            paths.setdefault(filename.lower(), os.path.join(root, filename))
+    return paths
+
+def link_file(source, destination, link):
+    # Link source to destination (hard or symbolic). Returns 'existing' when it was already linked.
+    try:
+        if os.path.samefile(source, destination):
+            return 'existing'
+    except OSError:
+        pass
+    directory, filename = os.path.split(destination)
+    destination_tmp = os.path.join(directory, '.{}.{}.tmp'.format(filename, os.getpid()))
+    if link == 'hard':
+        os.link(source, destination_tmp)
+    else:
+        os.symlink(os.path.abspath(source), destination_tmp)
+    os.replace(destination_tmp, destination)
+    return 'linked'
+
+def stage_models(obj_directory, output_folder, texture_directory=None, mtl_folder=None, link='hard', max_workers=None):
+    os.makedirs(output_folder, exist_ok=True)
+    textures = texture_index(texture_directory) if texture_directory is not None else {}
+    obj_paths = [os.path.join(obj_directory, filename) for filename in sorted(os.listdir(obj_directory)) if filename.endswith('.obj')]
+
+    linked = 0
+    existing = 0
+    staged_textures = {}
+    texture_users = {}
+    missing_textures = {}
+    tasks = [(obj_path, mtl_folder) for obj_path in obj_paths]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for obj_path, mtl_paths, texture_filenames in executor.map(model_files_star, tasks, chunksize=64):
+            model_identifier = os.path.splitext(os.path.basename(obj_path))[0]
+            files = [(obj_path, os.path.basename(obj_path))] + [(mtl_path, mtl_filename) for mtl_filename, mtl_path in mtl_paths]
+            for texture_filename in texture_filenames:
+                source = os.path.join(obj_directory, texture_filename)
+                if not os.path.exists(source):
+                    source = textures.get(os.path.basename(texture_filename.replace('\\', '/')).lower())
+                if source is None:
+                    missing_textures.setdefault(texture_filename, []).append(model_identifier)
+                    continue
+                texture_users.setdefault(texture_filename, []).append(model_identifier)
+                # Every texture is linked once, however many models share it
+                if texture_filename not in staged_textures:
+                    staged_textures[texture_filename] = source
+                    files.append((source, texture_filename))
+            for source, filename in files:
+                destination = os.path.join(output_folder, filename)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                if link_file(source, destination, link) == 'linked':
+                    linked += 1
+                else:
+                    existing += 1
+
+    shared = {texture: users for texture, users in texture_users.items() if len(users) > 1}
+    references = sum(len(users) for users in texture_users.values())
+    unique_size = sum(os.path.getsize(source) for source in staged_textures.values())
+    # What copying the whole texture directory into the models folder would take
+    directory_size = sum(os.path.getsize(source) for source in textures.values())
+    report = {'models': len(obj_paths), 'links_created': linked, 'links_existing': existing,
+              'texture_references': references, 'textures': len(staged_textures), 'shared_textures': len(shared),
+              'texture_size': unique_size, 'texture_directory_size': directory_size,
+              'most_shared': sorted(((texture, len(users)) for texture, users in shared.items()), key=lambda item: -item[1])[:20],
+              'missing_textures': missing_textures}
+    with open(os.path.join(output_folder, REPORT_FILENAME), 'w') as file:
+        json.dump(report, file, indent=1)
+    return report
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Builds a render-ready folder of links to the models, fixed .mtl files and textures.')
+    parser.add_argument('--obj_directory', type=str,
+                        help='The directory containing the .obj files.')
+    parser.add_argument('--texture_directory', type=str, default=None,
+                        help='The directory containing the textures (searched recursively), e.g. models-textures/textures.')
+    parser.add_argument('--mtl_folder', type=str, default=None,
+                        help='The folder of the fixed .mtl files written by fix_shapenetsem.py. Default is the .mtl files next to the .obj files.')
+    parser.add_argument('--output_folder', type=str,
+                        help='The staged folder, given to render_blender.py as the folder of the .obj files.')
+    parser.add_argument('--link', type=str, default='hard', choices=['hard', 'symbolic'],
+                        help='Hard links (same file system only) or symbolic links. Default is hard.')
+    parser.add_argument('--max_workers', type=int, default=None,
+                        help='The number of processes reading the .obj and .mtl files. Default is the number of cores.')
+    args = parser.parse_args()
+
+    start = time.time()
+    report = stage_models(args.obj_directory, args.output_folder, args.texture_directory, args.mtl_folder, args.link, args.max_workers)
+    print('{} models staged in {:.1f} s: {} links created, {} already linked'.format(
+        report['models'], time.time() - start, report['links_created'], report['links_existing']))
+    print('{} texture references to {} textures ({} shared by several models): {:.1f} MB linked, {:.1f} MB in the texture directory'.format(
+        report['texture_references'], report['textures'], report['shared_textures'], report['texture_size'] / 1024**2,
+        report['texture_directory_size'] / 1024**2))
+    for texture, count in report['most_shared'][:5]:
+        print('    {} is used by {} models'.format(texture, count))
+    if report['missing_textures']:
+        print('{} textures are missing (listed in {})'.format(len(report['missing_textures']), os.path.join(args.output_folder, REPORT_FILENAME)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import numpy as np
+
+import benchmark, rgbd_io
+
+def write_render(folder, rgb_value, depth_value):
+    (folder / 'sphere').mkdir(parents=True)
+    rgba = np.zeros((8, 8, 4), dtype=np.uint8)
+    rgba[2:6, 2:6] = (rgb_value, rgb_value, rgb_value, 255)
+    rgbd_io.write_png(str(folder / 'sphere' / 'sphere_r_000.png'), rgba)
+    depth = np.zeros((8, 8), dtype=np.float32)
+    depth[2:6, 2:6] = depth_value
+    rgbd_io.write_depth(str(folder / 'sphere' / 'sphere_r_000_depth0001.exr'), depth)
+
+def test_render_error(tmp_path):
+    write_render(tmp_path / 'fast', 100, 2.002)
+    write_render(tmp_path / 'reference', 110, 2.0)
+    error = benchmark.render_error(str(tmp_path / 'fast'), str(tmp_path / 'reference'))
+    assert error['rgb'] == 10.0
+    assert abs(error['depth'] - 0.002) < 1e-6
+    assert benchmark.render_error(str(tmp_path / 'missing'), str(tmp_path / 'reference')) is None
+
+def test_profile_table():
+    results = {'environment': {'platform': 'Linux', 'cpu_count': 8, 'blender': 'Blender 2.90.0'}, 'results': [
+        {'benchmark': 'render', 'params': {'engine': 'CYCLES'}, 'view_seconds': {'p50': 2.0, 'p95': 2.5}},
+        {'benchmark': 'render', 'params': {'engine': 'CYCLES', 'profile': 'fast'}, 'view_seconds': {'p50': 0.5, 'p95': 0.7},
+         'error': {'rgb': 3.25, 'depth': 0.0004}},
+        {'benchmark': 'depth', 'params': {'faces': 1000}}]}
+    lines = benchmark.profile_table(results).splitlines()
+    assert lines[0] == 'Measured on Linux (8 cores), Blender 2.90.0'
+    assert lines[4] == '| CYCLES | `default` | 2.000 | 2.500 | - | - |'
+    assert lines[5] == '| CYCLES | `fast` | 0.500 | 0.700 | 3.25 | 0.40 |'
+    assert benchmark.profile_table({'environment': {}, 'results': []}) is None
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+import generate_commands
+
+def make_manifest(costs):
+    return pd.DataFrame({'obj': ['/models/{:03d}.obj'.format(i) for i in range(len(costs))], 'cost': costs,
+                         'up': '0\\,0\\,1', 'front': '0\\,-1\\,0', 'aligned_dims': None, 'unit': 1.0})
+
+def test_assign_shards_balances_costs():
+    manifest = make_manifest([10, 9, 8, 7, 6, 5, 4, 3, 2, 1])
+    shards = generate_commands.assign_shards(manifest, 3)
+    loads = manifest.groupby(shards)['cost'].sum()
+    assert sorted(loads.index) == [0, 1, 2]
+    assert loads.max() - loads.min() <= 1
+
+def test_assign_shards_spreads_models_of_unknown_cost():
+    # Without the .obj files every cost is 0, and the models must still be split evenly
+    shards = generate_commands.assign_shards(make_manifest([0] * 240), 3)
+    assert shards.value_counts().sort_index().tolist() == [80, 80, 80]
+
+def test_assign_shards_is_deterministic():
+    manifest = make_manifest([5, 5, 5, 1, 1, 0, 0])
+    shuffled = manifest.sample(frac=1, random_state=0)
+    shards = generate_commands.assign_shards(manifest, 2)
+    assert (generate_commands.assign_shards(shuffled, 2)[manifest.index] == shards).all()
+
+def test_parse_vectors():
+    column = pd.Series(['0\\,0\\,1', None, '1,0.5,-2'], dtype=object, name='up')
+    assert generate_commands.parse_vectors(column).tolist() == [[0.0, 0.0, 1.0], None, [1.0, 0.5, -2.0]]
+
+def test_parse_vectors_rejects_wrong_lengths():
+    column = pd.Series(['0\\,0\\,1', '0\\,1'], dtype=object, name='up')
+    with pytest.raises(ValueError, match=r"up of row 1 \(b.obj\) has 2 components"):
+        generate_commands.parse_vectors(column, pd.Series(['a.obj', 'b.obj']))
+
+def test_to_jsonl_leaves_out_missing_values():
+    lines = generate_commands.to_jsonl(make_manifest([1]).assign(output_folder='/out'))
+    assert '"aligned_dims"' not in lines[0] and '"up": [0.0, 0.0, 1.0]' in lines[0]
@@ -0,0 +1,31 @@
+import pytest
+
+import index_metadata
+
+@pytest.mark.parametrize('statement, filename', [
+    ('map_Kd wood.jpg', 'wood.jpg'),
+    ('map_Kd  my texture.png  ', 'my texture.png'),
+    ('map_Kd -s 1 1 1 wood.jpg', 'wood.jpg'),
+    ('map_Kd -o 0 0 0 -s 2 2 1 wood.jpg', 'wood.jpg'),
+    ('map_Kd -s 2 wood.jpg', 'wood.jpg'),
+    ('map_Kd -o 0.5 0.5 wood.jpg', 'wood.jpg'),
+    ('map_Kd -mm 0 1 -clamp on wood.jpg', 'wood.jpg'),
+    ('map_Kd -blendu off -blendv off -imfchan r wood.jpg', 'wood.jpg'),
+    ('bump -bm 0.5 -t 0.1 0.1 0 bump.png', 'bump.png'),
+    ('refl -type sphere sky.png', 'sky.png'),
+    ('map_Kd -s 1 1 1 2.jpg', '2.jpg'),
+    ('  map_d textures\\alpha.png', 'textures\\alpha.png'),
+])
+def test_mtl_textures_skips_the_options(statement, filename):
+    assert index_metadata.mtl_textures(b'newmtl a\nKd 1 1 1\n' + statement.encode() + b'\n') == [filename]
+
+def test_mtl_textures_every_map():
+    mtl = b'newmtl a\r\nmap_Kd a.jpg\r\nmap_Ka -s 1 1 1 a.jpg\r\nnewmtl b\nbump b.png\nKs 0 0 0\n'
+    assert index_metadata.mtl_textures(mtl) == ['a.jpg', 'a.jpg', 'b.png']
+
+def test_obj_statistics(tmp_path):
+    (tmp_path / 'model.mtl').write_bytes(b'newmtl a\r\nmap_Kd -s 1 1 1 Wood.JPG\r\nnewmtl b\r\nmap_Kd wood.jpg\r\nbump b.png\r\n')
+    (tmp_path / 'model.obj').write_bytes(b'mtllib model.mtl\r\nv 0 0 0\r\nv 1 0 0\r\nv 0 1 0\r\nv 1 1 0\r\nf 1 2 3\r\nf 2 4 3\r\n')
+    statistics = index_metadata.obj_statistics(str(tmp_path / 'model.obj'))
+    assert (statistics['vertices'], statistics['faces'], statistics['textures']) == (4, 2, 2)
+    assert index_metadata.obj_statistics(str(tmp_path / 'missing.obj')) is None
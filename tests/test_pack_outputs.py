@@ -0,0 +1,28 @@
+import io, json, tarfile
+
+import pytest
+
+import pack_outputs
+
+@pytest.mark.parametrize('name, key, extension', [
+    ('1a2b_r_000.png', '1a2b_r_000', 'png'),
+    ('1a2b_r_000.depth.exr', '1a2b_r_000', 'depth.exr'),
+    ('1a2b_r_000.depth.png', '1a2b_r_000', 'depth.png'),
+    ('model.v2_r_000.json', 'model.v2_r_000', 'json'),
+    ('model.v2_r_000.depth.png', 'model.v2_r_000', 'depth.png'),
+    ('model.v2_r_000.txt', 'model.v2_r_000', 'txt'),
+])
+def test_split_member_name(name, key, extension):
+    assert pack_outputs.split_member_name(name) == (key, extension)
+
+def test_iter_samples_from_tar(tmp_path):
+    with tarfile.open(str(tmp_path / 'shard.tar'), 'w') as tar:
+        for view in ('_r_000', '_r_045'):
+            metadata = {'model': 'model.v2', 'view': view, 'K': [[1, 0, 0], [0, 1, 0], [0, 0, 1]], 'camera_to_world': [[1]]}
+            for extension, data in (('png', b'rgb' + view.encode()), ('depth.png', b'depth'), ('json', json.dumps(metadata).encode())):
+                info = tarfile.TarInfo('model.v2{}.{}'.format(view, extension))
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+    samples = list(pack_outputs.iter_samples([str(tmp_path / 'shard.tar')]))
+    assert [sample['key'] for sample in samples] == ['model.v2_r_000', 'model.v2_r_045']
+    assert samples[1]['rgb'] == b'rgb_r_045' and samples[1]['depth'] == b'depth'
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import render_blender_parallel
+
+def command(tmp_path, name):
+    return 'blender --background --python render_blender.py -- --output_folder {} --views 2 /models/{}.obj'.format(tmp_path / 'out', name)
+
+def write_commands(tmp_path, commands):
+    commands_file = tmp_path / 'commands.txt'
+    commands_file.write_text(''.join(command + '\n' for command in commands))
+    return str(commands_file)
+
+def test_ledger_last_record_wins(tmp_path):
+    ledger = render_blender_parallel.Ledger(str(tmp_path / 'ledger.jsonl'))
+    ledger.update('a', status='running', attempts=1)
+    ledger.update('a', status='failed')
+    ledger.close()
+    # A crash may leave a truncated last line
+    with open(tmp_path / 'ledger.jsonl', 'a') as file:
+        file.write('{"command": "a", "sta')
+    ledger = render_blender_parallel.Ledger(str(tmp_path / 'ledger.jsonl'))
+    assert ledger.get('a')['status'] == 'failed' and ledger.get('a')['attempts'] == 1
+    ledger.close()
+    assert len((tmp_path / 'ledger.jsonl').read_text().splitlines()) == 1
+
+def test_select_commands(tmp_path):
+    commands = [command(tmp_path, name) for name in ('new', 'retry', 'given_up', 'done')]
+    ledger = render_blender_parallel.Ledger(str(tmp_path / 'ledger.jsonl'))
+    ledger.update(commands[1], status='failed', attempts=1)
+    ledger.update(commands[2], status='failed', attempts=3)
+    ledger.update(commands[3], status='done', attempts=1, packed=True)
+    pending, skipped, given_up = render_blender_parallel.select_commands(commands, ledger, max_attempts=3)
+    assert pending == commands[:2] and skipped == 1 and given_up == 1
+
+    pending, skipped, given_up = render_blender_parallel.select_commands(commands, ledger, max_attempts=3, retry_failed=True)
+    assert pending == commands[:3] and skipped == 1 and given_up == 0
+    assert ledger.get(commands[2])['attempts'] == 0
+    ledger.close()
+
+def test_select_commands_marks_complete_outputs_done(tmp_path):
+    commands = [command(tmp_path, 'model')]
+    for filepath in render_blender_parallel.expected_outputs(commands[0]):
+        magic = render_blender_parallel.PNG_SIGNATURE if filepath.endswith('.png') else render_blender_parallel.EXR_MAGIC
+        (tmp_path / 'out' / 'model').mkdir(parents=True, exist_ok=True)
+        with open(filepath, 'wb') as file:
+            file.write(magic + b'\x00')
+    ledger = render_blender_parallel.Ledger(str(tmp_path / 'ledger.jsonl'))
+    assert render_blender_parallel.select_commands(commands, ledger, max_attempts=3) == ([], 1, 0)
+    assert ledger.get(commands[0])['status'] == 'done'
+    ledger.close()
+
+def test_resumed_run_with_given_up_commands_fails(tmp_path):
+    commands_file = write_commands(tmp_path, [command(tmp_path, 'broken')])
+    with open(commands_file + '.ledger.jsonl', 'w') as file:
+        file.write(json.dumps({'command': command(tmp_path, 'broken'), 'status': 'failed', 'attempts': 3}) + '\n')
+    assert not render_blender_parallel.execute_commands_in_parallel(commands_file, max_workers=1, max_attempts=3,
+                                                                    memory_budget=1024**3)
+
+def test_report_without_stats(tmp_path, monkeypatch, capsys):
+    commands_file = write_commands(tmp_path, [command(tmp_path, 'model')])
+    monkeypatch.setattr('sys.argv', ['render_blender_parallel.py', '--file', commands_file, '--report'])
+    with pytest.raises(SystemExit) as exit_info:
+        render_blender_parallel.main()
+    assert exit_info.value.code == 1
+    assert 'No stats recorded' in capsys.readouterr().out
+
+def test_run_report():
+    records = [{'status': 'done', 'start': 0.0, 'duration': 10.0, 'phases': {'import': 2.0, 'render': 6.0}, 'views': [0.5] * 12,
+                'obj': 'a.obj', 'faces': 1000},
+               {'status': 'done', 'start': 5.0, 'duration': 20.0, 'phases': {'import': 4.0, 'render': 14.0}, 'views': [1.0] * 14,
+                'obj': 'b.obj', 'faces': 5000},
+               {'status': 'failed', 'start': 25.0, 'duration': 5.0, 'obj': 'c.obj'}]
+    report = render_blender_parallel.run_report(records)
+    assert report['done'] == 2 and report['failed'] == 1 and report['elapsed'] == 30.0
+    assert report['phases']['import']['p50'] == 2.0 and report['phases']['import']['p95'] == 4.0
+    assert report['profiles']['default']['views'] == 26
+    assert [record['duration'] for record in report['slowest']] == [20.0, 10.0]
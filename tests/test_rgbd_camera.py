@@ -0,0 +1,41 @@
+import numpy as np
+
+import rgbd_camera
+
+K = rgbd_camera.intrinsics_matrix(588.0, 588.0, 320.0, 240.0)
+
+def test_projection_factor_matches_pixel_rays():
+    # Both go through the pixel centers, so the factor is the inverse length of the ray at plane depth 1
+    rays = rgbd_camera.pixel_rays(640, 480, K)
+    factors = rgbd_camera.projection_factor_map(640, 480, 588.0, 588.0, 320.0, 240.0)
+    np.testing.assert_allclose(factors, 1.0 / np.linalg.norm(rays, axis=2), rtol=1e-6)
+    # The optical axis is at the corner shared by the 4 central pixels
+    assert rays[239, 319, 0] < 0 < rays[240, 320, 0] and rays[240, 320, 1] < 0 < rays[239, 319, 1]
+    np.testing.assert_allclose(factors[239:241, 319:321], factors[239, 319])
+
+def test_cycles_depth_back_projects_to_the_point():
+    # A point seen through the center of a pixel: Cycles renders its distance to the camera center, the compositor
+    # multiplies it by the projection factor, and depth_to_points must give the point back
+    rays = rgbd_camera.pixel_rays(640, 480, K)
+    point = rays[100, 500] * 2.5
+    depth = np.zeros((480, 640), dtype=np.float32)
+    depth[100, 500] = np.linalg.norm(point) * rgbd_camera.projection_factor_map(640, 480, 588.0, 588.0, 320.0, 240.0)[100, 500]
+    points, mask = rgbd_camera.depth_to_points(depth, rays)
+    assert mask.sum() == 1 and mask[100, 500]
+    np.testing.assert_allclose(points[0], point, rtol=1e-5)
+
+def test_projection_factor_rgba_rows_start_at_the_bottom():
+    rgba = rgbd_camera.projection_factor_rgba(64, 48, 60.0, 60.0, 32.0, 24.0, 'CYCLES').reshape(48, 64, 4)
+    factors = rgbd_camera.projection_factor_map(64, 48, 60.0, 60.0, 32.0, 24.0)
+    np.testing.assert_allclose(rgba[:, :, 0], factors[::-1], rtol=1e-6)
+    assert np.all(rgbd_camera.projection_factor_rgba(64, 48, 60.0, 60.0, 32.0, 24.0, 'BLENDER_EEVEE') == 1.0)
+
+def test_depth_to_points_world_frame():
+    rays = rgbd_camera.pixel_rays(4, 3, rgbd_camera.intrinsics_matrix(2.0, 2.0, 2.0, 1.5))
+    depth = np.full((3, 4), 2.0, dtype=np.float32)
+    depth[0, 0] = 0.0
+    camera_to_world = np.eye(4)
+    camera_to_world[:3, 3] = (1.0, 2.0, 3.0)
+    points, mask = rgbd_camera.depth_to_points(depth, rays, camera_to_world)
+    assert mask.sum() == 11
+    np.testing.assert_allclose(points[:, 2], 1.0)
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import rgbd_io
+
+def depth_map(height=37, width=53):
+    # Smooth depth in meters with a hole, like a rendered model
+    y, x = np.mgrid[0:height, 0:width]
+    depth = (1.0 + 0.01 * x + 0.02 * y).astype(np.float32)
+    depth[:5, :7] = 0.0
+    return depth
+
+@pytest.mark.parametrize('compression', ['NONE', 'ZIPS', 'ZIP'])
+@pytest.mark.parametrize('depth_format', ['exr', 'exr_rgb'])
+def test_exr_depth_round_trip(tmp_path, compression, depth_format):
+    depth = depth_map()
+    filepath = str(tmp_path / 'depth.exr')
+    rgbd_io.write_depth(filepath, depth, depth_format, compression)
+    np.testing.assert_array_equal(rgbd_io.read_depth(filepath), depth)
+    with open(filepath, 'rb') as file:
+        data = file.read()
+    np.testing.assert_array_equal(rgbd_io.decode_depth(data, stride=4), depth[::4, ::4])
+
+def test_exr_half_error(tmp_path):
+    depth = depth_map() * 5
+    filepath = str(tmp_path / 'depth.exr')
+    rgbd_io.write_depth(filepath, depth, 'exr', 'ZIP', half=True)
+    assert np.all(np.abs(rgbd_io.read_depth(filepath) - depth) <= depth * 2.0**-11)
+
+def test_exr_channels(tmp_path):
+    channels = {'R': np.ones((3, 4), dtype=np.float32), 'A': np.arange(12, dtype=np.float32).reshape(3, 4)}
+    rgbd_io.write_exr(str(tmp_path / 'image.exr'), channels)
+    read = rgbd_io.read_exr(str(tmp_path / 'image.exr'))
+    assert sorted(read) == ['A', 'R']
+    np.testing.assert_array_equal(read['A'], channels['A'])
+
+def test_png16_depth_round_trip(tmp_path):
+    depth = depth_map()
+    filepath = str(tmp_path / 'depth.png')
+    rgbd_io.write_depth(filepath, depth, 'png16', invalid_value=65535)
+    read = rgbd_io.read_depth(filepath, invalid_value=65535)
+    assert np.all(read[depth == 0] == 0)
+    assert np.abs(read - depth).max() <= 0.0005 + 1e-6
+    assert rgbd_io.read_png(filepath)[0, 0] == 65535
+
+@pytest.mark.parametrize('shape, dtype', [((9, 7), np.uint16), ((9, 7, 3), np.uint8), ((9, 7, 4), np.uint16)])
+def test_png_round_trip(tmp_path, shape, dtype):
+    pixels = np.random.default_rng(0).integers(0, np.iinfo(dtype).max, size=shape, dtype=dtype)
+    rgbd_io.write_png(str(tmp_path / 'image.png'), pixels)
+    read = rgbd_io.read_png(str(tmp_path / 'image.png'))
+    assert read.dtype == dtype
+    np.testing.assert_array_equal(read, pixels)
+
+def test_unfilter_scanlines_every_filter():
+    # One scanline per filter type (None, Sub, Up, Average, Paeth), checked against a direct implementation
+    rng = np.random.default_rng(1)
+    height, stride, bytes_per_pixel = 5, 12, 3
+    raw = rng.integers(0, 256, size=(height, stride), dtype=np.uint8)
+    filtered = bytearray()
+    previous = np.zeros(stride, dtype=np.int64)
+    for y in range(height):
+        line = raw[y].astype(np.int64)
+        encoded = []
+        for x in range(stride):
+            left = line[x - bytes_per_pixel] if x >= bytes_per_pixel else 0
+            up_left = previous[x - bytes_per_pixel] if x >= bytes_per_pixel else 0
+            predictor = [0, left, previous[x], (left + previous[x]) >> 1, rgbd_io.paeth(left, previous[x], up_left)][y]
+            encoded.append((line[x] - predictor) & 0xff)
+        filtered += bytes([y] + encoded)
+        previous = line
+    np.testing.assert_array_equal(rgbd_io.unfilter_scanlines(bytes(filtered), height, stride, bytes_per_pixel), raw)
+
+def test_ply_round_trip(tmp_path):
+    points = np.random.default_rng(2).normal(size=(10, 3)).astype(np.float32)
+    colors = np.arange(30, dtype=np.uint8).reshape(10, 3)
+    rgbd_io.write_ply(str(tmp_path / 'cloud.ply'), points, colors)
+    read_points, read_colors = rgbd_io.read_ply(str(tmp_path / 'cloud.ply'))
+    np.testing.assert_array_equal(read_points, points)
+    np.testing.assert_array_equal(read_colors, colors)